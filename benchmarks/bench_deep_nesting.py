@@ -0,0 +1,62 @@
+"""
+Stress benchmark for deeply nested expressions.
+
+Parses and evaluates nested groupings and long left-deep `+` chains with the
+explicit-stack StackParser and StackInterpreter. The recursive Parser and
+Interpreter are run on the same inputs for comparison where they fit inside
+the recursion limit.
+
+Usage: python3 benchmarks/bench_deep_nesting.py [depth ...]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import lox
+
+
+def nested_groupings(depth):
+    return "(" * depth + "1" + ")" * depth
+
+
+def left_deep_chain(depth):
+    return " + ".join(["1"] * depth)
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench(name, text, parser_class, interpreter_class):
+    tokens, scan_time = time_call(lox.Scanner.scan_str, text)
+    try:
+        expr, parse_time = time_call(parser_class(tokens).expression)
+        value, eval_time = time_call(interpreter_class().evaluate, expr)
+    except RecursionError:
+        print(f"  {name:<28} {interpreter_class.__name__:<17} RecursionError")
+        return
+
+    print(
+        f"  {name:<28} {interpreter_class.__name__:<17} "
+        f"scan {scan_time:8.3f}s  parse {parse_time:8.3f}s  "
+        f"evaluate {eval_time:8.3f}s  = {value}"
+    )
+
+
+def main(args):
+    depths = [int(arg) for arg in args] or [1_000, 100_000, 1_000_000]
+    for depth in depths:
+        print(f"depth {depth}")
+        for name, text in [
+            ("nested groupings", nested_groupings(depth)),
+            ("left-deep + chain", left_deep_chain(depth)),
+        ]:
+            bench(name, text, lox.StackParser, lox.StackInterpreter)
+            bench(name, text, lox.Parser, lox.Interpreter)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,64 @@
+"""
+Micro-benchmarks for formulas over columns.
+
+Evaluates an arithmetic formula and a string formula over columns of rows,
+once by interpreting the expression for each row and once with
+Formula.evaluate.
+
+Usage: python3 benchmarks/bench_formula.py [rows]
+"""
+import random
+import sys
+import time
+from array import array
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import lox
+
+
+ARITHMETIC = "(price * quantity - discount) / 100 > 5"
+STRING = 'name + ": " + unit'
+
+
+def per_row(source, columns):
+    interpreter = lox.Interpreter()
+    expression = lox.Formula.parse(source, interpreter).expression
+    globals_ = interpreter.globals
+    symbols = [lox.symbols.intern(name) for name in columns]
+    results = []
+    for row in zip(*columns.values()):
+        interpreter.environment = lox.Environment(globals_, dict(zip(symbols, row)))
+        results.append(interpreter.evaluate(expression))
+    return results
+
+
+def bench(name, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"  {name:<28} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main(args):
+    n = int(args[0]) if args else 200_000
+    rng = random.Random(0)
+    numbers = {
+        "price": array("d", (rng.uniform(1, 100) for _ in range(n))),
+        "quantity": [float(rng.randint(1, 10)) for _ in range(n)],
+        "discount": array("d", (rng.uniform(0, 50) for _ in range(n))),
+    }
+    strings = {
+        "name": [f"item{i}" for i in range(n)],
+        "unit": [rng.choice(["kg", "each", "box"]) for _ in range(n)],
+    }
+    formula = lox.Formula.parse(ARITHMETIC)
+    expected = bench(f"arithmetic per row ({n})", lambda: per_row(ARITHMETIC, numbers))
+    assert bench("arithmetic, columns", lambda: formula.evaluate(numbers)) == expected
+    formula = lox.Formula.parse(STRING)
+    expected = bench(f"string per row ({n})", lambda: per_row(STRING, strings))
+    assert bench("string, columns", lambda: formula.evaluate(strings)) == expected
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,49 @@
+"""
+Benchmark for function calls.
+
+Runs recursive fib, which is dominated by non-tail calls, and a
+tail-recursive counting loop, which runs in constant Python stack however
+many iterations it's given.
+
+Usage: python3 benchmarks/bench_functions.py [fib n] [loop iterations]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import lox
+
+
+FIB = """
+fun fib(n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+}
+print fib(%d);
+"""
+
+LOOP = """
+fun loop(n, total) {
+    if (n < 1) return total;
+    return loop(n - 1, total + n);
+}
+print loop(%d, 0);
+"""
+
+
+def bench(name, source):
+    start = time.perf_counter()
+    lox.Lox().run(source)
+    print(f"  {name:<28} {time.perf_counter() - start:8.3f}s")
+
+
+def main(args):
+    n = int(args[0]) if args else 22
+    iterations = int(args[1]) if len(args) > 1 else 200_000
+    bench(f"fib({n})", FIB % n)
+    bench(f"tail loop({iterations})", LOOP % iterations)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
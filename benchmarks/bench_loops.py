@@ -0,0 +1,67 @@
+"""
+Micro-benchmarks for loops.
+
+Runs a counting loop, nested loops and a loop accumulating into a string,
+each as a whole Lox program timed from outside, and then again with the
+operators specialized by type inference.
+
+Usage: python3 benchmarks/bench_loops.py [iterations]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import lox
+
+
+COUNT = """
+var total = 0;
+for (var i = 0; i < %(n)d; i = i + 1) {
+    total = total + i;
+}
+print total;
+"""
+
+NESTED = """
+var total = 0;
+var i = 0;
+while (i < %(root)d) {
+    var j = 0;
+    while (j < %(root)d) {
+        total = total + i * j;
+        j = j + 1;
+    }
+    i = i + 1;
+}
+print total;
+"""
+
+STRING = """
+var text = "";
+for (var i = 0; i < %(n)d; i = i + 1) {
+    text = text + "x";
+}
+print len(text);
+"""
+
+
+def bench(name, source, optimize=False):
+    start = time.perf_counter()
+    lox.Lox(optimize=optimize).run(source)
+    print(f"  {name:<28} {time.perf_counter() - start:8.3f}s")
+
+
+def main(args):
+    n = int(args[0]) if args else 200_000
+    values = {"n": n, "root": int(n ** 0.5)}
+    bench(f"counting loop ({n})", COUNT % values)
+    bench(f"nested loops ({values['root']}^2)", NESTED % values)
+    bench(f"string accumulate ({n})", STRING % values)
+    bench("counting loop, optimized", COUNT % values, optimize=True)
+    bench("nested loops, optimized", NESTED % values, optimize=True)
+    bench("string accumulate, optimized", STRING % values, optimize=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,57 @@
+"""
+Micro-benchmarks for parsing.
+
+Parses the same generated script from a list of Token and from the
+TokenBuffer that BufferScanner fills, with each parser. Looking ahead in a
+buffer reads the kind column directly, so parsing one shouldn't cost much
+more than parsing a list; the run fails if it does.
+
+Usage: python3 benchmarks/bench_parse.py [copies]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import lox
+
+
+CHUNK = """
+var total = 0;
+fun add(a, b) { return a + b * 2 - (a / b); }
+for (var i = 0; i < 10; i = i + 1) {
+    if (i > 5) total = add(total, i); else print "skip " + (-i);
+}
+class Point { init(x, y) { this.x = x; this.y = y; } sum() { return this.x + this.y; } }
+print Point(1, 2).sum() >= total;
+"""
+
+# How much slower parsing a TokenBuffer may be than parsing a list of Token.
+# Compiled, reading the list gets much faster while building the Tokens that
+# go into the AST doesn't, so the buffer is allowed further behind.
+MAX_RATIO = 3.5 if lox.COMPILED else 2.0
+
+
+def time_parse(parser_class, tokens):
+    start = time.perf_counter()
+    parser_class(tokens).parse()
+    return time.perf_counter() - start
+
+
+def main(args):
+    copies = int(args[0]) if args else 2_000
+    source = CHUNK * copies
+    tokens = lox.Scanner.scan_str(source)
+    buffer = lox.BufferScanner.scan_str(source)
+    for parser_class in (lox.Parser, lox.PrattParser, lox.StackParser):
+        list_time = time_parse(parser_class, tokens)
+        buffer_time = time_parse(parser_class, buffer)
+        name = f"{parser_class.__name__} ({len(tokens)} tokens)"
+        print(f"  {name:<28} list {list_time:8.3f}s  buffer {buffer_time:8.3f}s")
+        assert buffer_time < list_time * MAX_RATIO, (
+            f"parsing a TokenBuffer took {buffer_time / list_time:.1f}x as long as a list"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,49 @@
+"""
+Micro-benchmarks for green threads.
+
+Spawns a worker per green thread that receives a value from a shared
+channel, and sends back its square on another, with the main program
+feeding and draining them, so the turn moves between every green thread.
+
+Usage: python3 benchmarks/bench_threads.py [threads]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import lox
+
+
+FAN_OUT = """
+var jobs = channel(1);
+var results = channel(1);
+fun worker() {
+    var job = receive(jobs);
+    send(results, job * job);
+}
+for (var i = 0; i < %(n)d; i = i + 1) spawn(worker);
+fun feed() {
+    for (var i = 0; i < %(n)d; i = i + 1) send(jobs, i);
+}
+spawn(feed);
+var total = 0;
+for (var i = 0; i < %(n)d; i = i + 1) total = total + receive(results);
+print total;
+"""
+
+
+def bench(name, source):
+    start = time.perf_counter()
+    lox.Lox().run(source)
+    print(f"  {name:<28} {time.perf_counter() - start:8.3f}s")
+
+
+def main(args):
+    sizes = [int(args[0])] if args else [50, 200, 1000, 5000]
+    for n in sizes:
+        bench(f"fan out ({n} threads)", FAN_OUT % {"n": n})
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,14 +1,96 @@
 from __future__ import annotations
 
+import asyncio
+import copy
+import hashlib
+import inspect
+import io
+import json
+import math
+import os
+import pickle
+# What pickle's classes come from, which mypyc needs imported to subclass them
+import _pickle
+import queue
+import struct
 import sys
-from dataclasses import dataclass, field
+import tempfile
+import threading
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, fields, is_dataclass
+from enum import IntEnum
+from functools import lru_cache, partial
+from itertools import accumulate, repeat
+from operator import add, eq, ge, gt, le, lt, mul, ne, neg, not_, sub, truediv
 from pathlib import Path
-from typing import *
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Any, Callable, Iterable, Iterator, Optional, Union, get_args
+
+try:
+    import numpy  # type: ignore[import-not-found]
+except ImportError:
+    numpy = None  # type: ignore[assignment]
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where Coverage.write goes without a lock
+    fcntl = None  # type: ignore[assignment]
+
+try:
+    from mypy_extensions import mypyc_attr
+except ImportError:
+    def mypyc_attr(*attrs: str, **kwattrs: Any) -> Callable:  # type: ignore[misc]
+        return lambda cls: cls
+
+# Whether this module was compiled with mypyc (`make compile`), in which case
+# the extension module is imported instead of this file
+COMPILED = not __file__.endswith(".py")
 
 class ParseError(Exception):
     pass
 
 
+class BudgetExceeded(Exception):
+    pass
+
+
+class NativeError(Exception):
+    pass
+
+
+class ImageError(Exception):
+    pass
+
+
+class FormulaError(Exception):
+    """
+    Raised by Formula.evaluate when the formula fails on any rows, with the
+    message for each of them by row index, and the values of the rest, which
+    are None where they failed.
+    """
+
+    def __init__(self, message: str, errors: dict[int, str], values: list):
+        super().__init__(message)
+        self.errors = errors
+        self.values = values
+
+
+class Cancelled(BaseException):
+    """
+    Raised in a green thread that's still running when the program ends, so
+    that its thread unwinds. A BaseException, like KeyboardInterrupt, so the
+    interpreter's handlers for runtime errors let it through.
+    """
+
+
 @dataclass
 class LeftParen:
     pass
@@ -28,6 +110,16 @@ class RightBrace:
     pass
 
 
+@dataclass
+class LeftBracket:
+    pass
+
+
+@dataclass
+class RightBracket:
+    pass
+
+
 @dataclass
 class Comma:
     pass
@@ -197,6 +289,11 @@ class WhileToken:
     pass
 
 
+@dataclass
+class ImportToken:
+    pass
+
+
 @dataclass
 class EndOfFile:
     pass
@@ -208,6 +305,8 @@ TokenType = Union[
     RightParen,
     LeftBrace,
     RightBrace,
+    LeftBracket,
+    RightBracket,
     Comma,
     Dot,
     Minus,
@@ -242,23 +341,90 @@ TokenType = Union[
     ThisToken,
     VarToken,
     WhileToken,
+    ImportToken,
     EndOfFile,
 ]
 
 @dataclass
 class Token:
     token_type: TokenType
-    lexeme: str = field(default=None, compare=False)
+    lexeme: str = field(default="", compare=False)
     literal: Any = field(default=None)
     line: int = field(default=-1, compare=False)
+    # Interned id of an identifier's name, see SymbolTable
+    symbol: Optional[int] = field(default=None, compare=False)
 
     def __str__(self):
-        return f"{self.token_type} {lexeme} {literal}"
+        return f"{self.token_type} {self.lexeme} {self.literal}"
 
 
 Operator = Union[DoubleEqual, BangEqual]
 
 
+# Keyword token types are stateless, so the same instances can be shared by
+# every token rather than being rebuilt for each identifier scanned.
+KEYWORDS: dict[str, TokenType] = {
+    "and": AndToken(),
+    "class": ClassToken(),
+    "else": ElseToken(),
+    "false": FalseToken(),
+    "for": ForToken(),
+    "fun": FunToken(),
+    "if": IfToken(),
+    "nil": NilToken(),
+    "or": OrToken(),
+    "print": PrintToken(),
+    "return": ReturnToken(),
+    "super": SuperToken(),
+    "this": ThisToken(),
+    "true": TrueToken(),
+    "var": VarToken(),
+    "while": WhileToken(),
+    "import": ImportToken(),
+}
+
+
+@dataclass
+class SymbolTable:
+    """
+    Interns identifier names as small integer ids.
+
+    The scanner interns every identifier once, and the id is carried on its
+    Token through the AST into the Environment, so variable access hashes an
+    int rather than the name.
+    """
+    ids: dict[str, int] = field(default_factory=dict)
+    names: list[str] = field(default_factory=list)
+
+    def intern(self, name: str) -> int:
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return symbol
+
+    def name(self, symbol: int) -> str:
+        return self.names[symbol]
+
+
+symbols = SymbolTable()
+
+
+def symbol_of(name: Token) -> int:
+    """
+    The interned symbol of a name, which unlike other tokens always has one.
+    """
+    assert name.symbol is not None, f"{name.lexeme!r} is not a name"
+    return name.symbol
+
+# `this` and `super` are keywords, but are looked up like variables
+THIS = symbols.intern("this")
+SUPER = symbols.intern("super")
+INIT = symbols.intern("init")
+KEYWORD_SYMBOLS = {"this": THIS, "super": SUPER}
+THIS_TOKEN = Token(ThisToken(), "this", symbol=THIS)
+
+
 @dataclass
 class Expr:
     pass
@@ -282,6 +448,32 @@ class BinaryExpr(Expr):
     right: Expr
 
 
+@dataclass
+class TypedUnaryExpr(UnaryExpr):
+    """
+    A UnaryExpr whose operand TypeInference has proven to be of the one type
+    `function` applies to, so it's evaluated without checking.
+    """
+    function: Callable = field(default=neg, repr=False, compare=False)
+
+
+@dataclass
+class TypedBinaryExpr(BinaryExpr):
+    """
+    A BinaryExpr whose operands TypeInference has proven to be numbers, or
+    both of another type for equality, so it's evaluated by `function`
+    without matching on their types.
+    """
+    function: Callable = field(default=add, repr=False, compare=False)
+
+
+@dataclass
+class ConcatExpr(BinaryExpr):
+    """
+    A `+` whose operands TypeInference has proven to be strings.
+    """
+
+
 @dataclass
 class GroupingExpr(Expr):
     expression: Expr
@@ -298,14 +490,72 @@ class AssignExpr(Expr):
     value: Expr
 
 
+@dataclass
+class CallExpr(Expr):
+    callee: Expr
+    paren: Token
+    arguments: list[Expr]
+
+
+@dataclass
+class GetExpr(Expr):
+    object: Expr
+    name: Token
+    # Inline cache: the shape last seen here, and the field index (or -1)
+    # or method that name resolved to for it. Fields left out of __init__
+    # take their defaults from default_factory throughout, since mypyc
+    # doesn't set a plain default for them on its native classes.
+    shape: Optional[Shape] = field(default_factory=lambda: None, init=False, repr=False, compare=False)
+    index: int = field(default_factory=lambda: -1, init=False, repr=False, compare=False)
+    method: Optional[LoxFunction] = field(default_factory=lambda: None, init=False, repr=False, compare=False)
+
+
+@dataclass
+class SetExpr(Expr):
+    object: Expr
+    name: Token
+    value: Expr
+    # Inline cache: the shape last seen here, the field index, and the
+    # shape after setting it, which is the same shape unless it's a new field
+    shape: Optional[Shape] = field(default_factory=lambda: None, init=False, repr=False, compare=False)
+    index: int = field(default_factory=lambda: -1, init=False, repr=False, compare=False)
+    transition: Optional[Shape] = field(default_factory=lambda: None, init=False, repr=False, compare=False)
+
+
+@dataclass
+class ThisExpr(Expr):
+    keyword: Token
+
+
+@dataclass
+class SuperExpr(Expr):
+    keyword: Token
+    method: Token
+
+
+@dataclass
+class ArrayExpr(Expr):
+    bracket: Token
+    elements: list[Expr]
+
+
+@dataclass
+class IndexExpr(Expr):
+    array: Expr
+    bracket: Token
+    index: Expr
+
+
+@dataclass
 class Statement:
-    pass
+    # Line the statement starts on, which Debugger breakpoints refer to
+    line: int = field(default=0, kw_only=True, repr=False, compare=False)
 
 
 @dataclass
 class VariableStatement(Statement):
     name: Token
-    initializer: Expr
+    initializer: Optional[Expr]
 
 
 @dataclass
@@ -321,6 +571,306 @@ class PrintStatement(Statement):
 class BlockStatement(Statement):
     statements: list[Statement]
 
+    def __post_init__(self):
+        # Blocks that declare nothing don't need a scope of their own, and
+        # blocks in which nothing can capture the scope can have a recycled
+        # one, see Interpreter.block
+        self.declares = any(
+            isinstance(stmt, (VariableStatement, FunctionStatement, ClassStatement))
+            for stmt in self.statements
+        )
+        self.captures = self.declares and declares_closure(self.statements)
+        if self.captures:
+            # Mark the names functions here use that the block declares, see
+            # FunctionStatement.late. Blocks in a function are walked again
+            # with the function's own scope.
+            walk_scopes(self.statements, set())
+
+
+@dataclass
+class IfStatement(Statement):
+    condition: Expr
+    then_branch: Statement
+    else_branch: Optional[Statement]
+
+
+@dataclass
+class WhileStatement(Statement):
+    condition: Expr
+    body: Statement
+    # Evaluated after the body each iteration, from a desugared for loop
+    increment: Optional[Expr] = None
+
+    def __post_init__(self):
+        # Worked out once here rather than on every iteration: the body's
+        # statements, and how to scope them. Bodies that declare nothing run
+        # in the loop's own environment. Bodies whose declarations can't be
+        # captured by a closure reuse one environment, cleared each
+        # iteration, and only the rest get a new environment per iteration.
+        if isinstance(self.body, BlockStatement):
+            self.body_statements = self.body.statements
+            self.declares = self.body.declares
+            self.captures = self.body.captures
+        else:
+            self.body_statements = [self.body]
+            self.declares = self.captures = False
+
+
+@dataclass
+class FunctionStatement(Statement):
+    name: Token
+    params: list[Token]
+    body: list[Statement]
+
+    def __post_init__(self) -> None:
+        # Symbols of the free variables that an enclosing local scope
+        # declares, maybe only after the function, see Interpreter.closure.
+        # Filled in as the enclosing function or block is parsed.
+        self.late: set[Optional[int]] = set()
+        # The variables the function closes over, see Interpreter.closure
+        self.free = free_variables(self)
+
+
+@dataclass
+class ReturnStatement(Statement):
+    keyword: Token
+    value: Optional[Expr]
+
+
+@dataclass
+class ClassStatement(Statement):
+    name: Token
+    superclass: Optional[VariableExpr]
+    methods: list[FunctionStatement]
+
+
+@dataclass
+class ImportStatement(Statement):
+    keyword: Token
+    name: Token
+    # File the import is in, which the name is relative to, or None for
+    # source that isn't from a file
+    origin: Optional[Path] = None
+
+
+@dataclass
+class BreakpointStatement(Statement):
+    """
+    Stands in for a statement on a line with a breakpoint, see Debugger.
+    """
+    statement: Statement
+    debugger: Debugger
+
+
+@dataclass
+class CoverageStatement(Statement):
+    """
+    Stands in for a statement whose line hasn't been executed yet, until it
+    is, see Coverage. It's held at `key` in `container`, to put the statement
+    back there.
+    """
+    statement: Statement
+    hits: bytearray = field(repr=False, compare=False)
+    container: Any = field(repr=False, compare=False)
+    key: Any = field(repr=False, compare=False)
+
+
+# Statements that stand in for another, which they hold as `statement`
+WRAPPER_STATEMENTS = (BreakpointStatement, CoverageStatement)
+
+
+@dataclass
+class AttributeSlots:
+    """
+    The attributes of obj as a container, standing in for its __dict__, which
+    mypyc's native classes don't have.
+    """
+
+    obj: Any
+
+    def __getitem__(self, key: str) -> Any:
+        return getattr(self.obj, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        setattr(self.obj, key, value)
+
+
+def statement_slots(
+    statements: list[Statement], line: Optional[int] = None
+) -> Iterator[tuple[Any, Any, Statement]]:
+    """
+    Every place in statements, and in the statements nested in them, that
+    holds a statement which gets executed, as (container, key, statement).
+    If branches are held in AttributeSlots of the If. The statements nested
+    in a statement on `line` are left out, so that a breakpoint stops once, at
+    the outermost statement on its line.
+    """
+    for index, stmt in enumerate(statements):
+        if stmt is None:
+            continue
+        yield statements, index, stmt
+        yield from nested_slots(stmt, line)
+
+
+def nested_slots(stmt: Statement, line: Optional[int]) -> Iterator[tuple[Any, Any, Statement]]:
+    if stmt.line == line:
+        return
+    while isinstance(stmt, WRAPPER_STATEMENTS):
+        stmt = stmt.statement
+    match stmt:
+        case BlockStatement():
+            yield from statement_slots(stmt.statements, line)
+        case IfStatement():
+            yield AttributeSlots(stmt), "then_branch", stmt.then_branch
+            yield from nested_slots(stmt.then_branch, line)
+            if stmt.else_branch is not None:
+                yield AttributeSlots(stmt), "else_branch", stmt.else_branch
+                yield from nested_slots(stmt.else_branch, line)
+        case WhileStatement():
+            # The loop runs body_statements, which for a block body is the
+            # block's own list
+            yield from statement_slots(stmt.body_statements, line)
+        case FunctionStatement():
+            yield from statement_slots(stmt.body, line)
+        case ClassStatement():
+            for method in stmt.methods:
+                yield from statement_slots(method.body, line)
+
+
+def declares_closure(statements: list[Statement]) -> bool:
+    """
+    Whether any function or class is declared anywhere in statements.
+    """
+    pending = list(statements)
+    while pending:
+        stmt = pending.pop()
+        match stmt:
+            case FunctionStatement() | ClassStatement():
+                return True
+            case BlockStatement():
+                pending += stmt.statements
+            case IfStatement():
+                pending.append(stmt.then_branch)
+                if stmt.else_branch is not None:
+                    pending.append(stmt.else_branch)
+            case WhileStatement():
+                pending.append(stmt.body)
+    return False
+
+
+def free_variables(function: FunctionStatement) -> list[Token]:
+    """
+    The names function uses, itself or through the functions declared in it,
+    that aren't its parameters or declared in it before they're used, which
+    are what it closes over. A Token for each, where it's first used.
+    """
+    return walk_scopes(function.body, {param.symbol for param in function.params})
+
+
+def walk_scopes(body: list[Statement], declared: set[Optional[int]]) -> list[Token]:
+    """
+    The names used in body, run in a scope where `declared` are already
+    declared, that aren't declared in it or a block nested in it before
+    they're used. Functions declared anywhere in body have those of their
+    free variables that one of the scopes they're declared in declares,
+    possibly only after them, added to their `late` symbols.
+    """
+    free: dict[Optional[int], Token] = {}
+    scopes = [declared]
+    # Each function declared in body, with the scopes it's declared in
+    nested: list[tuple[FunctionStatement, list[set[Optional[int]]]]] = []
+
+    def use(name: Token) -> None:
+        if not any(name.symbol in scope for scope in scopes):
+            free.setdefault(name.symbol, name)
+
+    def statements(stmts: list[Statement]) -> None:
+        for stmt in stmts:
+            while isinstance(stmt, WRAPPER_STATEMENTS):
+                stmt = stmt.statement
+            match stmt:
+                case ExpressionStatement() | PrintStatement():
+                    expression(stmt.expression)
+                case VariableStatement():
+                    if stmt.initializer:
+                        expression(stmt.initializer)
+                    scopes[-1].add(stmt.name.symbol)
+                case BlockStatement():
+                    scopes.append(set())
+                    statements(stmt.statements)
+                    scopes.pop()
+                case IfStatement():
+                    expression(stmt.condition)
+                    statements([stmt.then_branch])
+                    if stmt.else_branch is not None:
+                        statements([stmt.else_branch])
+                case WhileStatement():
+                    expression(stmt.condition)
+                    statements([stmt.body])
+                    if stmt.increment is not None:
+                        expression(stmt.increment)
+                case ReturnStatement():
+                    if stmt.value is not None:
+                        expression(stmt.value)
+                case FunctionStatement():
+                    # Declared before its closure is made, so it can call
+                    # itself
+                    scopes[-1].add(stmt.name.symbol)
+                    nested.append((stmt, list(scopes)))
+                    for name in stmt.free:
+                        use(name)
+                case ClassStatement():
+                    scopes[-1].add(stmt.name.symbol)
+                    if stmt.superclass is not None:
+                        use(stmt.superclass.name)
+                    for method in stmt.methods:
+                        nested.append((method, list(scopes)))
+                        for name in method.free:
+                            # Methods get these from their own frame and class
+                            if name.symbol != THIS and name.symbol != SUPER:
+                                use(name)
+
+    def expression(expr: Expr) -> None:
+        pending = [expr]
+        while pending:
+            expr = pending.pop()
+            match expr:
+                case VariableExpr():
+                    use(expr.name)
+                case AssignExpr():
+                    pending.append(expr.value)
+                    use(expr.name)
+                case ThisExpr():
+                    use(expr.keyword)
+                case SuperExpr():
+                    use(expr.keyword)
+                    use(THIS_TOKEN)
+                case UnaryExpr():
+                    pending.append(expr.right)
+                case BinaryExpr():
+                    pending += [expr.right, expr.left]
+                case GroupingExpr():
+                    pending.append(expr.expression)
+                case CallExpr():
+                    pending += reversed(expr.arguments)
+                    pending.append(expr.callee)
+                case GetExpr():
+                    pending.append(expr.object)
+                case SetExpr():
+                    pending += [expr.value, expr.object]
+                case ArrayExpr():
+                    pending += reversed(expr.elements)
+                case IndexExpr():
+                    pending += [expr.index, expr.array]
+
+    statements(body)
+    # Only now is everything the scopes declare known
+    for function, enclosing in nested:
+        for name in function.free:
+            if any(name.symbol in scope for scope in enclosing):
+                function.late.add(name.symbol)
+    return list(free.values())
+
 
 @dataclass
 class Scanner:
@@ -329,28 +879,25 @@ class Scanner:
     start: int = 0
     current: int = 0
     line: int = 1
+    # When set, errors are collected here as (offset, message) instead of
+    # being reported through Lox
+    errors: Optional[list[tuple[int, str]]] = None
 
     @classmethod
-    def scan_str(cls, input_str):
+    def scan_str(cls, input_str: str) -> Tokens:
         scanner = cls(input_str)
         return scanner.scan_tokens()
 
-    def scan_tokens(self) -> list[Token]:
+    def scan_tokens(self) -> Tokens:
         while not self.is_at_end():
             self.start = self.current
             self.scan_token()
 
-        self.tokens.append(
-            Token(
-                token_type = EndOfFile(),
-                lexeme = "",
-                literal = None,
-                line = self.line,
-            )
-        )
+        self.start = self.current
+        self.add_token(EndOfFile())
         return self.tokens
 
-    def scan_token(self):
+    def scan_token(self) -> None:
         c = self.advance()
         match c:
             case "(":
@@ -361,6 +908,10 @@ class Scanner:
                 self.add_token(LeftBrace())
             case "}":
                 self.add_token(RightBrace())
+            case "[":
+                self.add_token(LeftBracket())
+            case "]":
+                self.add_token(RightBracket())
             case ",":
                 self.add_token(Comma())
             case ".":
@@ -402,9 +953,9 @@ class Scanner:
             case c if c.isalpha():
                 self.identifier()
             case _:
-                Lox.error(self.line, f"Unexpected character {repr(c)}")
+                self.error(self.line, f"Unexpected character {repr(c)}")
 
-    def match(self, expected) -> bool:
+    def match(self, expected: str) -> bool:
         if self.is_at_end():
             return False
         if self.source[self.current] != expected:
@@ -424,7 +975,7 @@ class Scanner:
             return "\0"
         return self.source[self.current+1]
 
-    def string(self):
+    def string(self) -> None:
         starting_line = self.line
         while self.peek() != '"' and not self.is_at_end():
             if self.peek() == '\n':
@@ -432,14 +983,14 @@ class Scanner:
             self.advance()
 
         if self.is_at_end():
-            Lox.error(line, "Unterminated string on line {starting_line}")
+            self.error(starting_line, "Unterminated string.")
             return
 
         self.advance()
         value = self.source[self.start+1:self.current-1]
         self.add_token(String(), value)
 
-    def number(self):
+    def number(self) -> None:
         while True:
             if self.peek().isdigit():
                 self.advance()
@@ -456,36 +1007,27 @@ class Scanner:
 
         self.add_token(Number(), float(self.source[self.start:self.current]))
 
-    def identifier(self):
+    def identifier(self) -> None:
         while self.peek().isalnum():
             self.advance()
 
-        keyword_tokens = {
-            "and": AndToken(),
-            "class": ClassToken(),
-            "else": ElseToken(),
-            "false": FalseToken(),
-            "for": ForToken(),
-            "fun": FunToken(),
-            "if": IfToken(),
-            "nil": NilToken(),
-            "or": OrToken(),
-            "print": PrintToken(),
-            "return": ReturnToken(),
-            "super": SuperToken(),
-            "this": ThisToken(),
-            "true": TrueToken(),
-            "var": VarToken(),
-            "while": WhileToken(),
-        }
-
         text = self.source[self.start:self.current]
-        self.add_token(keyword_tokens.get(text, Identifier()))
+        keyword = KEYWORDS.get(text)
+        if keyword is not None:
+            self.add_token(keyword, symbol=KEYWORD_SYMBOLS.get(text))
+        else:
+            self.add_token(Identifier(), symbol=symbols.intern(text))
 
-    def scan_source(self):
+    def scan_source(self) -> None:
         raise NotImplementedError
 
-    def add_token(self, token_type: TokenType, literal: Any = None):
+    def error(self, line: int, message: str) -> None:
+        if self.errors is not None:
+            self.errors.append((self.start, message))
+        else:
+            Lox.error(line, message)
+
+    def add_token(self, token_type: TokenType, literal: Any = None, symbol: Optional[int] = None) -> None:
         text = self.source[self.start:self.current]
         self.tokens.append(
             Token(
@@ -493,10 +1035,11 @@ class Scanner:
                 lexeme = text,
                 literal = literal,
                 line = self.line,
+                symbol = symbol,
             )
         )
 
-    def advance(self):
+    def advance(self) -> str:
         c = self.source[self.current]
         self.current += 1
         return c
@@ -505,91 +1048,496 @@ class Scanner:
         return self.current >= len(self.source)
 
 
+# Token type classes indexed by the small integer kinds a TokenBuffer stores
+TOKEN_TYPES = get_args(TokenType)
+TOKEN_KINDS = {token_type: kind for kind, token_type in enumerate(TOKEN_TYPES)}
+# Token types carry no state, so a single shared instance of each is enough
+TOKEN_TYPE_INSTANCES = tuple(token_type() for token_type in TOKEN_TYPES)
+
+
+@dataclass
+class TokenBuffer:
+    """
+    Compact token stream stored as parallel columns.
+
+    Each token is a kind, a start offset into the source and a length. Only
+    tokens with a literal have an entry in the `literals` side table, and
+    only identifiers have one in the `symbols` side table.
+    Lexemes are sliced from the source when asked for, and lines and columns
+    are computed from an index of newline offsets that is built on first use.
+    Indexing the buffer returns a BufferToken view, so a Parser can consume
+    it in place of a list of Token.
+    """
+    source: str
+    kinds: array = field(default_factory=lambda: array("B"))
+    starts: array = field(default_factory=lambda: array("I"))
+    lengths: array = field(default_factory=lambda: array("I"))
+    literals: dict[int, Any] = field(default_factory=dict)
+    symbols: dict[int, int] = field(default_factory=dict)
+    newlines: Optional[array] = None
+    # The line line_at last found, which the next lookup usually shares
+    last_line: int = field(default=1, compare=False)
+
+    def append(
+        self,
+        kind: int,
+        start: int,
+        length: int,
+        literal: Any = None,
+        symbol: Optional[int] = None,
+    ):
+        if literal is not None:
+            self.literals[len(self.kinds)] = literal
+        if symbol is not None:
+            self.symbols[len(self.kinds)] = symbol
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.lengths.append(length)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index: int) -> BufferToken:
+        if index < 0:
+            index += len(self.kinds)
+        if not 0 <= index < len(self.kinds):
+            raise IndexError("token index out of range")
+        return BufferToken(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield BufferToken(self, index)
+
+    def token_type(self, index: int) -> TokenType:
+        return TOKEN_TYPE_INSTANCES[self.kinds[index]]
+
+    def token(self, index: int) -> Token:
+        """
+        The token at index as a Token, for a Parser to keep in the AST.
+        """
+        start = self.starts[index]
+        end = start + self.lengths[index]
+        return Token(
+            TOKEN_TYPE_INSTANCES[self.kinds[index]],
+            self.source[start:end],
+            self.literals.get(index),
+            # Like line, from where it ends
+            self.line_at(end),
+            self.symbols.get(index),
+        )
+
+    def lexeme(self, index: int) -> str:
+        start = self.starts[index]
+        return self.source[start:start + self.lengths[index]]
+
+    def literal(self, index: int) -> Any:
+        return self.literals.get(index)
+
+    def line(self, index: int) -> int:
+        # Like Scanner, a token that spans lines reports the line it ends on
+        return self.line_at(self.starts[index] + self.lengths[index])
+
+    def column(self, index: int) -> int:
+        start = self.starts[index]
+        line = self.line_at(start)
+        if line == 1:
+            return start + 1
+        return start - self.newline_offsets()[line - 2]
+
+    def line_at(self, offset: int) -> int:
+        newlines = self.newline_offsets()
+        # A Parser asks for lines in order, a token at a time, so try the
+        # last one before searching
+        line = self.last_line
+        if (line == 1 or newlines[line - 2] < offset) and (
+            line > len(newlines) or offset <= newlines[line - 1]
+        ):
+            return line
+        line = bisect_left(newlines, offset) + 1
+        self.last_line = line
+        return line
+
+    def newline_offsets(self) -> array:
+        if self.newlines is None:
+            self.newlines = array("I")
+            newline = self.source.find("\n")
+            while newline != -1:
+                self.newlines.append(newline)
+                newline = self.source.find("\n", newline + 1)
+        return self.newlines
+
+
+class BufferToken:
+    """
+    View of a single token in a TokenBuffer, with the same attributes as
+    Token. Only the kind and position are stored; everything else is looked
+    up in the buffer when accessed.
+    """
+    __slots__ = ("buffer", "index")
+
+    def __init__(self, buffer: TokenBuffer, index: int):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def token_type(self) -> TokenType:
+        return TOKEN_TYPE_INSTANCES[self.buffer.kinds[self.index]]
+
+    @property
+    def lexeme(self) -> str:
+        return self.buffer.lexeme(self.index)
+
+    @property
+    def literal(self) -> Any:
+        return self.buffer.literals.get(self.index)
+
+    @property
+    def line(self) -> int:
+        return self.buffer.line(self.index)
+
+    @property
+    def symbol(self) -> Optional[int]:
+        return self.buffer.symbols.get(self.index)
+
+    @property
+    def column(self) -> int:
+        return self.buffer.column(self.index)
+
+    def __eq__(self, other):
+        # Same comparison as Token: the lexeme and line are ignored
+        if isinstance(other, (Token, BufferToken)):
+            return (
+                self.token_type == other.token_type
+                and self.literal == other.literal
+            )
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self):
+        return (
+            f"BufferToken(token_type={self.token_type!r}, lexeme={self.lexeme!r}, "
+            f"literal={self.literal!r}, line={self.line!r})"
+        )
+
+
+# What a Scanner produces and a Parser consumes
+Tokens = Union[list[Token], TokenBuffer]
+
+
+@dataclass
+class BufferScanner(Scanner):
+    """
+    Scanner that writes its tokens into a TokenBuffer instead of a list of
+    Token.
+    """
+    buffer: TokenBuffer = field(init=False)
+
+    def __post_init__(self):
+        self.buffer = TokenBuffer(self.source)
+
+    def scan_tokens(self) -> Tokens:
+        super().scan_tokens()
+        return self.buffer
+
+    def add_token(self, token_type: TokenType, literal: Any = None, symbol: Optional[int] = None) -> None:
+        self.buffer.append(
+            TOKEN_KINDS[type(token_type)],
+            self.start,
+            self.current - self.start,
+            literal,
+            symbol,
+        )
+
+
+@dataclass
+class DocumentScanner(Scanner):
+    """
+    Scanner that also records the offset each token starts at, for Document.
+    """
+    starts: list[int] = field(default_factory=list)
+
+    def add_token(self, token_type: TokenType, literal: Any = None, symbol: Optional[int] = None) -> None:
+        self.starts.append(self.start)
+        super().add_token(token_type, literal, symbol)
+
+
 def print_ast(expression: Expr):
     print(format_ast(expression))
 
 
 def format_ast(expr: Expr):
-    match expr:
-        case LiteralExpr():
-            if expr.value is None:
-                return "nil"
-            return str(expr.value)
-        case UnaryExpr():
-            return f"({expr.operator.lexeme} {format_ast(expr.right)})"
-        case GroupingExpr():
-            return f"(group {format_ast(expr.expression)})"
-        case BinaryExpr():
-            return f"({expr.operator.lexeme} {format_ast(expr.left)} {format_ast(expr.right)})"
-        case _:
-            assert False, f"got unexpected Expr type: {type(expr)}"
+    # Pieces are pushed in reverse so that popping them yields the output in
+    # order. Using an explicit stack keeps very deeply nested expressions from
+    # hitting the recursion limit.
+    pending: list[Union[Expr, str]] = [expr]
+    parts = []
+    while pending:
+        item = pending.pop()
+        match item:
+            case str():
+                parts.append(item)
+            case LiteralExpr():
+                if item.value is None:
+                    parts.append("nil")
+                else:
+                    parts.append(str(item.value))
+            case UnaryExpr():
+                pending += [")", item.right, f"({item.operator.lexeme} "]
+            case GroupingExpr():
+                pending += [")", item.expression, "(group "]
+            case BinaryExpr():
+                pending += [")", item.right, " ", item.left, f"({item.operator.lexeme} "]
+            case ArrayExpr():
+                pending.append(")")
+                for element in reversed(item.elements):
+                    pending += [element, " "]
+                pending.append("(array")
+            case IndexExpr():
+                pending += [")", item.index, " ", item.array, "(index "]
+            case CallExpr():
+                pending.append(")")
+                for argument in reversed(item.arguments):
+                    pending += [argument, " "]
+                pending += [item.callee, "(call "]
+            case GetExpr():
+                pending += [f" {item.name.lexeme})", item.object, "(get "]
+            case SetExpr():
+                pending += [")", item.value, f" {item.name.lexeme} ", item.object, "(set "]
+            case ThisExpr():
+                parts.append("this")
+            case SuperExpr():
+                parts.append(f"(super {item.method.lexeme})")
+            case _:
+                assert False, f"got unexpected Expr type: {type(item)}"
+
+    return "".join(parts)
 
 
 @dataclass
 class Parser:
-    tokens: list[Token]
+    tokens: Tokens
     current: int = 0
+    # Number of function bodies being parsed, to reject top level returns
+    function_depth: int = 0
+    # Whether each class being parsed has a superclass, innermost last
+    classes: list[bool] = field(default_factory=list)
+    in_initializer: bool = False
+    # When set, errors are collected here as (token, message) instead of
+    # being reported through Lox
+    errors: Optional[list[tuple[Token, str]]] = None
+    # When set, each statement is recorded here with the index of the token
+    # it starts at, as (statement, index), for Document to move its line
+    statement_tokens: Optional[list[tuple[Statement, int]]] = None
+    # File the tokens were scanned from, for resolving imports
+    path: Optional[Path] = None
 
     @classmethod
-    def parse_str(cls, input_str) -> Expr:
+    def parse_str(cls, input_str: str) -> list[Optional[Statement]]:
         parser = cls(Scanner.scan_str(input_str))
         return parser.parse()
 
-    def parse(self) -> Expr:
+    def parse(self) -> list[Optional[Statement]]:
+        """
+        Every declaration, with None in place of those that failed to parse.
+        """
         statements = []
         while not self.is_at_end():
             statements.append(self.declaration())
 
         return statements
 
-    def declaration(self):
+    def declaration(self) -> Optional[Statement]:
+        start = self.current
+        statement: Statement
         try:
-            if self.match(VarToken()):
-                return self.var_declaration()
-            return self.statement()
+            if self.match(ClassToken()):
+                statement = self.class_declaration()
+            elif self.match(FunToken()):
+                statement = self.function("function")
+            elif self.match(VarToken()):
+                statement = self.var_declaration()
+            else:
+                return self.statement()
         except ParseError:
             self.synchronize()
             return None
+        self.place(statement, start)
+        return statement
 
-    def var_declaration(self):
+    def var_declaration(self) -> VariableStatement:
         token = self.consume(Identifier(), "Expect variable name")
         initializer = None
         if self.match(Equal()):
             initializer = self.expression()
 
-        self.consume(Semicolon(), "Expect ';' after variable declaration")
+        self.expect(Semicolon(), "Expect ';' after variable declaration")
         return VariableStatement(token, initializer)
 
+    def class_declaration(self) -> ClassStatement:
+        name = self.consume(Identifier(), "Expect class name.")
+        superclass = None
+        if self.match(Less()):
+            superclass = VariableExpr(self.consume(Identifier(), "Expect superclass name."))
+            if superclass.name.lexeme == name.lexeme:
+                self.error(superclass.name, "A class can't inherit from itself.")
 
-    def statement(self):
+        self.expect(LeftBrace(), "Expect '{' before class body.")
+        self.classes.append(superclass is not None)
+        try:
+            methods = []
+            while not self.check(RightBrace()) and not self.is_at_end():
+                methods.append(self.function("method"))
+        finally:
+            self.classes.pop()
+
+        self.expect(RightBrace(), "Expect '}' after class body.")
+        return ClassStatement(name, superclass, methods)
+
+    def function(self, kind: str) -> FunctionStatement:
+        name = self.consume(Identifier(), f"Expect {kind} name.")
+        self.expect(LeftParen(), f"Expect '(' after {kind} name.")
+        params = []
+        if not self.check(RightParen()):
+            params.append(self.consume(Identifier(), "Expect parameter name."))
+            while self.match(Comma()):
+                if len(params) >= 255:
+                    self.error(self.peek(), "Can't have more than 255 parameters.")
+                params.append(self.consume(Identifier(), "Expect parameter name."))
+        self.expect(RightParen(), "Expect ')' after parameters.")
+
+        self.expect(LeftBrace(), f"Expect '{{' before {kind} body.")
+        in_initializer = self.in_initializer
+        self.in_initializer = kind == "method" and name.lexeme == "init"
+        self.function_depth += 1
+        try:
+            body = self.block_statement()
+        finally:
+            self.function_depth -= 1
+            self.in_initializer = in_initializer
+        return FunctionStatement(name, params, body)
+
+    def statement(self) -> Statement:
+        start = self.current
+        statement: Statement
         if self.match(PrintToken()):
-            return self.print_statement()
-        if self.match(LeftBrace):
-            return BlockStatement(self.block_statement())
-        return self.expression_statement()
-
-    def print_statement(self):
+            statement = self.print_statement()
+        elif self.match(IfToken()):
+            statement = self.if_statement()
+        elif self.match(WhileToken()):
+            statement = self.while_statement()
+        elif self.match(ForToken()):
+            statement = self.for_statement()
+        elif self.match(ReturnToken()):
+            statement = self.return_statement()
+        elif self.match(ImportToken()):
+            statement = self.import_statement()
+        elif self.match(LeftBrace()):
+            statement = BlockStatement(self.block_statement())
+        else:
+            statement = self.expression_statement()
+        self.place(statement, start)
+        return statement
+
+    def place(self, statement: Statement, start: int) -> None:
+        """
+        Set the line of statement to that of the token it starts at.
+        """
+        statement.line = self.line(start)
+        if self.statement_tokens is not None:
+            self.statement_tokens.append((statement, start))
+
+    def if_statement(self) -> IfStatement:
+        self.expect(LeftParen(), "Expect '(' after 'if'.")
+        condition = self.expression()
+        self.expect(RightParen(), "Expect ')' after if condition.")
+
+        then_branch = self.statement()
+        else_branch = None
+        if self.match(ElseToken()):
+            else_branch = self.statement()
+        return IfStatement(condition, then_branch, else_branch)
+
+    def while_statement(self) -> WhileStatement:
+        self.expect(LeftParen(), "Expect '(' after 'while'.")
+        condition = self.expression()
+        self.expect(RightParen(), "Expect ')' after condition.")
+        return WhileStatement(condition, self.statement())
+
+    def for_statement(self) -> Statement:
+        start = self.current - 1
+        self.expect(LeftParen(), "Expect '(' after 'for'.")
+        initializer: Optional[Statement]
+        if self.match(Semicolon()):
+            initializer = None
+        elif self.match(VarToken()):
+            initializer = self.var_declaration()
+        else:
+            initializer = self.expression_statement()
+        if initializer is not None:
+            self.place(initializer, start)
+
+        condition: Expr = LiteralExpr(True)
+        if not self.check(Semicolon()):
+            condition = self.expression()
+        self.expect(Semicolon(), "Expect ';' after loop condition.")
+
+        increment = None
+        if not self.check(RightParen()):
+            increment = self.expression()
+        self.expect(RightParen(), "Expect ')' after for clauses.")
+
+        # The increment is kept on the loop rather than wrapped in a block
+        # with the body, so the body isn't nested one block deeper
+        loop = WhileStatement(condition, self.statement(), increment)
+        self.place(loop, start)
+        if initializer is not None:
+            return BlockStatement([initializer, loop])
+        return loop
+
+    def return_statement(self) -> ReturnStatement:
+        keyword = self.previous()
+        if not self.function_depth:
+            self.error(keyword, "Can't return from top-level code.")
+        value = None
+        if not self.check(Semicolon()):
+            if self.in_initializer:
+                self.error(keyword, "Can't return a value from an initializer.")
+            value = self.expression()
+
+        self.expect(Semicolon(), "Expect ';' after return value.")
+        return ReturnStatement(keyword, value)
+
+    def import_statement(self) -> ImportStatement:
+        keyword = self.previous()
+        name = self.consume(String(), "Expect module path after 'import'.")
+        self.expect(Semicolon(), "Expect ';' after module path.")
+        return ImportStatement(keyword, name, self.path)
+
+    def print_statement(self) -> PrintStatement:
         value = self.expression()
-        self.consume(Semicolon(), "Expect ';' after value")
+        self.expect(Semicolon(), "Expect ';' after value")
         return PrintStatement(value)
 
-    def expression_statement(self):
+    def expression_statement(self) -> ExpressionStatement:
         value = self.expression()
-        self.consume(Semicolon(), "Expect ';' after expression")
+        self.expect(Semicolon(), "Expect ';' after expression")
         return ExpressionStatement(value)
 
     def block_statement(self) -> list[Statement]:
         statements = []
         while not self.check(RightBrace()) and not self.is_at_end():
-            statements.append(self.declaration())
+            statement = self.declaration()
+            if statement is not None:
+                statements.append(statement)
 
-        self.consume(RightBrace(), "Expect '}' after block.")
+        self.expect(RightBrace(), "Expect '}' after block.")
         return statements
 
-    def expression(self):
+    def expression(self) -> Expr:
         return self.assignment()
 
-    def assignment(self):
+    def assignment(self) -> Expr:
         expr = self.equality()
         if self.match(Equal()):
             equals = self.previous()
@@ -598,12 +1546,14 @@ class Parser:
             if isinstance(expr, VariableExpr):
                 name = expr.name
                 return AssignExpr(name, value)
+            elif isinstance(expr, GetExpr):
+                return SetExpr(expr.object, expr.name, value)
 
             self.error(equals, "Invalid assignment target")
 
         return expr
 
-    def equality(self):
+    def equality(self) -> Expr:
         expr = self.comparison()
         while self.match(BangEqual(), DoubleEqual()):
             operator = self.previous()
@@ -612,7 +1562,7 @@ class Parser:
 
         return expr
 
-    def comparison(self):
+    def comparison(self) -> Expr:
         expr = self.term()
         while self.match(Greater(), GreaterEqual(), Less(), LessEqual()):
             operator = self.previous()
@@ -621,7 +1571,7 @@ class Parser:
 
         return expr
 
-    def term(self):
+    def term(self) -> Expr:
         expr = self.factor()
         while self.match(Minus(), Plus()):
             operator = self.previous()
@@ -630,7 +1580,7 @@ class Parser:
 
         return expr
 
-    def factor(self):
+    def factor(self) -> Expr:
         expr = self.unary()
         while self.match(Slash(), Star()):
             operator = self.previous()
@@ -639,15 +1589,72 @@ class Parser:
 
         return expr
 
-    def unary(self):
+    def unary(self) -> Expr:
         if self.match(Bang(), Minus()):
             operator = self.previous()
             right = self.unary()
             return UnaryExpr(operator, right)
 
-        return self.primary()
+        return self.call()
 
-    def primary(self):
+    def call(self) -> Expr:
+        expr = self.primary()
+        while True:
+            if self.match(LeftParen()):
+                expr = self.finish_call(expr, self.previous())
+            elif self.match(Dot()):
+                expr = GetExpr(expr, self.consume(Identifier(), "Expect property name after '.'."))
+            elif self.match(LeftBracket()):
+                expr = self.finish_index(expr, self.previous())
+            else:
+                return expr
+
+    def finish_call(self, callee: Expr, paren: Token) -> CallExpr:
+        arguments = []
+        if not self.check(RightParen()):
+            arguments.append(self.expression())
+            while self.match(Comma()):
+                if len(arguments) >= 255:
+                    self.error(self.peek(), "Can't have more than 255 arguments.")
+                arguments.append(self.expression())
+
+        self.expect(RightParen(), "Expect ')' after arguments.")
+        return CallExpr(callee, paren, arguments)
+
+    def finish_index(self, array: Expr, bracket: Token) -> IndexExpr:
+        index = self.expression()
+        self.expect(RightBracket(), "Expect ']' after index.")
+        return IndexExpr(array, bracket, index)
+
+    def this(self, keyword: Token) -> ThisExpr:
+        if not self.classes:
+            self.error(keyword, "Can't use 'this' outside of a class.")
+        return ThisExpr(keyword)
+
+    def super(self, keyword: Token) -> SuperExpr:
+        if not self.classes:
+            self.error(keyword, "Can't use 'super' outside of a class.")
+        elif not self.classes[-1]:
+            self.error(keyword, "Can't use 'super' in a class with no superclass.")
+        self.expect(Dot(), "Expect '.' after 'super'.")
+        method = self.consume(Identifier(), "Expect superclass method name.")
+        return SuperExpr(keyword, method)
+
+    def array(self, bracket: Token) -> ArrayExpr:
+        elements = []
+        if not self.check(RightBracket()):
+            elements.append(self.expression())
+            while self.match(Comma()):
+                elements.append(self.expression())
+
+        self.expect(RightBracket(), "Expect ']' after array elements.")
+        return ArrayExpr(bracket, elements)
+
+    def primary(self) -> Expr:
+        if self.is_at_end():
+            # advance wouldn't move past the end, and would give back the
+            # previous token again
+            raise self.error(self.peek(), "Expected expression")
         token = self.advance()
         match token.token_type:
             case FalseToken():
@@ -660,205 +1667,2898 @@ class Parser:
                 return LiteralExpr(token.literal)
             case LeftParen():
                 expr = self.expression()
-                self.consume(RightParen(), "Expected ')' after expression.")
+                self.expect(RightParen(), "Expected ')' after expression.")
                 return GroupingExpr(expr)
+            case LeftBracket():
+                return self.array(token)
+            case ThisToken():
+                return self.this(token)
+            case SuperToken():
+                return self.super(token)
             case Identifier():
                 return VariableExpr(token)
             case _:
                 #breakpoint()
                 raise self.error(self.peek(), "Expected expression")
 
-    def match(self, *token_types: Token) -> bool:
+    def match(self, *token_types: TokenType) -> bool:
         for token_type in token_types:
             if self.check(token_type):
-                self.advance()
+                # check has already made sure this isn't the end
+                self.current += 1
                 return True
 
         return False
 
-    def check(self, token_type: Token) -> bool:
-        if self.is_at_end():
-            return False
-        return self.peek().token_type == token_type
+    def check(self, token_type: TokenType) -> bool:
+        # Token types have no fields, so they're equal when their classes are
+        kind = type(self.token_type(self.current))
+        return kind is type(token_type) and kind is not EndOfFile
 
-    def advance(self):
+    def advance(self) -> Token:
         if not self.is_at_end():
             self.current += 1
         return self.previous()
 
-    def is_at_end(self):
-        return self.peek().token_type == EndOfFile()
-
-    def peek(self):
-        return self.tokens[self.current]
-
-    def previous(self):
-        return self.tokens[self.current-1]
-
-    def consume(self, token_type, message: str):
+    def is_at_end(self) -> bool:
+        return type(self.token_type(self.current)) is EndOfFile
+
+    def peek(self) -> Token:
+        return self.token(self.current)
+
+    def previous(self) -> Token:
+        return self.token(self.current - 1)
+
+    def token_type(self, index: int) -> TokenType:
+        # Looking ahead only needs the kind, which a TokenBuffer has without
+        # building a Token
+        tokens = self.tokens
+        if isinstance(tokens, TokenBuffer):
+            return tokens.token_type(index)
+        return tokens[index].token_type
+
+    def line(self, index: int) -> int:
+        tokens = self.tokens
+        if isinstance(tokens, TokenBuffer):
+            return tokens.line(index)
+        return tokens[index].line
+
+    def token(self, index: int) -> Token:
+        """
+        The token at index, for keeping in the AST or reporting an error at.
+        """
+        tokens = self.tokens
+        if isinstance(tokens, TokenBuffer):
+            return tokens.token(index)
+        return tokens[index]
+
+    def consume(self, token_type: TokenType, message: str) -> Token:
         if self.check(token_type):
             return self.advance()
 
         #breakpoint()
         raise self.error(self.peek(), message)
 
-    def error(self, token: Token, message: str):
-        Lox.error_token(token, message)
+    def expect(self, token_type: TokenType, message: str) -> None:
+        """
+        Like consume, for punctuation that doesn't go into the AST.
+        """
+        if not self.check(token_type):
+            raise self.error(self.peek(), message)
+        self.current += 1
+
+    def error(self, token: Token, message: str) -> ParseError:
+        if self.errors is not None:
+            self.errors.append((token, message))
+        else:
+            Lox.error_token(token, message)
         return ParseError("parse error")
 
-    def synchronize(self):
-        self.advance()
+    def synchronize(self) -> None:
+        if not self.is_at_end():
+            self.current += 1
         while not self.is_at_end():
-            if self.previous.token_type == Semicolon:
+            if self.token_type(self.current - 1) == Semicolon():
                 return
 
-            match self.peek().token_type:
-                case ClassToken() | ForToken() | FunToken() | IfToken() | PrintToken() | ReturnToken() | VarToken() | WhileToken():
+            match self.token_type(self.current):
+                case ClassToken() | ForToken() | FunToken() | IfToken() | PrintToken() | ReturnToken() | VarToken() | WhileToken() | ImportToken():
                     return
                 case _:
                     pass
 
-        self.advance()
-
-
-@dataclass
-class Environment:
-    enclosing: Optional[Environment] = None
-    values: dict[str, Any] = field(default_factory=dict)
-
-    def get(self, name):
-        if name.lexeme in self.values:
-            return self.values[name.lexeme]
+            self.current += 1
 
-        elif self.enclosing:
-            return self.enclosing.get(name)
 
-        raise Exception(f"Undefined variable {name.lexeme}.")
+class Precedence(IntEnum):
+    NONE = 0
+    ASSIGNMENT = 1
+    EQUALITY = 2
+    COMPARISON = 3
+    TERM = 4
+    FACTOR = 5
+    UNARY = 6
+    CALL = 7
 
 
-    def define(self, name, value):
-        self.values[name.lexeme] = value
+@dataclass
+class ParseRule:
+    prefix: Optional[Callable]
+    infix: Optional[Callable]
+    precedence: Precedence
 
-    def assign(self, name, value):
-        if name.lexeme in self.values:
-            self.values[name.lexeme] = value
-            return value
 
-        elif self.enclosing:
-            return self.enclosing.assign(name, value)
+@dataclass
+class PrattParser(Parser):
+    """
+    Precedence climbing parser for expressions.
 
-        raise Exception(f"Undefined variable {name.lexeme}.")
+    Statements are parsed exactly like Parser, but expressions are driven by
+    the PRATT_RULES table keyed on the token type class instead of one method per
+    precedence level. The resulting AST is identical to Parser's.
+    """
 
+    def expression(self) -> Expr:
+        return self.parse_precedence(Precedence.ASSIGNMENT)
 
+    def parse_precedence(self, precedence: int) -> Expr:
+        if self.is_at_end():
+            raise self.error(self.peek(), "Expected expression")
 
-@dataclass
-class Interpreter:
-    environment: Environment = field(default_factory=Environment)
+        token = self.advance()
+        rule = PRATT_RULES.get(type(token.token_type))
+        if rule is None or rule.prefix is None:
+            raise self.error(self.peek(), "Expected expression")
 
-    @classmethod
-    def evaluate_str(cls, input_str):
-        interpreter = cls()
-        scanner = Scanner(input_str)
-        parser = Parser(scanner.scan_tokens())
-        return interpreter.evaluate(parser.expression())
+        expr = rule.prefix(self, token)
+        while True:
+            rule = PRATT_RULES.get(type(self.token_type(self.current)))
+            if rule is None or rule.infix is None or rule.precedence < precedence:
+                return expr
 
-    def interpret(self, stmts):
-        try:
-            for statement in stmts:
-                self.execute(statement)
-            #print(self.stringify(result))
-        except Exception as exc:
-            Lox.runtime_error(exc.args[0])
+            token = self.token(self.current)
+            self.current += 1
+            expr = rule.infix(self, expr, token)
 
-    def execute(self, stmt):
-        match stmt:
-            case PrintStatement():
-                result = self.evaluate(stmt.expression)
-                print(self.stringify(result))
-            case ExpressionStatement():
-                self.evaluate(stmt.expression)
-            case VariableStatement():
-                value = None
-                if stmt.initializer:
-                    value = self.evaluate(stmt.initializer)
-                self.environment.define(stmt.name, value)
+    def prefix_literal(self, token: Token) -> Expr:
+        match token.token_type:
+            case FalseToken():
+                return LiteralExpr(False)
+            case TrueToken():
+                return LiteralExpr(True)
+            case NilToken():
+                return LiteralExpr(None)
             case _:
-                #breakpoint()
-                raise Exception(f"Unexpected statement {stmt}")
+                return LiteralExpr(token.literal)
 
-    def evaluate(self, expr: Expr):
-        match expr:
-            case LiteralExpr():
-                return expr.value
+    def prefix_grouping(self, token: Token) -> Expr:
+        expr = self.expression()
+        self.expect(RightParen(), "Expected ')' after expression.")
+        return GroupingExpr(expr)
 
-            case UnaryExpr(operator=Token(token_type=Minus())):
-                return -self.evaluate(expr.right)
+    def prefix_variable(self, token: Token) -> Expr:
+        return VariableExpr(token)
 
-            case UnaryExpr(operator=Token(token_type=Bang())):
-                return not self.is_truthy(self.evaluate(expr.right))
+    def prefix_array(self, bracket: Token) -> Expr:
+        return self.array(bracket)
 
-            case GroupingExpr():
-                return self.evaluate(expr.expression)
+    def prefix_this(self, keyword: Token) -> Expr:
+        return self.this(keyword)
 
-            case VariableExpr():
-                return self.environment.get(expr.name)
+    def prefix_super(self, keyword: Token) -> Expr:
+        return self.super(keyword)
 
-            case AssignExpr():
-                value = self.evaluate(expr.value)
-                self.environment.assign(expr.name, value)
-                return value
+    def prefix_unary(self, operator: Token) -> Expr:
+        return UnaryExpr(operator, self.parse_precedence(Precedence.UNARY))
 
-            case BinaryExpr():
-                left = self.evaluate(expr.left)
-                right = self.evaluate(expr.right)
-                match expr.operator.token_type, left, right:
-                    case Minus(), float(), float():
-                        return left - right
+    def infix_binary(self, left: Expr, operator: Token) -> Expr:
+        precedence = PRATT_RULES[type(operator.token_type)].precedence
+        right = self.parse_precedence(precedence + 1)
+        return BinaryExpr(left, operator, right)
 
-                    case Slash(), float(), float():
-                        return left / right
+    def infix_assignment(self, expr: Expr, equals: Token) -> Expr:
+        # Assignment is right associative, so the value is parsed at the same
+        # precedence rather than one level higher.
+        value = self.parse_precedence(Precedence.ASSIGNMENT)
+        if isinstance(expr, VariableExpr):
+            return AssignExpr(expr.name, value)
+        if isinstance(expr, GetExpr):
+            return SetExpr(expr.object, expr.name, value)
 
-                    case Star(), float(), float():
-                        return left * right
+        self.error(equals, "Invalid assignment target")
+        return expr
 
-                    case Greater(), float(), float():
-                        return left > right
+    def infix_index(self, array: Expr, bracket: Token) -> Expr:
+        return self.finish_index(array, bracket)
+
+    def infix_call(self, callee: Expr, paren: Token) -> Expr:
+        return self.finish_call(callee, paren)
+
+    def infix_get(self, expr: Expr, dot: Token) -> Expr:
+        return GetExpr(expr, self.consume(Identifier(), "Expect property name after '.'."))
+
+
+# Parse rules for PrattParser, kept outside the class so its methods can be
+# referred to while it stays a native class under mypyc
+PRATT_RULES: dict[type, ParseRule] = {
+    LeftParen: ParseRule(PrattParser.prefix_grouping, PrattParser.infix_call, Precedence.CALL),
+    LeftBracket: ParseRule(PrattParser.prefix_array, PrattParser.infix_index, Precedence.CALL),
+    Dot: ParseRule(None, PrattParser.infix_get, Precedence.CALL),
+    Minus: ParseRule(PrattParser.prefix_unary, PrattParser.infix_binary, Precedence.TERM),
+    Plus: ParseRule(None, PrattParser.infix_binary, Precedence.TERM),
+    Slash: ParseRule(None, PrattParser.infix_binary, Precedence.FACTOR),
+    Star: ParseRule(None, PrattParser.infix_binary, Precedence.FACTOR),
+    Bang: ParseRule(PrattParser.prefix_unary, None, Precedence.NONE),
+    BangEqual: ParseRule(None, PrattParser.infix_binary, Precedence.EQUALITY),
+    DoubleEqual: ParseRule(None, PrattParser.infix_binary, Precedence.EQUALITY),
+    Equal: ParseRule(None, PrattParser.infix_assignment, Precedence.ASSIGNMENT),
+    Greater: ParseRule(None, PrattParser.infix_binary, Precedence.COMPARISON),
+    GreaterEqual: ParseRule(None, PrattParser.infix_binary, Precedence.COMPARISON),
+    Less: ParseRule(None, PrattParser.infix_binary, Precedence.COMPARISON),
+    LessEqual: ParseRule(None, PrattParser.infix_binary, Precedence.COMPARISON),
+    Identifier: ParseRule(PrattParser.prefix_variable, None, Precedence.NONE),
+    String: ParseRule(PrattParser.prefix_literal, None, Precedence.NONE),
+    Number: ParseRule(PrattParser.prefix_literal, None, Precedence.NONE),
+    FalseToken: ParseRule(PrattParser.prefix_literal, None, Precedence.NONE),
+    NilToken: ParseRule(PrattParser.prefix_literal, None, Precedence.NONE),
+    TrueToken: ParseRule(PrattParser.prefix_literal, None, Precedence.NONE),
+    ThisToken: ParseRule(PrattParser.prefix_this, None, Precedence.NONE),
+    SuperToken: ParseRule(PrattParser.prefix_super, None, Precedence.NONE),
+}
 
-                    case GreaterEqual(), float(), float():
-                        return left >= right
 
-                    case Less(), float(), float():
-                        return left < right
+@dataclass
+class StackParser(PrattParser):
+    """
+    Non-recursive variant of PrattParser.
+
+    Unary operators, groupings, binary operators and assignments are kept on
+    an explicit stack of pending frames instead of the Python call stack, so
+    nesting depth is only limited by memory. Any other rule in the table is
+    still called directly.
+    """
+
+    def expression(self) -> Expr:
+        # Each frame is (rule handler, left operand, operator token, minimum
+        # precedence of the operand being parsed for it).
+        frames: list[tuple[Callable, Optional[Expr], Token, int]] = []
+        precedence: int = Precedence.ASSIGNMENT
+        while True:
+            # Prefix position: push unary operators and groupings until an
+            # operand can be produced.
+            if self.is_at_end():
+                raise self.error(self.peek(), "Expected expression")
 
-                    case LessEqual(), float(), float():
-                        return left <= right
+            token = self.advance()
+            rule = PRATT_RULES.get(type(token.token_type))
+            if rule is None or rule.prefix is None:
+                raise self.error(self.peek(), "Expected expression")
 
-                    case Plus(), float(), float():
-                        return left + right
+            if rule.prefix is PrattParser.prefix_unary:
+                frames.append((rule.prefix, None, token, precedence))
+                precedence = Precedence.UNARY
+                continue
+            if rule.prefix is PrattParser.prefix_grouping:
+                frames.append((rule.prefix, None, token, precedence))
+                precedence = Precedence.ASSIGNMENT
+                continue
 
-                    case Plus(), str(), str():
-                        return left + right
+            expr = rule.prefix(self, token)
 
-                    case BangEqual(), _, _:
-                        return not self.is_equal(left, right)
+            # Infix position: either start a new operand or reduce the
+            # innermost pending frame.
+            while True:
+                rule = PRATT_RULES.get(type(self.token_type(self.current)))
+                if rule is not None and rule.infix is not None and rule.precedence >= precedence:
+                    token = self.token(self.current)
+                    self.current += 1
+                    if rule.infix is PrattParser.infix_binary:
+                        frames.append((rule.infix, expr, token, precedence))
+                        precedence = rule.precedence + 1
+                        break
+                    if rule.infix is PrattParser.infix_assignment:
+                        frames.append((rule.infix, expr, token, precedence))
+                        precedence = Precedence.ASSIGNMENT
+                        break
+                    expr = rule.infix(self, expr, token)
+                    continue
+
+                if not frames:
+                    return expr
+
+                handler, left, operator, precedence = frames.pop()
+                if handler is PrattParser.prefix_unary:
+                    expr = UnaryExpr(operator, expr)
+                elif handler is PrattParser.prefix_grouping:
+                    self.expect(RightParen(), "Expected ')' after expression.")
+                    expr = GroupingExpr(expr)
+                elif left is None:
+                    assert False, f"got unexpected frame handler: {handler}"
+                elif handler is PrattParser.infix_binary:
+                    expr = BinaryExpr(left, operator, expr)
+                elif isinstance(left, VariableExpr):
+                    expr = AssignExpr(left.name, expr)
+                elif isinstance(left, GetExpr):
+                    expr = SetExpr(left.object, left.name, expr)
+                else:
+                    self.error(operator, "Invalid assignment target")
+                    expr = left
 
-                    case DoubleEqual(), _, _:
-                        return self.is_equal(left, right)
 
-                    case _:
-                        raise Exception(f"Operand '{expr.operator.lexeme}' not supported between {type(left).__name__} and {type(right).__name__} on line {expr.operator.line}")
+@dataclass
+class Document:
+    """
+    Source text kept scanned and parsed across edits, for editors.
+
+    An edit re-scans from just before the changed text until a token starts
+    at the same place in the unchanged text after it, since from there on
+    the old tokens are still right. Likewise only the top level declarations
+    from just before the changed tokens are re-parsed, until one starts
+    where an old declaration did. Every other Token and Statement object is
+    kept.
+
+    Lines of the tokens and statements after an edit are not updated straight
+    away. Each edit just records the number of lines it added from some
+    token on, and they're all applied in one pass when `tokens`,
+    `statements` or `diagnostics` is next read. Errors are collected rather than reported
+    through Lox: scan errors by offset, and parse errors per declaration.
+    """
+    source: str
+    parser_class: type[Parser] = Parser
+
+    def __post_init__(self) -> None:
+        scan_errors: list[tuple[int, str]] = []
+        scanner = DocumentScanner(self.source, errors=scan_errors)
+        scanner.scan_tokens()
+        self._tokens = scanner.tokens
+        # Offset of each token
+        self.starts = scanner.starts
+        self.scan_errors = scan_errors
+        # Pending (token index, lines added) adjustments to token lines
+        self.line_shifts: list[tuple[int, int]] = []
+        (
+            self._statements,
+            self.statement_starts,
+            self.statement_errors,
+            self.statement_tokens,
+            _,
+        ) = self.parse_from(0, [])
+        # How much work the last edit did
+        self.rescanned = len(self._tokens)
+        self.reparsed = len(self._statements)
+
+    @property
+    def tokens(self) -> list[Token]:
+        self.settle_lines()
+        return self._tokens
+
+    @property
+    def statements(self) -> list[Optional[Statement]]:
+        self.settle_lines()
+        return self._statements
+
+    @property
+    def diagnostics(self) -> list[tuple[int, str]]:
+        """
+        The (line, message) of each scan and parse error in the document, in
+        order of line.
+        """
+        self.settle_lines()
+        diagnostics = [
+            (self.source.count("\n", 0, offset) + 1, message)
+            for offset, message in self.scan_errors
+        ]
+        diagnostics += [
+            (token.line, message)
+            for errors in self.statement_errors
+            for token, message in errors
+        ]
+        diagnostics.sort(key=lambda diagnostic: diagnostic[0])
+        return diagnostics
+
+    def settle_lines(self):
+        if not self.line_shifts:
+            return
+        shifts = sorted(self.line_shifts)
+        # Total lines added from each shifted token on
+        indices = [index for index, _ in shifts]
+        totals = list(accumulate(lines for _, lines in shifts))
+        shifts.append((len(self._tokens), 0))
+        for (index, _), (end, _), total in zip(shifts, shifts[1:], totals):
+            if total:
+                for token in self._tokens[index:end]:
+                    token.line += total
+
+        # Statements were given the lines of their tokens before the shifts
+        # too, whether they were parsed before the edits or since
+        starts = self.statement_starts
+        for declaration in range(max(bisect_right(starts, indices[0]) - 1, 0), len(starts)):
+            start = starts[declaration]
+            for statement, offset in self.statement_tokens[declaration]:
+                shift = bisect_right(indices, start + offset) - 1
+                if shift >= 0:
+                    statement.line += totals[shift]
+        self.line_shifts = []
+
+    def edit(self, offset: int, deleted: int, inserted: str):
+        """
+        Replace `deleted` characters at `offset` with `inserted`.
+        """
+        old_source = self.source
+        if not 0 <= offset <= offset + deleted <= len(old_source):
+            raise ValueError(f"Edit of {deleted} characters at {offset} is outside the document")
+        source = self.source = old_source[:offset] + inserted + old_source[offset + deleted:]
+        delta = len(inserted) - deleted
+        lines = inserted.count("\n") - old_source.count("\n", offset, offset + deleted)
+        tokens, starts = self._tokens, self.starts
+
+        # Re-scan from a token that starts at least two characters before the
+        # edit. Scanning a token looks at most two characters past it, for a
+        # number's decimal point, so the tokens before it can't have seen
+        # the edit.
+        first = bisect_right(starts, offset - 2) - 1
+        if first < 0:
+            first = restart = 0
+        else:
+            restart = starts[first]
+        scan_errors: list[tuple[int, str]] = []
+        scanner = DocumentScanner(
+            source,
+            start=restart,
+            current=restart,
+            line=source.count("\n", 0, restart) + 1,
+            errors=scan_errors,
+        )
+        damage_end = offset + len(inserted)
+        old = bisect_left(starts, offset + deleted, lo=first)
+        resync = len(tokens) - 1
+        while not scanner.is_at_end():
+            scanner.start = scanner.current
+            count = len(scanner.tokens)
+            scanner.scan_token()
+            if len(scanner.tokens) == count or scanner.start < damage_end:
+                continue
+            # The text from here on is unchanged, so if an old token started
+            # here the rest of the old tokens can be kept
+            while old < len(starts) and starts[old] + delta < scanner.start:
+                old += 1
+            if old < len(starts) and starts[old] + delta == scanner.start:
+                scanner.tokens.pop()
+                scanner.starts.pop()
+                resync = old
+                break
+
+        new_tokens = scanner.tokens
+        new_resync = first + len(new_tokens)
+        token_delta = new_resync - resync
+
+        # Replace the scan errors from the re-scanned text
+        scan_end = scanner.start if resync < len(tokens) - 1 else len(source)
+        self.scan_errors = (
+            [error for error in self.scan_errors if error[0] < restart]
+            + scan_errors
+            + [
+                (error_offset + delta, message)
+                for error_offset, message in self.scan_errors
+                if error_offset >= scan_end - delta
+            ]
+        )
+
+        # New tokens already have the right lines, so offset them by any
+        # pending shifts that will be applied to them
+        shifts = []
+        pending = 0
+        for index, shift in self.line_shifts:
+            if index <= first:
+                pending += shift
+                shifts.append((index, shift))
+            elif index < resync:
+                shifts.append((new_resync, shift))
+            else:
+                shifts.append((index + token_delta, shift))
+        if lines:
+            shifts.append((new_resync, lines))
+        self.line_shifts = shifts
+        if pending:
+            for token in new_tokens:
+                token.line -= pending
+
+        tokens[first:resync] = new_tokens
+        starts[first:resync] = scanner.starts
+        starts[new_resync:] = [start + delta for start in starts[new_resync:]]
+        self.rescanned = len(new_tokens)
+
+        self.reparse(first, resync, token_delta)
+
+    def reparse(self, first: int, resync: int, token_delta: int):
+        # Re-parse from the declaration before the one the changed tokens
+        # start in, since error recovery may have run into them
+        statement_starts = self.statement_starts
+        index = max(bisect_right(statement_starts, first) - 2, 0)
+        start = statement_starts[index] if statement_starts else 0
+        # Old declarations starting after the changed tokens, where the new
+        # ones can rejoin the old
+        kept = bisect_left(statement_starts, resync)
+        candidates = [old + token_delta for old in statement_starts[kept:]]
+
+        statements, starts, errors, statement_tokens, reached = self.parse_from(start, candidates)
+        rejoin = len(statement_starts) if reached is None else kept + reached
+        self._statements[index:rejoin] = statements
+        self.statement_errors[index:rejoin] = errors
+        self.statement_tokens[index:rejoin] = statement_tokens
+        statement_starts[index:rejoin] = starts
+        tail = index + len(statements)
+        statement_starts[tail:] = [old + token_delta for old in statement_starts[tail:]]
+        self.reparsed = len(statements)
+
+    def parse_from(self, start: int, candidates: list[int]) -> tuple[
+        list[Optional[Statement]],
+        list[int],
+        list[list[tuple[Token, str]]],
+        list[list[tuple[Statement, int]]],
+        Optional[int],
+    ]:
+        """
+        Parse declarations from token `start` to the end, or until one would
+        start at one of the sorted token indices in `candidates`. Returns the
+        declarations with their starts and errors, every statement in each
+        with the index of the token it starts at relative to the
+        declaration's start, and the index into candidates of the one
+        reached, if any.
+        """
+        parser = self.parser_class(self._tokens, current=start)
+        statements: list[Optional[Statement]] = []
+        starts: list[int] = []
+        errors: list[list[tuple[Token, str]]] = []
+        statement_tokens: list[list[tuple[Statement, int]]] = []
+        candidate = 0
+        while not parser.is_at_end():
+            while candidate < len(candidates) and candidates[candidate] < parser.current:
+                candidate += 1
+            if candidate < len(candidates) and candidates[candidate] == parser.current:
+                return statements, starts, errors, statement_tokens, candidate
+            declaration_start = parser.current
+            starts.append(declaration_start)
+            declaration_errors: list[tuple[Token, str]] = []
+            parser.errors = declaration_errors
+            parser.statement_tokens = []
+            statements.append(parser.declaration())
+            errors.append(declaration_errors)
+            # Relative, so they stay right as tokens before them come and go
+            statement_tokens.append([
+                (statement, index - declaration_start)
+                for statement, index in parser.statement_tokens
+            ])
+        return statements, starts, errors, statement_tokens, None
+
+
+@dataclass
+class Environment:
+    enclosing: Optional[Environment] = None
+    # Keyed by the interned symbol of each name rather than the name itself
+    values: dict[int, Any] = field(default_factory=dict)
+    # Upvalues for the variables here that closures have captured, by
+    # symbol, which are closed when the scope is left
+    upvalues: Optional[dict[int, Upvalue]] = field(default=None, repr=False, compare=False)
+
+    def get(self, name: Token) -> Any:
+        if name.symbol in self.values:
+            return self.values[name.symbol]
+
+        elif self.enclosing:
+            return self.enclosing.get(name)
+
+        raise Exception(f"Undefined variable {name.lexeme}.")
+
+
+    def define(self, name: Token, value: Any) -> None:
+        assert name.symbol is not None
+        self.values[name.symbol] = value
+
+    def depth(self, name: Token) -> int:
+        """
+        Number of enclosing environments get walks through to find name.
+        """
+        environment = self
+        depth = 0
+        while environment.enclosing and name.symbol not in environment.values:
+            environment = environment.enclosing
+            depth += 1
+        return depth
+
+    def assign(self, name: Token, value: Any) -> Any:
+        if name.symbol in self.values:
+            self.values[name.symbol] = value
+            return value
+
+        elif self.enclosing:
+            return self.enclosing.assign(name, value)
+
+        raise Exception(f"Undefined variable {name.lexeme}.")
+
+    def capture(self, symbol: int) -> Upvalue:
+        """
+        The upvalue for the variable symbol here, shared by every closure
+        that captures it.
+        """
+        if self.upvalues is None:
+            self.upvalues = {}
+        upvalue = self.upvalues.get(symbol)
+        if upvalue is None:
+            upvalue = self.upvalues[symbol] = Upvalue(self, symbol)
+        return upvalue
+
+    def close(self) -> None:
+        """
+        Called when the scope is left, so that closures keep the variables
+        they captured from it without keeping the scope.
+        """
+        if self.upvalues is None:
+            return
+        for upvalue in self.upvalues.values():
+            upvalue.close()
+        self.upvalues = None
+
+
+class Upvalue:
+    """
+    A variable captured by closures. While the scope it's declared in is
+    still running, it's open, and reads and writes the variable in the
+    scope's environment. When the scope is left it's closed, and holds the
+    value itself from then on.
+    """
+    __slots__ = ("environment", "symbol", "value")
+
+    def __init__(self, environment: Optional[Environment], symbol: int, value: Any = None):
+        self.environment = environment
+        self.symbol = symbol
+        self.value = value
+
+    def get(self) -> Any:
+        if self.environment is None:
+            return self.value
+        return self.environment.values[self.symbol]
+
+    def set(self, value: Any) -> None:
+        if self.environment is None:
+            self.value = value
+        else:
+            self.environment.values[self.symbol] = value
+
+    def close(self) -> None:
+        if self.environment is not None:
+            self.value = self.environment.values.get(self.symbol)
+            self.environment = None
+
+
+class LateUpvalue(Upvalue):
+    """
+    A variable a closure uses that an enclosing local scope declares only
+    after the closure is made, like a function calling one declared after it.
+    Until the variable is declared, the name is a global to the closure, and
+    from then on it's captured like any other.
+    """
+    __slots__ = ("name", "captured")
+
+    def __init__(self, environment: Optional[Environment], name: Token):
+        super().__init__(environment, symbol_of(name))
+        self.name = name
+        self.captured: Optional[Upvalue] = None
+
+    def capture(self) -> Optional[Upvalue]:
+        """
+        The Upvalue of the variable, once a scope the closure was made in has
+        declared it.
+        """
+        if self.captured is None:
+            scope = self.environment
+            while scope is not None and scope.enclosing is not None:
+                if self.symbol in scope.values:
+                    if type(scope) is ClosureEnvironment:
+                        self.captured = scope.values[self.symbol]
+                    else:
+                        self.captured = scope.capture(self.symbol)
+                    # The scopes aren't needed any more
+                    self.environment = None
+                    break
+                scope = scope.enclosing
+        return self.captured
+
+    def globals(self) -> Environment:
+        assert self.environment is not None
+        scope = self.environment
+        while scope.enclosing is not None:
+            scope = scope.enclosing
+        return scope
+
+    def get(self) -> Any:
+        captured = self.capture()
+        if captured is None:
+            return self.globals().get(self.name)
+        return captured.get()
+
+    def set(self, value: Any) -> None:
+        captured = self.capture()
+        if captured is None:
+            self.globals().assign(self.name, value)
+        else:
+            captured.set(value)
+
+
+class ClosureEnvironment(Environment):
+    """
+    The environment a closure's calls are enclosed by, which holds an
+    Upvalue for each of the function's free variables that isn't a global,
+    and is enclosed by the globals. So a captured variable is found in one
+    step, and a closure keeps only what it uses alive rather than every
+    scope it was declared in.
+    """
+
+    def get(self, name: Token) -> Any:
+        # Always enclosed by the globals, and only names have a symbol
+        assert name.symbol is not None and self.enclosing is not None
+        upvalue = self.values.get(name.symbol)
+        if upvalue is not None:
+            return upvalue.get()
+        return self.enclosing.get(name)
+
+    def assign(self, name: Token, value: Any) -> Any:
+        assert name.symbol is not None and self.enclosing is not None
+        upvalue = self.values.get(name.symbol)
+        if upvalue is not None:
+            upvalue.set(value)
+            return value
+        return self.enclosing.assign(name, value)
+
+
+
+class LoxArray:
+    """
+    Numeric array value, stored contiguously as doubles.
+
+    The storage is a NumPy array when NumPy is installed and an array('d')
+    otherwise. Arithmetic and comparison operators between arrays of the same
+    length, or an array and a number, are applied element-wise in one call
+    into the backend rather than one interpreter dispatch per element.
+    Comparisons produce arrays of 1 and 0. `==` and `!=` compare whole arrays.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def from_values(cls, values: Iterable[float]) -> LoxArray:
+        if numpy is not None:
+            return cls(numpy.fromiter(values, dtype=numpy.float64))
+        return cls(array("d", values))
+
+    @classmethod
+    def broadcast(cls, operator: Token, left, right) -> LoxArray:
+        function = ARRAY_OPERATORS[type(operator.token_type)]
+        left_data = left.data if type(left) is LoxArray else left
+        right_data = right.data if type(right) is LoxArray else right
+        if (
+            type(left) is LoxArray
+            and type(right) is LoxArray
+            and len(left_data) != len(right_data)
+        ):
+            raise Exception(
+                f"Operand '{operator.lexeme}' needs arrays of the same length, "
+                f"got {len(left_data)} and {len(right_data)} on line {operator.line}"
+            )
+
+        if numpy is not None:
+            with numpy.errstate(divide="raise", invalid="raise"):
+                result = function(left_data, right_data)
+            return cls(result.astype(numpy.float64, copy=False))
+
+        if type(left) is not LoxArray:
+            left_data = repeat(left_data, len(right_data))
+        elif type(right) is not LoxArray:
+            right_data = repeat(right_data, len(left_data))
+        return cls(array("d", map(function, left_data, right_data)))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index: int) -> float:
+        return float(self.data[index])
+
+    def __iter__(self):
+        return map(float, self.data)
+
+    def __neg__(self) -> LoxArray:
+        if numpy is not None:
+            return LoxArray(-self.data)
+        return LoxArray(array("d", map(neg, self.data)))
+
+    def __eq__(self, other):
+        if type(other) is not LoxArray:
+            return False
+        if numpy is not None:
+            return bool(numpy.array_equal(self.data, other.data))
+        return self.data == other.data
+
+    def __hash__(self):
+        # Arrays are never modified in place, so they can key memoized calls
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return f"LoxArray({list(self)!r})"
+
+    def sum(self) -> float:
+        if numpy is not None:
+            return float(self.data.sum())
+        return float(sum(self.data))
+
+    def min(self) -> float:
+        if not len(self.data):
+            raise ValueError("of an empty array")
+        return float(self.data.min() if numpy is not None else min(self.data))
+
+    def max(self) -> float:
+        if not len(self.data):
+            raise ValueError("of an empty array")
+        return float(self.data.max() if numpy is not None else max(self.data))
+
+
+# Operators that broadcast over arrays, keyed by token type class, and the
+# operand types they accept
+ARRAY_OPERATORS = {
+    Plus: add,
+    Minus: sub,
+    Star: mul,
+    Slash: truediv,
+    Greater: gt,
+    GreaterEqual: ge,
+    Less: lt,
+    LessEqual: le,
+}
+ARRAY_OPERANDS = (LoxArray, float)
+
+
+@dataclass(frozen=True)
+class NativeFunction:
+    name: str
+    arity: int
+    function: Callable = field(compare=False)
+    # Whether memoized functions may call it, see check_pure
+    pure: bool = field(default=False, compare=False)
+
+    def __str__(self):
+        return "<native fn>"
+
+
+@dataclass(eq=False)
+class GreenThread:
+    """
+    A Lox function started by spawn. It runs on a Python thread of its own,
+    but only while the Scheduler has given it the turn, so green threads
+    take turns rather than running at once.
+    """
+    function: Any
+    thread: Optional[threading.Thread] = field(default=None, repr=False)
+    result: Any = None
+    done: bool = False
+    # Green threads waiting in join for this one to finish
+    joiners: list[GreenThread] = field(default_factory=list, repr=False)
+    # The interpreter's state while another green thread has the turn
+    environment: Environment = field(default_factory=Environment, repr=False)
+    return_value: Any = field(default=None, repr=False)
+    # Set when the Scheduler gives this green thread the turn, so that only
+    # it wakes
+    turn: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def __str__(self):
+        return "<green thread>"
+
+
+@dataclass(eq=False)
+class Channel:
+    """
+    A queue of values between green threads, made by the channel native.
+    Sending waits while `capacity` values are already queued, and receiving
+    waits until there's a value, or returns nil once the channel is closed
+    and empty.
+    """
+    capacity: int
+    buffer: deque = field(default_factory=deque, repr=False)
+    closed: bool = False
+    # Green threads waiting for room, or for a value
+    senders: deque[GreenThread] = field(default_factory=deque, repr=False)
+    receivers: deque[GreenThread] = field(default_factory=deque, repr=False)
+
+    def __str__(self):
+        return "<channel>"
+
+
+def expect(name: str, value, *types: type):
+    if type(value) not in types:
+        expected = " or ".join(TYPE_NAMES[t] for t in types)
+        raise NativeError(f"{name}() expects {expected}, got {Interpreter.type_name(value)}")
+    return value
+
+
+def expect_index(name: str, value) -> int:
+    if type(value) is not float or not value.is_integer():
+        raise NativeError(f"{name}() expects a whole number, got {Interpreter.stringify(value)}")
+    return int(value)
+
+
+def native_len(value) -> float:
+    return float(len(expect("len", value, str, LoxArray)))
+
+
+def native_substring(string, start, end) -> str:
+    string = expect("substring", string, str)
+    start = expect_index("substring", start)
+    end = expect_index("substring", end)
+    if not 0 <= start <= end <= len(string):
+        raise NativeError(f"substring() range {start} to {end} is out of bounds")
+    return string[start:end]
+
+
+def native_find(string, needle) -> float:
+    return float(expect("find", string, str).find(expect("find", needle, str)))
+
+
+def native_num(string) -> Optional[float]:
+    # nil rather than an error for text that isn't a number, so scripts can
+    # validate input
+    try:
+        value = float(expect("num", string, str))
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+def native_fixed(number, digits) -> str:
+    return f"{expect('fixed', number, float):.{expect_index('fixed', digits)}f}"
+
+
+def native_sqrt(number) -> float:
+    if expect("sqrt", number, float) < 0:
+        raise NativeError("sqrt() of a negative number")
+    return math.sqrt(number)
+
+
+def native_pow(base, exponent) -> float:
+    try:
+        return math.pow(expect("pow", base, float), expect("pow", exponent, float))
+    except (ValueError, OverflowError) as exc:
+        raise NativeError(f"pow() {exc}") from exc
+
+
+def native_fill(length, value) -> LoxArray:
+    length = expect_index("fill", length)
+    if length < 0:
+        raise NativeError("fill() length can't be negative")
+    return LoxArray.from_values(repeat(expect("fill", value, float), length))
+
+
+def native_memoize(function, size) -> MemoizedFunction:
+    if type(function) is not LoxFunction:
+        raise NativeError(f"memoize() expects a function, got {Interpreter.type_name(function)}")
+    size = expect_index("memoize", size)
+    if size < 1:
+        raise NativeError("memoize() cache size must be at least 1")
+    bindings: list[tuple[Environment, Token, Any]] = []
+    reason = check_pure(function, bindings=bindings)
+    if reason is not None:
+        raise NativeError(f"memoize() needs a pure function, but {function} {reason}")
+    return MemoizedFunction(function, size, bindings)
+
+
+def memoized(name: str, value) -> MemoizedFunction:
+    if type(value) is not MemoizedFunction:
+        raise NativeError(f"{name}() expects a memoized function, got {Interpreter.type_name(value)}")
+    return value
+
+
+def array_reduction(name: str, method: Callable) -> Callable:
+    def reduce(array):
+        array = expect(name, array, LoxArray)
+        try:
+            return method(array)
+        except ValueError as exc:
+            raise NativeError(f"{name}() {exc.args[0]}") from exc
+    return reduce
+
+
+TYPE_NAMES = {
+    float: "a number",
+    str: "a string",
+    LoxArray: "an array",
+    Channel: "a channel",
+    GreenThread: "a green thread",
+}
+
+# Functions defined in every interpreter's global environment
+STANDARD_LIBRARY = (
+    NativeFunction("clock", 0, time.perf_counter),
+    NativeFunction("sqrt", 1, native_sqrt, pure=True),
+    NativeFunction("floor", 1, lambda x: float(math.floor(expect("floor", x, float))), pure=True),
+    NativeFunction("ceil", 1, lambda x: float(math.ceil(expect("ceil", x, float))), pure=True),
+    NativeFunction("abs", 1, lambda x: abs(expect("abs", x, float)), pure=True),
+    NativeFunction("pow", 2, native_pow, pure=True),
+    NativeFunction("min", 2, lambda a, b: min(expect("min", a, float), expect("min", b, float)), pure=True),
+    NativeFunction("max", 2, lambda a, b: max(expect("max", a, float), expect("max", b, float)), pure=True),
+    NativeFunction("len", 1, native_len, pure=True),
+    NativeFunction("substring", 3, native_substring, pure=True),
+    NativeFunction("find", 2, native_find, pure=True),
+    NativeFunction("num", 1, native_num, pure=True),
+    NativeFunction("str", 1, lambda value: Interpreter.stringify(value), pure=True),
+    NativeFunction("fixed", 2, native_fixed, pure=True),
+    NativeFunction("fill", 2, native_fill, pure=True),
+    NativeFunction("sum", 1, array_reduction("sum", LoxArray.sum), pure=True),
+    NativeFunction("amin", 1, array_reduction("amin", LoxArray.min), pure=True),
+    NativeFunction("amax", 1, array_reduction("amax", LoxArray.max), pure=True),
+    NativeFunction("memoize", 2, native_memoize),
+    NativeFunction("cacheHits", 1, lambda f: float(memoized("cacheHits", f).hits)),
+    NativeFunction("cacheMisses", 1, lambda f: float(memoized("cacheMisses", f).misses)),
+)
+
+
+# Most block scopes an Interpreter keeps for reuse
+FREE_ENVIRONMENTS_LIMIT = 64
+
+# Signals returned by Interpreter.execute for return statements
+RETURN = "return"
+TAIL_CALL = "tail call"
+
+
+class LoxFunction:
+    """
+    A function declaration with its closure, the environment its calls are
+    enclosed by: the globals, or a ClosureEnvironment with the variables it
+    captured where it was declared.
+
+    The parameter symbols are gathered once here, so a call builds its frame
+    with a single dict(zip(...)) and runs the body directly in it, without
+    the extra block Environment the body's braces would otherwise get.
+    """
+    __slots__ = ("declaration", "closure", "params", "arity", "is_initializer")
+
+    def __init__(
+        self,
+        declaration: FunctionStatement,
+        closure: Environment,
+        is_initializer: bool = False,
+    ):
+        self.declaration = declaration
+        self.closure = closure
+        self.params = tuple(symbol_of(param) for param in declaration.params)
+        self.arity = len(self.params)
+        self.is_initializer = is_initializer
+
+    def __str__(self):
+        return f"<fn {self.declaration.name.lexeme}>"
+
+    def check_arity(self, arguments: list, paren: Token):
+        if len(arguments) != self.arity:
+            raise Exception(f"Expected {self.arity} arguments but got {len(arguments)} on line {paren.line}")
+
+    def call(self, interpreter: Interpreter, arguments: list, this: Optional[LoxInstance] = None):
+        """
+        Call the function. Methods are called with the instance as `this`,
+        which goes in the same frame as the parameters rather than an
+        environment of its own.
+        """
+        previous = interpreter.environment
+        function = self
+        environment = None
+        try:
+            while True:
+                frame = dict(zip(function.params, arguments))
+                if this is not None:
+                    frame[THIS] = this
+                interpreter.environment = environment = Environment(function.closure, frame)
+                signal = None
+                for statement in function.declaration.body:
+                    signal = interpreter.execute(statement)
+                    if signal is not None:
+                        break
+
+                if signal is TAIL_CALL:
+                    # Loop around to run the tail call in this same frame
+                    function, arguments, this = interpreter.return_value
+                    if environment.upvalues is not None:
+                        environment.close()
+                    continue
+                if function.is_initializer:
+                    return this
+                if signal is RETURN:
+                    return interpreter.return_value
+                return None
+        finally:
+            interpreter.environment = previous
+            if environment is not None and environment.upvalues is not None:
+                environment.close()
+
+
+class LoxBoundMethod:
+    __slots__ = ("function", "this")
+
+    def __init__(self, function: LoxFunction, this: LoxInstance):
+        self.function = function
+        self.this = this
+
+    def __str__(self):
+        return str(self.function)
+
+
+class Shape:
+    """
+    Hidden class describing the layout of instances' fields.
+
+    Each class has a root shape with no fields, and adding a field moves an
+    instance along a transition to a shape with that field appended. So
+    instances given the same fields in the same order share a shape, and a
+    shape identifies both an instance's class and where each field is in its
+    slot list. Shapes are never modified once made.
+    """
+    __slots__ = ("klass", "indices", "transitions")
+
+    def __init__(self, klass: LoxClass, indices: dict[int, int]):
+        self.klass = klass
+        # Slot index of each field, keyed by interned name
+        self.indices = indices
+        self.transitions: dict[int, Shape] = {}
+
+    def add(self, name: int) -> Shape:
+        shape = self.transitions.get(name)
+        if shape is None:
+            shape = Shape(self.klass, {**self.indices, name: len(self.indices)})
+            self.transitions[name] = shape
+        return shape
+
+
+class LoxClass:
+    __slots__ = ("name", "superclass", "methods", "method_cache", "shape")
+
+    def __init__(
+        self,
+        name: str,
+        superclass: Optional[LoxClass],
+        methods: dict[int, LoxFunction],
+    ):
+        self.name = name
+        self.superclass = superclass
+        self.methods = methods
+        # Methods found through the superclasses. Classes can't change once
+        # declared, so entries never need invalidating.
+        self.method_cache: dict[int, Optional[LoxFunction]] = {}
+        self.shape = Shape(self, {})
+
+    def __str__(self):
+        return self.name
+
+    def find_method(self, name: int) -> Optional[LoxFunction]:
+        try:
+            return self.method_cache[name]
+        except KeyError:
+            pass
+        method = self.methods.get(name)
+        if method is None and self.superclass is not None:
+            method = self.superclass.find_method(name)
+        self.method_cache[name] = method
+        return method
+
+
+class LoxInstance:
+    __slots__ = ("shape", "fields")
+
+    def __init__(self, klass: LoxClass):
+        self.shape = klass.shape
+        # Field values, at the indices given by the shape
+        self.fields: list[Any] = []
+
+    def __str__(self):
+        return f"{self.shape.klass.name} instance"
+
+
+class MemoizedFunction:
+    """
+    A pure LoxFunction whose results are cached in an LRU keyed on the types
+    and values of its arguments, made by the memoize native.
+
+    Its purity depends on what the names it calls through are bound to, so
+    they're checked before each call, and if any has been bound to something
+    else since, the function is checked again and the cache cleared.
+    """
+    __slots__ = ("function", "cache", "interpreter", "bindings")
+
+    def __init__(self, function: LoxFunction, size: int, bindings: list[tuple[Environment, Token, Any]]):
+        self.function = function
+        # Set by Interpreter.call, outside of the cache key
+        self.interpreter: Optional[Interpreter] = None
+        # The (closure, name, value) of each callee check_pure found
+        self.bindings = bindings
+
+        def call(*arguments):
+            return function.call(self.interpreter, list(arguments))
+
+        self.cache = lru_cache(maxsize=size, typed=True)(call)
+
+    def __str__(self):
+        return f"<memoized {self.function}>"
+
+    def lookup(self, arguments: list[Any]) -> Any:
+        """
+        The result of calling the function with arguments, from the cache
+        if it's there.
+        """
+        # The cache can't tell -0.0 from 0.0, though the result can depend
+        # on which it is, so calls with -0.0 always go to the function
+        for argument in arguments:
+            if type(argument) is float and argument == 0 and math.copysign(1, argument) < 0:
+                assert self.interpreter is not None
+                return self.function.call(self.interpreter, arguments)
+        return self.cache(*arguments)
+
+    def check_bindings(self) -> Optional[str]:
+        """
+        Check the function again if any callee it was checked with has been
+        rebound, returning why it's no longer pure, or None if it still is.
+        """
+        for closure, name, value in self.bindings:
+            try:
+                if closure.get(name) is value:
+                    continue
+            except Exception:
+                pass
+            bindings: list[tuple[Environment, Token, Any]] = []
+            reason = check_pure(self.function, bindings=bindings)
+            if reason is None:
+                self.bindings = bindings
+                self.cache.cache_clear()
+            return reason
+        return None
+
+    @property
+    def hits(self) -> int:
+        return self.cache.cache_info().hits
+
+    @property
+    def misses(self) -> int:
+        return self.cache.cache_info().misses
+
+
+def check_pure(
+    function: LoxFunction,
+    checking: Optional[set[int]] = None,
+    bindings: Optional[list[tuple[Environment, Token, Any]]] = None,
+) -> Optional[str]:
+    """
+    Check that calling function can't have side effects or depend on state
+    other than its arguments, returning why not or None if it's pure.
+
+    This is conservative: functions that print, assign to or read
+    non-local variables, declare nested functions, or call anything other
+    than pure natives and functions that pass this check themselves are
+    rejected. Callees are checked as they're bound when this is called,
+    and each one found is added to bindings as (closure, name, value), so
+    that MemoizedFunction can tell when that's changed.
+    """
+    if checking is None:
+        checking = set()
+    # Recursive and mutually recursive calls are checked once
+    checking.add(id(function.declaration))
+    closure = function.closure
+
+    def callee(expr: Expr, scopes: list[set[int]]) -> Optional[str]:
+        if type(expr) is not VariableExpr or any(expr.name.symbol in scope for scope in scopes):
+            return "calls a function that isn't known until it runs"
+        try:
+            value = closure.get(expr.name)
+        except Exception:
+            return f"calls undefined '{expr.name.lexeme}'"
+        if bindings is not None:
+            bindings.append((closure, expr.name, value))
+        if type(value) is LoxFunction:
+            if id(value.declaration) in checking:
+                return None
+            reason = check_pure(value, checking, bindings)
+            return reason and f"calls {value}, which {reason}"
+        if type(value) is MemoizedFunction or type(value) is NativeFunction and value.pure:
+            return None
+        return f"calls {Interpreter.stringify(value)}, which isn't pure"
+
+    def expression(expr: Expr, scopes: list[set[int]]) -> Optional[str]:
+        match expr:
+            case LiteralExpr():
+                return None
+            case VariableExpr():
+                if any(expr.name.symbol in scope for scope in scopes):
+                    return None
+                return f"reads non-local variable '{expr.name.lexeme}'"
+            case AssignExpr():
+                if not any(expr.name.symbol in scope for scope in scopes):
+                    return f"assigns to non-local variable '{expr.name.lexeme}'"
+                return expression(expr.value, scopes)
+            case CallExpr():
+                children = expr.arguments
+                reason = callee(expr.callee, scopes)
+                if reason is not None:
+                    return reason
+            case UnaryExpr():
+                children = [expr.right]
+            case BinaryExpr():
+                children = [expr.left, expr.right]
+            case GroupingExpr():
+                children = [expr.expression]
+            case ArrayExpr():
+                children = expr.elements
+            case IndexExpr():
+                children = [expr.array, expr.index]
+            case _:
+                return f"uses {type(expr).__name__}"
+
+        for child in children:
+            reason = expression(child, scopes)
+            if reason is not None:
+                return reason
+        return None
+
+    def statements(stmts: list[Statement], scopes: list[set[int]]) -> Optional[str]:
+        for stmt in stmts:
+            match stmt:
+                case PrintStatement():
+                    return "prints"
+                case ExpressionStatement():
+                    reason = expression(stmt.expression, scopes)
+                case VariableStatement():
+                    reason = None
+                    if stmt.initializer:
+                        reason = expression(stmt.initializer, scopes)
+                    scopes[-1].add(symbol_of(stmt.name))
+                case ReturnStatement():
+                    reason = None
+                    if stmt.value is not None:
+                        reason = expression(stmt.value, scopes)
+                case IfStatement():
+                    reason = (
+                        expression(stmt.condition, scopes)
+                        or statements([stmt.then_branch], scopes)
+                        or statements([stmt.else_branch] if stmt.else_branch else [], scopes)
+                    )
+                case BlockStatement():
+                    reason = statements(stmt.statements, scopes + [set()])
+                case WhileStatement():
+                    reason = (
+                        expression(stmt.condition, scopes)
+                        or statements([stmt.body], scopes)
+                        or (stmt.increment and expression(stmt.increment, scopes))
+                        or None
+                    )
+                case FunctionStatement():
+                    return "declares a nested function"
+                case BreakpointStatement() | CoverageStatement():
+                    reason = statements([stmt.statement], scopes)
+                case _:
+                    return f"uses {type(stmt).__name__}"
+            if reason is not None:
+                return reason
+        return None
+
+    return statements(function.declaration.body, [set(function.params)])
+
+
+@dataclass
+class Budget:
+    """
+    Execution limits for running untrusted scripts.
+
+    `max_steps` limits the number of statements executed plus expressions
+    evaluated, `timeout` is a wall-clock limit in seconds from the start of
+    each Interpreter.interpret, and `max_string_length` limits the total
+    number of characters in strings produced by `+`. Exceeding any of them
+    raises BudgetExceeded.
+
+    Steps are counted in calls to evaluate, so they mean something different
+    on a StackInterpreter: it evaluates a whole expression tree in one call,
+    which is one step however many nodes it has. There, `max_steps` limits
+    statements plus the expressions they evaluate directly.
+
+    Nothing is checked unless a budget is installed on an interpreter, which
+    replaces its execute, evaluate, binary and concatenate methods with
+    counting wrappers for the duration of a run. Steps are counted down in
+    batches of `check_interval`, and the clock is only read between batches.
+    """
+    max_steps: Optional[int] = None
+    timeout: Optional[float] = None
+    max_string_length: Optional[int] = None
+    check_interval: int = 1024
+
+    # Usage so far in the current run
+    steps: int = field(default=0, compare=False)
+    string_length: int = field(default=0, compare=False)
+
+    def install(self, interpreter: Interpreter):
+        self.steps = 0
+        self.string_length = 0
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+
+        # Size of the batch currently being counted down, so steps stays
+        # exact when the limit isn't a multiple of the interval.
+        batch = self.next_batch()
+        countdown = batch
+
+        def tick():
+            nonlocal batch, countdown
+            self.steps += batch
+            if self.max_steps is not None and self.steps > self.max_steps:
+                raise BudgetExceeded(
+                    f"Execution budget exceeded: more than {self.max_steps} steps."
+                )
+            if deadline is not None and time.monotonic() > deadline:
+                raise BudgetExceeded(
+                    f"Execution budget exceeded: ran for more than {self.timeout} seconds."
+                )
+            batch = countdown = self.next_batch()
+
+        inner_execute = interpreter.execute
+        inner_evaluate = interpreter.evaluate
+        inner_binary = interpreter.binary
+        inner_concatenate = interpreter.concatenate
+
+        def execute(stmt):
+            nonlocal countdown
+            countdown -= 1
+            if not countdown:
+                tick()
+            return inner_execute(stmt)
+
+        def evaluate(expr):
+            nonlocal countdown
+            countdown -= 1
+            if not countdown:
+                tick()
+            return inner_evaluate(expr)
+
+        def count(result):
+            self.string_length += len(result)
+            if self.string_length > self.max_string_length:
+                raise BudgetExceeded(
+                    f"Execution budget exceeded: more than "
+                    f"{self.max_string_length} string characters produced."
+                )
+
+        def binary(operator, left, right):
+            result = inner_binary(operator, left, right)
+            if type(result) is str:
+                count(result)
+            return result
+
+        def concatenate(left, right):
+            result = inner_concatenate(left, right)
+            count(result)
+            return result
+
+        interpreter.execute = execute
+        interpreter.evaluate = evaluate
+        if self.max_string_length is not None:
+            interpreter.binary = binary
+            interpreter.concatenate = concatenate
+
+        def uninstall():
+            # Put back whatever was there before, which is usually the
+            # interpreter's own methods
+            interpreter.execute = inner_execute
+            interpreter.evaluate = inner_evaluate
+            interpreter.binary = inner_binary
+            interpreter.concatenate = inner_concatenate
+
+        return uninstall
+
+    def next_batch(self) -> int:
+        if self.max_steps is None:
+            return self.check_interval
+        # One past the limit, so that the step exceeding it is the one to fail
+        return max(1, min(self.check_interval, self.max_steps + 1 - self.steps))
+
+
+@dataclass
+class ParsedModule:
+    mtime_ns: int
+    digest: bytes
+    statements: list[Statement]
+
+
+# Every module parsed in this process, by path and the scanner and parser
+# classes that parsed it, for Importers to share
+PARSED_MODULES: dict[tuple[Path, type, type], ParsedModule] = {}
+
+
+@dataclass
+class Importer:
+    """
+    Finds, parses and runs the modules imported by an Interpreter.
+
+    A module is looked for relative to the file importing it, or the current
+    directory for source that isn't from a file, and then in each directory
+    of `search_path`. It's run the first time an import of it is executed,
+    with its declarations going into the globals, and never again by the
+    same importer.
+
+    Parsed modules are kept in PARSED_MODULES for the life of the process.
+    A module is reused without reading it while its file's mtime is
+    unchanged, and without re-parsing it while its contents hash the same.
+    The cached statements are never run: each importer gets its own copy,
+    since running them fills inline caches, and a Debugger or Coverage
+    patches them in place.
+    """
+    search_path: list[Path] = field(default_factory=list)
+    scanner_class: type[Scanner] = Scanner
+    parser_class: type[Parser] = Parser
+    # Modules that have been run, and the ones running, innermost last
+    loaded: set[Path] = field(default_factory=set)
+    running: list[Path] = field(default_factory=list)
+
+    def resolve(self, name: str, origin: Optional[Path]) -> Optional[Path]:
+        directory = origin.parent if origin is not None else Path.cwd()
+        for directory in [directory, *self.search_path]:
+            path = directory / name
+            if path.is_file():
+                return path.resolve()
+        return None
+
+    def parse(self, path: Path) -> list[Statement]:
+        return copy.deepcopy(self.parsed(path).statements)
+
+    def parsed(self, path: Path) -> ParsedModule:
+        key = (path, self.scanner_class, self.parser_class)
+        mtime_ns = path.stat().st_mtime_ns
+        module = PARSED_MODULES.get(key)
+        if module is not None and module.mtime_ns == mtime_ns:
+            return module
+
+        contents = path.read_bytes()
+        digest = hashlib.sha256(contents).digest()
+        if module is not None and module.digest == digest:
+            module.mtime_ns = mtime_ns
+            return module
+
+        source = contents.decode()
+        scanner = self.scanner_class(source, errors=[])
+        parser = self.parser_class(scanner.scan_tokens(), errors=[], path=path)
+        parsed = parser.parse()
+        if scanner.errors:
+            offset, message = scanner.errors[0]
+            line = source.count("\n", 0, offset) + 1
+            raise Exception(f"{message} in {path.name} on line {line}")
+        if parser.errors:
+            token, message = parser.errors[0]
+            raise Exception(f"{message} in {path.name} on line {token.line}")
+        # Without errors, every declaration parsed
+        statements = [statement for statement in parsed if statement is not None]
+        module = PARSED_MODULES[key] = ParsedModule(mtime_ns, digest, statements)
+        return module
+
+    @contextmanager
+    def run(self, path: Path):
+        """
+        Mark path as running for the duration, so that importing it is
+        caught as a cycle.
+        """
+        self.running.append(path)
+        try:
+            yield
+        finally:
+            self.running.pop()
+
+
+# Commands for a Debugger to carry on with after pausing
+CONTINUE = "continue"
+STEP = "step"
+NEXT = "next"
+
+
+@dataclass
+class Pause:
+    """
+    A statement the Debugger has stopped before, and the environment it's
+    about to run in.
+    """
+    statement: Statement
+    environment: Environment
+
+    @property
+    def line(self) -> int:
+        return self.statement.line
+
+    def scopes(self) -> list[dict[str, Any]]:
+        """
+        The variables in each environment the statement can see, by name,
+        innermost first and ending with the globals.
+        """
+        scopes = []
+        environment: Optional[Environment] = self.environment
+        while environment is not None:
+            scope = {}
+            for symbol, value in environment.values.items():
+                if type(value) is LateUpvalue:
+                    # A global until it's declared, so shown with those
+                    value = value.capture()
+                    if value is None:
+                        continue
+                if type(value) is Upvalue:
+                    value = value.get()
+                scope[symbols.name(symbol)] = value
+            scopes.append(scope)
+            environment = environment.enclosing
+        return scopes
+
+    def variables(self) -> dict[str, Any]:
+        """
+        Every variable the statement can see, by name, without the ones
+        shadowed by an inner scope.
+        """
+        variables: dict[str, Any] = {}
+        for scope in self.scopes():
+            for name, value in scope.items():
+                variables.setdefault(name, value)
+        return variables
+
+
+@dataclass
+class Debugger:
+    """
+    Line breakpoints and single-stepping for an Interpreter.
+
+    Each time the debugger stops before a statement, it calls `on_pause` with
+    a Pause, and carries on as the command it returns says: CONTINUE runs
+    until the next breakpoint, STEP stops before the next statement to run,
+    going into calls, and NEXT runs the statement, including any calls and
+    nested statements, and stops before whichever statement runs after it.
+
+    Nothing is checked while the debugger isn't needed. Breakpoints replace
+    the statements on their line with BreakpointStatements in the programs
+    the interpreter has run, which Interpreter.execute checks for last, and
+    only stepping replaces the interpreter's execute with a wrapper that
+    stops before each statement. So an interpreter can be given a debugger
+    without any breakpoints, and a front end can set them, from another
+    thread too, once it has something to look at.
+    """
+    on_pause: Callable[[Pause], str]
+    breakpoints: set[int] = field(default_factory=set)
+
+    stepping: bool = field(default_factory=lambda: False, init=False)
+    # Every program the interpreter has been given, for setting breakpoints in
+    programs: list[list[Statement]] = field(default_factory=list, init=False, repr=False)
+    interpreter: Optional[Interpreter] = field(default_factory=lambda: None, init=False, repr=False)
+    # Number of times the debugger has paused
+    pauses: int = field(default_factory=lambda: 0, init=False)
+    # The stepping wrapper while it's installed, and the execute it replaced
+    wrapper: Optional[Callable] = field(default_factory=lambda: None, init=False, repr=False)
+    saved: Optional[Callable] = field(default_factory=lambda: None, init=False, repr=False)
+
+    def start(self, interpreter: Interpreter, statements: list[Statement]):
+        """
+        Called by the interpreter before running statements.
+        """
+        self.interpreter = interpreter
+        self.load(statements)
+        if self.stepping:
+            self.install()
+
+    def load(self, statements: list[Statement]):
+        """
+        Set the breakpoints in statements, as well as in any that are loaded
+        later, such as imported modules.
+        """
+        if any(program is statements for program in self.programs):
+            return
+        self.programs.append(statements)
+        for line in self.breakpoints:
+            self.patch(statements, line)
+
+    def stop(self):
+        """
+        Called by the interpreter after running statements, so that its
+        execute is left as it found it.
+        """
+        self.uninstall()
+
+    def set_breakpoint(self, line: int):
+        self.breakpoints.add(line)
+        for statements in self.programs:
+            self.patch(statements, line)
+
+    def clear_breakpoint(self, line: int):
+        self.breakpoints.discard(line)
+        for statements in self.programs:
+            for container, key, stmt in statement_slots(statements, line):
+                if type(stmt) is BreakpointStatement and stmt.line == line:
+                    container[key] = stmt.statement
+
+    def interrupt(self):
+        """
+        Stop before the next statement that runs.
+        """
+        self.stepping = True
+        if self.interpreter is not None:
+            self.install()
+
+    def patch(self, statements: list[Statement], line: int):
+        for container, key, stmt in statement_slots(statements, line):
+            if stmt.line == line and type(stmt) is not BreakpointStatement:
+                container[key] = BreakpointStatement(stmt, self, line=line)
+
+    def pause(self, interpreter: Interpreter, statement: Statement, execute: Callable):
+        """
+        Stop before statement, then run it with execute as the front end
+        says.
+        """
+        self.pauses += 1
+        pauses = self.pauses
+        command = self.on_pause(Pause(statement, interpreter.environment))
+        if command == STEP:
+            self.stepping = True
+            self.install()
+            return execute(statement)
+        if command == CONTINUE:
+            self.stepping = False
+            self.uninstall()
+            return execute(statement)
+        if command == NEXT:
+            self.stepping = False
+            self.install()
+            try:
+                return execute(statement)
+            finally:
+                # Unless the front end has said otherwise since, from a
+                # breakpoint within the statement
+                if self.pauses == pauses:
+                    self.stepping = True
+        raise ValueError(f"Unknown debugger command {command!r}.")
+
+    def install(self) -> None:
+        interpreter = self.interpreter
+        if interpreter is None or (self.wrapper is not None and interpreter.execute is self.wrapper):
+            return
+        inner = interpreter.execute
+
+        def execute(stmt: Statement) -> Optional[str]:
+            if self.stepping and not isinstance(stmt, WRAPPER_STATEMENTS):
+                return self.pause(interpreter, stmt, inner)
+            return inner(stmt)
+
+        self.saved = inner
+        self.wrapper = execute
+        interpreter.execute = execute
+
+    def uninstall(self) -> None:
+        interpreter = self.interpreter
+        if (
+            interpreter is None
+            or self.wrapper is None
+            or self.saved is None
+            or interpreter.execute is not self.wrapper
+        ):
+            return
+        interpreter.execute = self.saved
+        self.wrapper = self.saved = None
+
+
+@dataclass
+class Coverage:
+    """
+    Records which lines of each file have executed statements.
+
+    Each file has two bitmaps, one bit per line: `lines` has the lines with
+    statements on them, and `hits` the ones that have been executed. Loading
+    statements replaces each one on a line without a hit by a
+    CoverageStatement, which sets the bit the first time it runs and then
+    puts the statement back, so each line costs one extra dispatch and
+    coverage runs are otherwise as fast as normal ones.
+
+    Statements that aren't from a file are recorded under "<script>".
+    Coverage from separate runs or processes is combined with merge, or by
+    writing each run to the same file with `write(path, merge=True)`.
+
+    Only statements are recorded, each on the line it starts on. The other
+    lines of a statement that spans several, like the rest of a multi-line
+    expression, aren't in the report at all.
+    """
+    lines: dict[str, bytearray] = field(default_factory=dict)
+    hits: dict[str, bytearray] = field(default_factory=dict)
+
+    def load(self, statements: list[Statement], path: Optional[Path] = None) -> None:
+        file = "<script>" if path is None else str(path)
+        lines = self.lines.setdefault(file, bytearray())
+        hits = self.hits.setdefault(file, bytearray())
+        slots = list(statement_slots(statements))
+        size = (max((stmt.line for _, _, stmt in slots), default=0) >> 3) + 1
+        for bitmap in (lines, hits):
+            if len(bitmap) < size:
+                bitmap.extend(bytes(size - len(bitmap)))
+
+        for container, key, stmt in slots:
+            line = stmt.line
+            lines[line >> 3] |= 1 << (line & 7)
+            if type(stmt) is CoverageStatement:
+                # Left by an earlier Coverage in a module that's shared
+                # through PARSED_MODULES, and now reporting to this one
+                stmt.hits = hits
+            elif not isinstance(stmt, WRAPPER_STATEMENTS) and not hits[line >> 3] & 1 << (line & 7):
+                container[key] = CoverageStatement(stmt, hits, container, key, line=line)
+
+    def merge(self, other: Coverage) -> None:
+        for file, lines in other.lines.items():
+            for mine, theirs in ((self.lines, lines), (self.hits, other.hits[file])):
+                bitmap = mine.setdefault(file, bytearray())
+                if len(bitmap) < len(theirs):
+                    bitmap.extend(bytes(len(theirs) - len(bitmap)))
+                for index in range(len(theirs)):
+                    bitmap[index] |= theirs[index]
+
+    def report(self) -> dict[str, dict[int, bool]]:
+        """
+        For each file, whether each line with statements was executed.
+        """
+        return {
+            file: {
+                line: bool(self.hits[file][line >> 3] & 1 << (line & 7))
+                for line in range(len(lines) * 8)
+                if lines[line >> 3] & 1 << (line & 7)
+            }
+            for file, lines in self.lines.items()
+        }
+
+    def lcov(self) -> str:
+        records = []
+        for file, lines in sorted(self.report().items()):
+            records.append(f"TN:\nSF:{file}\n")
+            for line, hit in lines.items():
+                records.append(f"DA:{line},{int(hit)}\n")
+            records.append(f"LF:{len(lines)}\nLH:{sum(lines.values())}\nend_of_record\n")
+        return "".join(records)
+
+    @classmethod
+    def read(cls, path: Path | str) -> Coverage:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != COVERAGE_VERSION:
+            raise ValueError(f"{path} isn't version {COVERAGE_VERSION} coverage data.")
+        coverage = cls()
+        for file, bitmaps in data["files"].items():
+            coverage.lines[file] = bytearray.fromhex(bitmaps["lines"])
+            coverage.hits[file] = bytearray.fromhex(bitmaps["hits"])
+        return coverage
+
+    def write(self, path: Path | str, merge: bool = False) -> None:
+        """
+        Write the coverage to path, first merging in what's there already if
+        merge is True.
+
+        Processes writing to the same path take turns through a lock on a
+        ".lock" file next to it, so that none of them merges in a file that
+        another is about to replace.
+        """
+        path = Path(path)
+        with open(path.with_name(path.name + ".lock"), "a") as lock:
+            if fcntl is not None:
+                # Released when the file is closed
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            coverage = self
+            if merge and path.exists():
+                coverage = Coverage.read(path)
+                coverage.merge(self)
+            data = {
+                "version": COVERAGE_VERSION,
+                "files": {
+                    file: {"lines": lines.hex(), "hits": coverage.hits[file].hex()}
+                    for file, lines in coverage.lines.items()
+                },
+            }
+            with tempfile.NamedTemporaryFile(
+                "w", dir=path.parent, prefix=path.name, suffix=".tmp", delete=False
+            ) as f:
+                try:
+                    json.dump(data, f)
+                except BaseException:
+                    f.close()
+                    os.unlink(f.name)
+                    raise
+            os.replace(f.name, path)
+
+
+COVERAGE_VERSION = 1
+
+
+@dataclass
+class DebuggerQueues:
+    """
+    An on_pause for a Debugger whose front end runs on another thread, or in
+    an event loop through run_in_executor. Each Pause is put on `pauses`, and
+    the interpreter then waits for a command on `commands`.
+    """
+    pauses: queue.Queue = field(default_factory=queue.Queue)
+    commands: queue.Queue = field(default_factory=queue.Queue)
+
+    def __call__(self, pause: Pause) -> str:
+        self.pauses.put(pause)
+        return self.commands.get()
+
+
+# Statements a green thread runs before the others get a turn
+TIME_SLICE = 1000
+
+
+@dataclass(eq=False)
+class Scheduler:
+    """
+    Runs an Interpreter's green threads, one at a time, switching from one to
+    the next when it waits on a channel, in join or for an asynchronous
+    native, and otherwise every `time_slice` statements.
+
+    Each green thread is a Python thread, so that the tree-walking
+    interpreter can leave one anywhere in its recursion and come back to it
+    later, but only `current`, the green thread with the turn, runs while
+    the others wait on their own `turn` event, so handing the turn over
+    wakes just the one getting it. `main` is the program itself, on
+    whichever thread called interpret, which isn't over until every green
+    thread is. Nothing is installed until the first spawn, which wraps the
+    interpreter's execute, as Budget does, to count down the time slice.
+
+    So they're only green in that they take turns: spawning one starts an OS
+    thread, which it holds, along with its stack, until it finishes. How
+    many can be alive at once is bounded by the OS's limits on threads and
+    memory, typically tens of thousands, rather than by anything in Lox.
+
+    Natives defined with a coroutine function are asynchronous: they run on
+    an asyncio event loop with a thread of its own, and the green thread
+    that called one waits for its result while the others carry on. So
+    natives doing I/O, through asyncio.to_thread say, overlap with each
+    other and with the rest of the program rather than blocking it.
+    """
+    interpreter: Interpreter = field(repr=False)
+    time_slice: int = TIME_SLICE
+    # Statements left in current's time slice
+    countdown: int = field(default_factory=lambda: TIME_SLICE, init=False, repr=False)
+
+    main: GreenThread = field(default_factory=lambda: GreenThread(None), init=False, repr=False)
+    current: GreenThread = field(init=False, repr=False)
+    # Green threads to get the turn, in order
+    ready: deque[GreenThread] = field(default_factory=deque, init=False, repr=False)
+    # Spawned green threads that haven't finished
+    live: list[GreenThread] = field(default_factory=list, init=False, repr=False)
+    # Guards ready against asynchronous natives finishing, which the green
+    # thread with the turn waits on when nothing else is ready
+    condition: threading.Condition = field(default_factory=threading.Condition, init=False, repr=False)
+    # The error that ended a green thread, to be raised in main
+    failure: Optional[BaseException] = field(default_factory=lambda: None, init=False, repr=False)
+    cancelled: bool = field(default_factory=lambda: False, init=False, repr=False)
+    # Calls to asynchronous natives that haven't returned
+    pending: set[Future] = field(default_factory=set, init=False, repr=False)
+    loop: Optional[asyncio.AbstractEventLoop] = field(default_factory=lambda: None, init=False, repr=False)
+    loop_thread: Optional[threading.Thread] = field(default_factory=lambda: None, init=False, repr=False)
+    # The time slice wrapper while it's installed, and the execute it replaced
+    wrapper: Optional[Callable] = field(default_factory=lambda: None, init=False, repr=False)
+    saved: Optional[Callable] = field(default_factory=lambda: None, init=False, repr=False)
+
+    def __post_init__(self):
+        self.current = self.main
+
+    def natives(self) -> list[tuple[str, int, Callable]]:
+        return [
+            ("spawn", 1, self.spawn),
+            ("join", 1, self.join),
+            ("channel", 1, self.channel),
+            ("send", 2, self.send),
+            ("receive", 1, self.receive),
+            ("close", 1, self.close),
+            ("sleep", 1, native_sleep),
+        ]
+
+    def spawn(self, function: Any) -> GreenThread:
+        if type(function) is LoxBoundMethod:
+            arity = function.function.arity
+        elif type(function) is LoxFunction:
+            arity = function.arity
+        else:
+            raise NativeError(f"spawn() expects a function, got {Interpreter.type_name(function)}")
+        if arity:
+            raise NativeError(f"spawn() expects a function with no parameters, but {function} has {arity}")
+
+        green = GreenThread(function, environment=self.interpreter.globals)
+        green.thread = threading.Thread(target=self.run, args=(green,), name=f"lox {function}", daemon=True)
+        self.live.append(green)
+        self.ready.append(green)
+        self.install()
+        green.thread.start()
+        return green
+
+    def join(self, green: Any) -> Any:
+        green = expect("join", green, GreenThread)
+        while not green.done:
+            green.joiners.append(self.current)
+            self.park()
+        return green.result
+
+    def channel(self, capacity: Any) -> Channel:
+        capacity = expect_index("channel", capacity)
+        if capacity < 1:
+            raise NativeError("channel() capacity must be at least 1")
+        return Channel(capacity)
+
+    def send(self, channel: Any, value: Any) -> None:
+        channel = expect("send", channel, Channel)
+        while len(channel.buffer) >= channel.capacity and not channel.closed:
+            channel.senders.append(self.current)
+            self.park()
+        if channel.closed:
+            raise NativeError("send() on a closed channel")
+        channel.buffer.append(value)
+        if channel.receivers:
+            self.ready.append(channel.receivers.popleft())
+
+    def receive(self, channel: Any) -> Any:
+        channel = expect("receive", channel, Channel)
+        while not channel.buffer and not channel.closed:
+            channel.receivers.append(self.current)
+            self.park()
+        if not channel.buffer:
+            return None
+        if channel.senders:
+            self.ready.append(channel.senders.popleft())
+        return channel.buffer.popleft()
+
+    def close(self, channel: Any) -> None:
+        channel = expect("close", channel, Channel)
+        channel.closed = True
+        self.ready.extend(channel.senders)
+        self.ready.extend(channel.receivers)
+        channel.senders.clear()
+        channel.receivers.clear()
+
+    def call_async(self, function: Callable, *arguments: Any) -> Any:
+        """
+        Call an asynchronous native, giving the other green threads the turn
+        until it returns.
+        """
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = threading.Thread(target=self.loop.run_forever, name="lox event loop", daemon=True)
+            self.loop_thread.start()
+        future = asyncio.run_coroutine_threadsafe(function(*arguments), self.loop)
+        green = self.current
+
+        def wake(future: Future) -> None:
+            with self.condition:
+                self.pending.discard(future)
+                self.ready.append(green)
+                self.condition.notify_all()
+
+        with self.condition:
+            self.pending.add(future)
+        future.add_done_callback(wake)
+        self.park()
+        return future.result()
+
+    def park(self) -> None:
+        """
+        Give the turn to the next green thread, until this one, having been
+        put in ready or somewhere it'll be woken from, gets it back.
+        """
+        green = self.current
+        interpreter = self.interpreter
+        green.environment = interpreter.environment
+        green.return_value = interpreter.return_value
+        # Cleared before the turn is handed over, so that it can't be
+        # handed back before this waits for it
+        green.turn.clear()
+        with self.condition:
+            self.current = self.next_turn()
+        self.current.turn.set()
+        green.turn.wait()
+        if self.cancelled and green is not self.main:
+            raise Cancelled()
+        interpreter.environment = green.environment
+        interpreter.return_value = green.return_value
+        if green is self.main and self.failure is not None:
+            failure, self.failure = self.failure, None
+            raise failure
+
+    def next_turn(self) -> GreenThread:
+        # Called holding condition, which asynchronous natives wake ready
+        # green threads through
+        while not self.ready:
+            if not self.pending:
+                raise NativeError("Deadlock: every green thread is waiting")
+            self.condition.wait()
+        self.countdown = self.time_slice
+        return self.ready.popleft()
+
+    def run(self, green: GreenThread) -> None:
+        green.turn.wait()
+        if self.cancelled:
+            return
+        interpreter = self.interpreter
+        interpreter.environment = green.environment
+        function = green.function
+        try:
+            if type(function) is LoxBoundMethod:
+                green.result = function.function.call(interpreter, [], function.this)
+            else:
+                green.result = function.call(interpreter, [])
+        except Cancelled:
+            return
+        except BaseException as exc:
+            self.failure = exc
+        self.finish(green)
+
+    def finish(self, green: GreenThread) -> None:
+        green.done = True
+        green.thread = None
+        self.live.remove(green)
+        self.ready.extend(green.joiners)
+        green.joiners.clear()
+        with self.condition:
+            if self.failure is None:
+                try:
+                    self.current = self.next_turn()
+                except NativeError as exc:
+                    # Main is left waiting, and reports it where it waits
+                    self.failure = exc
+            if self.failure is not None:
+                self.current = self.main
+        self.current.turn.set()
+
+    def wait_all(self) -> None:
+        """
+        Called by the interpreter once the program has run, to wait for the
+        green threads it spawned.
+        """
+        while self.live:
+            self.join(self.live[0])
+
+    def shutdown(self) -> None:
+        """
+        Called by the interpreter after running statements, to stop any
+        green threads and asynchronous natives an error has left running,
+        and the event loop.
+        """
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(cancel_tasks(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if self.loop_thread is not None:
+                self.loop_thread.join()
+            self.loop.close()
+            self.loop = self.loop_thread = None
+        if self.live:
+            interpreter = self.interpreter
+            environment = interpreter.environment
+            self.cancelled = True
+            for green in self.live:
+                green.turn.set()
+            for green in self.live:
+                if green.thread is not None:
+                    green.thread.join()
+            interpreter.environment = environment
+            self.live.clear()
+        self.ready.clear()
+        self.current = self.main
+        self.cancelled = False
+        self.failure = None
+        self.uninstall()
+
+    def install(self) -> None:
+        interpreter = self.interpreter
+        if self.wrapper is not None and interpreter.execute is self.wrapper:
+            return
+        inner = interpreter.execute
+
+        def execute(stmt: Statement) -> Optional[str]:
+            self.countdown -= 1
+            if self.countdown <= 0:
+                if self.ready:
+                    self.ready.append(self.current)
+                    self.park()
+                else:
+                    self.countdown = self.time_slice
+            return inner(stmt)
+
+        self.saved = inner
+        self.wrapper = execute
+        interpreter.execute = execute
+
+    def uninstall(self) -> None:
+        interpreter = self.interpreter
+        if self.wrapper is None or self.saved is None or interpreter.execute is not self.wrapper:
+            return
+        interpreter.execute = self.saved
+        self.wrapper = self.saved = None
+
+
+async def native_sleep(seconds: Any) -> None:
+    await asyncio.sleep(expect("sleep", seconds, float))
+
+
+async def cancel_tasks() -> None:
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@dataclass
+class Interpreter:
+    environment: Environment = field(default_factory=Environment)
+    # Set while Lox.run is collecting statistics
+    stats: Optional[RunStats] = None
+    budget: Optional[Budget] = None
+    debugger: Optional[Debugger] = None
+    importer: Importer = field(default_factory=Importer)
+    coverage: Optional[Coverage] = None
+
+    # What evaluate_str and Formula.parse parse expressions with. A field
+    # rather than a ClassVar, which mypyc turns into a read-only field of the
+    # dataclass
+    parser_class: type[Parser] = field(default_factory=lambda: Parser, init=False, repr=False, compare=False)
+
+    # What statements are executed and expressions evaluated through, bound
+    # to execute_statement and evaluate_expression, and the operators Budget
+    # counts string lengths through. Budget, Debugger and Scheduler hook in
+    # by wrapping these, rather than replacing methods on the instance,
+    # which mypyc's native classes don't allow.
+    execute: Callable[[Statement], Optional[str]] = field(init=False, repr=False, compare=False)
+    evaluate: Callable[[Expr], Any] = field(init=False, repr=False, compare=False)
+    binary: Callable[[Token, Any, Any], Any] = field(init=False, repr=False, compare=False)
+    concatenate: Callable[[str, str], str] = field(init=False, repr=False, compare=False)
+
+    # Value of the last return statement, or the function and arguments of a
+    # pending tail call
+    return_value: Any = field(default_factory=lambda: None, init=False, repr=False, compare=False)
+    # Released block scopes, ready to be reused
+    free_environments: list[Environment] = field(
+        default_factory=list, init=False, repr=False, compare=False
+    )
+    scheduler: Scheduler = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.execute = self.execute_statement
+        self.evaluate = self.evaluate_expression
+        self.binary = self.binary_operator
+        self.concatenate = self.concatenate_strings
+        # The outermost environment, which natives are defined in
+        self.globals = self.environment
+        while self.globals.enclosing is not None:
+            self.globals = self.globals.enclosing
+        for native in STANDARD_LIBRARY:
+            self.globals.define(
+                Token(Identifier(), native.name, symbol=symbols.intern(native.name)),
+                native,
+            )
+        self.scheduler = Scheduler(self)
+        for name, arity, function in self.scheduler.natives():
+            self.define_native(name, arity, function)
+
+    @classmethod
+    def evaluate_str(cls, input_str: str) -> Any:
+        interpreter = cls()
+        scanner = Scanner(input_str)
+        parser = interpreter.parser_class(scanner.scan_tokens())
+        return interpreter.evaluate(parser.expression())
+
+    def interpret(self, stmts: list[Statement], path: Optional[Path] = None) -> None:
+        """
+        Run stmts, which were parsed from the file at path if there is one.
+        """
+        uninstall = None
+        if self.coverage is not None:
+            self.coverage.load(stmts, path)
+        if self.budget is not None:
+            uninstall = self.budget.install(self)
+        if self.debugger is not None:
+            self.debugger.start(self, stmts)
+        try:
+            for statement in stmts:
+                self.execute(statement)
+            #print(self.stringify(result))
+            self.scheduler.wait_all()
+        except BudgetExceeded as exceeded:
+            Lox.runtime_error(exceeded.args[0], exceeded_budget=True)
+        except RecursionError:
+            Lox.runtime_error("Stack overflow.")
+        except Exception as exc:
+            Lox.runtime_error(exc.args[0])
+        finally:
+            self.scheduler.shutdown()
+            if self.debugger is not None:
+                self.debugger.stop()
+            if uninstall is not None:
+                uninstall()
+
+    def execute_statement(self, stmt: Statement) -> Optional[str]:
+        """
+        Execute stmt, returning None, or RETURN or TAIL_CALL when a return
+        statement was reached. Signals are passed back up through blocks and
+        branches to LoxFunction.call rather than raised, with the value or
+        pending call left in return_value.
+        """
+        match stmt:
+            case PrintStatement():
+                result = self.evaluate(stmt.expression)
+                print(self.stringify(result))
+            case ExpressionStatement():
+                self.evaluate(stmt.expression)
+            case VariableStatement():
+                value = None
+                if stmt.initializer:
+                    value = self.evaluate(stmt.initializer)
+                self.environment.define(stmt.name, value)
+            case IfStatement():
+                if self.is_truthy(self.evaluate(stmt.condition)):
+                    return self.execute(stmt.then_branch)
+                elif stmt.else_branch is not None:
+                    return self.execute(stmt.else_branch)
+            case WhileStatement():
+                return self.while_statement(stmt)
+            case ReturnStatement():
+                return self.return_statement(stmt.value)
+            case BlockStatement():
+                return self.block(stmt)
+            case FunctionStatement():
+                # Defined first, so that it can capture itself
+                self.environment.define(stmt.name, None)
+                self.environment.define(stmt.name, LoxFunction(stmt, self.closure(stmt.free, stmt.late)))
+            case ClassStatement():
+                self.class_statement(stmt)
+            case ImportStatement():
+                self.import_statement(stmt)
+            case CoverageStatement():
+                return self.coverage_statement(stmt)
+            case BreakpointStatement():
+                # Checked last, so statements without a breakpoint don't pay
+                # for the debugger
+                return stmt.debugger.pause(self, stmt.statement, self.execute_statement)
+            case _:
+                #breakpoint()
+                raise Exception(f"Unexpected statement {stmt}")
+        return None
+
+    def block(self, stmt: BlockStatement) -> Optional[str]:
+        if not stmt.declares:
+            for statement in stmt.statements:
+                signal = self.execute(statement)
+                if signal is not None:
+                    return signal
+            return None
+
+        if stmt.captures:
+            return self.execute_block(stmt.statements, Environment(self.environment))
+
+        environment = self.acquire_environment()
+        try:
+            return self.execute_block(stmt.statements, environment)
+        finally:
+            self.release_environment(environment)
+
+    def acquire_environment(self) -> Environment:
+        """
+        Get an empty environment enclosed by the current one, reusing a
+        released one if there is any. It must be given back to
+        release_environment once nothing can refer to it any more.
+        """
+        if self.free_environments:
+            environment = self.free_environments.pop()
+            environment.enclosing = self.environment
+            return environment
+        return Environment(self.environment)
+
+    def release_environment(self, environment: Environment) -> None:
+        environment.values.clear()
+        environment.enclosing = None
+        if len(self.free_environments) < FREE_ENVIRONMENTS_LIMIT:
+            self.free_environments.append(environment)
+
+    def execute_block(self, statements: list[Statement], environment: Environment) -> Optional[str]:
+        previous = self.environment
+        self.environment = environment
+        try:
+            for statement in statements:
+                signal = self.execute(statement)
+                if signal is not None:
+                    return signal
+        finally:
+            self.environment = previous
+            if environment.upvalues is not None and environment is not self.globals:
+                environment.close()
+        return None
+
+    def closure(self, free: list[Token], late: set[Optional[int]]) -> Environment:
+        """
+        The closure for a function declared in the current environment with
+        the free variables `free`: a ClosureEnvironment with an Upvalue for
+        each of them found in a scope other than the globals, or just the
+        globals if there are none. Those not found yet that are in `late`,
+        because an enclosing scope declares them later, get a LateUpvalue,
+        and the rest are left to be looked up in the globals when the
+        function runs.
+        """
+        globals = self.globals
+        environment = self.environment
+        if environment is globals:
+            return globals
+        upvalues: dict[int, Upvalue] = {}
+        for name in free:
+            symbol = symbol_of(name)
+            scope: Optional[Environment] = environment
+            while scope is not None and scope is not globals:
+                if symbol in scope.values:
+                    if type(scope) is ClosureEnvironment:
+                        # Captured by the enclosing function already
+                        upvalues[symbol] = scope.values[symbol]
+                    else:
+                        upvalues[symbol] = scope.capture(symbol)
+                    break
+                scope = scope.enclosing
+            else:
+                if symbol in late:
+                    upvalues[symbol] = LateUpvalue(environment, name)
+        if not upvalues:
+            return globals
+        return ClosureEnvironment(globals, upvalues)
+
+    def class_statement(self, stmt: ClassStatement) -> None:
+        superclass = None
+        if stmt.superclass is not None:
+            superclass = self.evaluate(stmt.superclass)
+            if type(superclass) is not LoxClass:
+                raise Exception(f"Superclass must be a class on line {stmt.superclass.name.line}")
+
+        self.environment.define(stmt.name, None)
+        closure = self.closure(
+            [
+                name
+                for method in stmt.methods
+                for name in method.free
+                # Methods get these from their own frame and the class
+                if name.symbol != THIS and name.symbol != SUPER
+            ],
+            set().union(*(method.late for method in stmt.methods)),
+        )
+        if superclass is not None:
+            if type(closure) is not ClosureEnvironment:
+                closure = ClosureEnvironment(closure)
+            closure.values[SUPER] = Upvalue(None, SUPER, superclass)
+        methods = {
+            symbol_of(method.name): LoxFunction(method, closure, method.name.symbol == INIT)
+            for method in stmt.methods
+        }
+        self.environment.assign(stmt.name, LoxClass(stmt.name.lexeme, superclass, methods))
+
+    def coverage_statement(self, stmt: CoverageStatement) -> Optional[str]:
+        line = stmt.statement.line
+        hits = stmt.hits
+        hits[line >> 3] |= 1 << (line & 7)
+        # Put the statement back, unless something else has been put there
+        # since, so it runs at full speed from now on
+        if stmt.container[stmt.key] is stmt:
+            stmt.container[stmt.key] = stmt.statement
+        return self.execute(stmt.statement)
+
+    def import_statement(self, stmt: ImportStatement) -> None:
+        importer = self.importer
+        path = importer.resolve(stmt.name.literal, stmt.origin)
+        if path is None:
+            raise Exception(f"Can't find module '{stmt.name.literal}' on line {stmt.keyword.line}")
+        if path in importer.loaded:
+            return
+        if path in importer.running:
+            cycle = importer.running[importer.running.index(path):] + [path]
+            raise Exception(
+                f"Import cycle {' -> '.join(module.name for module in cycle)} "
+                f"on line {stmt.keyword.line}"
+            )
+
+        statements = importer.parse(path)
+        if self.debugger is not None:
+            self.debugger.load(statements)
+        if self.coverage is not None:
+            self.coverage.load(statements, path)
+        with importer.run(path):
+            self.execute_block(statements, self.globals)
+        importer.loaded.add(path)
+
+    def while_statement(self, stmt: WhileStatement) -> Optional[str]:
+        # Looked up once, so that wrappers installed on the instance (see
+        # Budget) are still used. execute is looked up for each statement
+        # instead, since the Debugger can replace it part way through.
+        evaluate = self.evaluate
+        condition = stmt.condition
+        increment = stmt.increment
+        statements = stmt.body_statements
+
+        previous = self.environment
+        scope = body = None
+        if stmt.declares and not stmt.captures:
+            scope = self.acquire_environment()
+        try:
+            while True:
+                # Only nil and false are falsey
+                value = evaluate(condition)
+                if value is None or value is False:
+                    return None
+
+                if scope is not None:
+                    scope.values.clear()
+                    self.environment = scope
+                elif stmt.captures:
+                    # A new scope each iteration, for closures to capture
+                    self.environment = body = Environment(previous)
+                for statement in statements:
+                    signal = self.execute(statement)
+                    if signal is not None:
+                        return signal
+                self.environment = previous
+                if body is not None and body.upvalues is not None:
+                    body.close()
+
+                if increment is not None:
+                    evaluate(increment)
+        finally:
+            self.environment = previous
+            if scope is not None:
+                self.release_environment(scope)
+            if body is not None and body.upvalues is not None:
+                body.close()
+
+    def return_statement(self, value: Optional[Expr]) -> str:
+        if type(value) is CallExpr:
+            callee = self.evaluate(value.callee)
+            arguments = [self.evaluate(argument) for argument in value.arguments]
+            if type(callee) is LoxFunction:
+                # Leave the call to the caller's LoxFunction.call, which
+                # reuses its Python frame for it
+                callee.check_arity(arguments, value.paren)
+                self.return_value = (callee, arguments, None)
+                return TAIL_CALL
+            if type(callee) is LoxBoundMethod:
+                callee.function.check_arity(arguments, value.paren)
+                self.return_value = (callee.function, arguments, callee.this)
+                return TAIL_CALL
+            self.return_value = self.call(callee, arguments, value.paren)
+        elif value is not None:
+            self.return_value = self.evaluate(value)
+        else:
+            self.return_value = None
+        return RETURN
+
+    def evaluate_expression(self, expr: Expr) -> Any:
+        match expr:
+            case LiteralExpr():
+                return expr.value
+
+            case TypedUnaryExpr():
+                return expr.function(self.evaluate(expr.right))
+
+            case UnaryExpr():
+                return self.unary(expr.operator, self.evaluate(expr.right))
+
+            case GroupingExpr():
+                return self.evaluate(expr.expression)
+
+            case VariableExpr():
+                if self.stats is not None:
+                    self.stats.record_lookup(self.environment.depth(expr.name))
+                return self.environment.get(expr.name)
+
+            case AssignExpr():
+                value = self.evaluate(expr.value)
+                self.environment.assign(expr.name, value)
+                return value
+
+            case TypedBinaryExpr():
+                return expr.function(self.evaluate(expr.left), self.evaluate(expr.right))
+
+            case ConcatExpr():
+                left = self.evaluate(expr.left)
+                return self.concatenate(left, self.evaluate(expr.right))
+
+            case BinaryExpr():
+                left = self.evaluate(expr.left)
+                right = self.evaluate(expr.right)
+                return self.binary(expr.operator, left, right)
+
+            case ArrayExpr():
+                values = [self.evaluate(element) for element in expr.elements]
+                for value in values:
+                    if type(value) is not float:
+                        raise Exception(f"Array elements must be numbers on line {expr.bracket.line}")
+                return LoxArray.from_values(values)
+
+            case IndexExpr():
+                array = self.evaluate(expr.array)
+                index = self.evaluate(expr.index)
+                return self.index(expr.bracket, array, index)
+
+            case CallExpr():
+                get = expr.callee
+                if type(get) is GetExpr:
+                    # Method calls go straight to the method without binding
+                    instance = self.evaluate(get.object)
+                    if type(instance) is LoxInstance:
+                        if instance.shape is not get.shape:
+                            self.cache_property(get, instance)
+                        # Read before the arguments, which can run this same
+                        # call on another shape and refill the cache
+                        method = get.method
+                        if method is not None:
+                            arguments = [self.evaluate(argument) for argument in expr.arguments]
+                            method.check_arity(arguments, expr.paren)
+                            return method.call(self, arguments, instance)
+                    callee = self.get(get, instance)
+                else:
+                    callee = self.evaluate(get)
+                arguments = [self.evaluate(argument) for argument in expr.arguments]
+                return self.call(callee, arguments, expr.paren)
+
+            case GetExpr():
+                return self.get(expr, self.evaluate(expr.object))
+
+            case SetExpr():
+                instance = self.evaluate(expr.object)
+                if type(instance) is not LoxInstance:
+                    raise Exception(f"Only instances have fields, on line {expr.name.line}")
+                value = self.evaluate(expr.value)
+                shape = instance.shape
+                if shape is not expr.shape:
+                    symbol = symbol_of(expr.name)
+                    index = shape.indices.get(symbol)
+                    if index is None:
+                        expr.index = len(shape.indices)
+                        expr.transition = shape.add(symbol)
+                    else:
+                        expr.index = index
+                        expr.transition = shape
+                    expr.shape = shape
+                transition = expr.transition
+                if transition is shape:
+                    instance.fields[expr.index] = value
+                else:
+                    # Set along with expr.shape above
+                    assert transition is not None
+                    instance.fields.append(value)
+                    instance.shape = transition
+                return value
+
+            case ThisExpr():
+                return self.environment.get(expr.keyword)
+
+            case SuperExpr():
+                superclass = self.environment.get(expr.keyword)
+                method = superclass.find_method(expr.method.symbol)
+                if method is None:
+                    raise Exception(f"Undefined property '{expr.method.lexeme}' on line {expr.method.line}")
+                return LoxBoundMethod(method, self.environment.get(THIS_TOKEN))
 
             case _:
                 #breakpoint()
                 raise Exception(f"Unexpected expression {expr}")
 
+    def unary(self, operator: Token, right: Any) -> Any:
+        match operator.token_type:
+            case Minus():
+                return -right
+            case Bang():
+                return not self.is_truthy(right)
+
+    def binary_operator(self, operator: Token, left: Any, right: Any) -> Any:
+        match operator.token_type, left, right:
+            case Minus(), float(), float():
+                return left - right
+
+            case Slash(), float(), float():
+                return left / right
+
+            case Star(), float(), float():
+                return left * right
+
+            case Greater(), float(), float():
+                return left > right
+
+            case GreaterEqual(), float(), float():
+                return left >= right
+
+            case Less(), float(), float():
+                return left < right
+
+            case LessEqual(), float(), float():
+                return left <= right
+
+            case Plus(), float(), float():
+                return left + right
+
+            case Plus(), str(), str():
+                return left + right
+
+            case BangEqual(), _, _:
+                return not self.is_equal(left, right)
+
+            case DoubleEqual(), _, _:
+                return self.is_equal(left, right)
+
+            case _ if (
+                (type(left) is LoxArray or type(right) is LoxArray)
+                and type(left) in ARRAY_OPERANDS
+                and type(right) in ARRAY_OPERANDS
+                and type(operator.token_type) in ARRAY_OPERATORS
+            ):
+                return LoxArray.broadcast(operator, left, right)
+
+            case _:
+                raise Exception(f"Operand '{operator.lexeme}' not supported between {type(left).__name__} and {type(right).__name__} on line {operator.line}")
+
+    def concatenate_strings(self, left: str, right: str) -> str:
+        # Separate from binary for ConcatExprs, so that Budget can count it
+        return left + right
+
+    def get(self, expr: GetExpr, instance: Any) -> Any:
+        if type(instance) is not LoxInstance:
+            raise Exception(f"Only instances have properties, on line {expr.name.line}")
+        if instance.shape is not expr.shape:
+            self.cache_property(expr, instance)
+        if expr.method is None:
+            return instance.fields[expr.index]
+        return LoxBoundMethod(expr.method, instance)
+
+    @staticmethod
+    def cache_property(expr: GetExpr, instance: LoxInstance) -> None:
+        """
+        Fill the inline cache at expr with where its name is found for
+        instance's shape: a field, or otherwise a method.
+        """
+        shape = instance.shape
+        symbol = symbol_of(expr.name)
+        index = shape.indices.get(symbol)
+        if index is not None:
+            expr.index, expr.method = index, None
+        else:
+            method = shape.klass.find_method(symbol)
+            if method is None:
+                raise Exception(f"Undefined property '{expr.name.lexeme}' on line {expr.name.line}")
+            expr.index, expr.method = -1, method
+        expr.shape = shape
+
+    def call(self, callee: Any, arguments: list[Any], paren: Token) -> Any:
+        if type(callee) is LoxFunction:
+            callee.check_arity(arguments, paren)
+            return callee.call(self, arguments)
+
+        if type(callee) is LoxBoundMethod:
+            callee.function.check_arity(arguments, paren)
+            return callee.function.call(self, arguments, callee.this)
+
+        if type(callee) is LoxClass:
+            instance = LoxInstance(callee)
+            initializer = callee.find_method(INIT)
+            if initializer is not None:
+                initializer.check_arity(arguments, paren)
+                initializer.call(self, arguments, instance)
+            elif arguments:
+                raise Exception(f"Expected 0 arguments but got {len(arguments)} on line {paren.line}")
+            return instance
+
+        if type(callee) is NativeFunction:
+            # Natives run directly on the arguments, without an Environment
+            if len(arguments) != callee.arity:
+                raise Exception(f"Expected {callee.arity} arguments but got {len(arguments)} on line {paren.line}")
+            try:
+                return callee.function(*arguments)
+            except NativeError as exc:
+                raise Exception(f"{exc.args[0]} on line {paren.line}") from exc
+
+        if type(callee) is MemoizedFunction:
+            callee.function.check_arity(arguments, paren)
+            reason = callee.check_bindings()
+            if reason is not None:
+                raise Exception(f"{callee} is no longer pure, {callee.function} {reason} on line {paren.line}")
+            callee.interpreter = self
+            return callee.lookup(arguments)
+
+        raise Exception(f"Can only call functions, not {type(callee).__name__}, on line {paren.line}")
+
+    def define_native(self, name: str, arity: int, function: Callable, pure: bool = False) -> None:
+        """
+        Define a global function implemented in Python. It's called with
+        exactly `arity` Lox values, and can raise NativeError to report a
+        runtime error at the call site. Pure natives, whose result depends
+        only on their arguments, can be called from memoized functions.
+
+        A coroutine function makes an asynchronous native, which the
+        Scheduler runs on its event loop while other green threads carry on.
+        """
+        if inspect.iscoroutinefunction(function):
+            function = partial(self.scheduler.call_async, function)
+        self.globals.define(
+            Token(Identifier(), name, symbol=symbols.intern(name)),
+            NativeFunction(name, arity, function, pure),
+        )
+
+    def save_image(self, path: Path | str) -> None:
+        """
+        Save the globals, along with everything they refer to, and which
+        modules have been imported, to an image that load_image can start
+        another interpreter from.
+        """
+        buffer = io.BytesIO()
+        ImagePickler(buffer, self.globals).dump({
+            "globals": {
+                symbols.name(symbol): value
+                for symbol, value in self.globals.values.items()
+            },
+            "loaded": sorted(str(module) for module in self.importer.loaded),
+        })
+        payload = buffer.getbuffer()
+        header = IMAGE_HEADER.pack(
+            IMAGE_MAGIC, IMAGE_VERSION, len(payload), hashlib.sha256(payload).digest()
+        )
+        # Written alongside and then moved into place, so that a process
+        # starting from the image never sees half of it
+        path = Path(path)
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "wb") as f:
+            f.write(header + payload)
+        os.replace(temporary, path)
+
+    def load_image(self, path: Path | str) -> None:
+        """
+        Define the globals saved in an image by save_image, as though the
+        code that made them had run in this interpreter. Natives are saved by
+        name, and must already be defined here.
+
+        The image is checked against its version and digest, which catches
+        damaged or outdated images but isn't a defence against crafted ones:
+        like any pickle, only load images from a trusted source.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < IMAGE_HEADER.size:
+            raise ImageError(f"{path} is too short to be an image.")
+        magic, version, length, digest = IMAGE_HEADER.unpack_from(data)
+        if magic != IMAGE_MAGIC:
+            raise ImageError(f"{path} isn't an image.")
+        if version != IMAGE_VERSION:
+            raise ImageError(
+                f"{path} is a version {version} image, but only version "
+                f"{IMAGE_VERSION} can be loaded."
+            )
+        payload = memoryview(data)[IMAGE_HEADER.size:]
+        if len(payload) != length or hashlib.sha256(payload).digest() != digest:
+            raise ImageError(f"{path} is damaged.")
+
+        try:
+            state = ImageUnpickler(io.BytesIO(payload), self.globals).load()
+        except ImageError:
+            raise
+        except Exception as exc:
+            raise ImageError(f"{path} can't be loaded: {exc}") from exc
+        for name, value in state["globals"].items():
+            self.globals.values[symbols.intern(name)] = value
+        self.importer.loaded.update(Path(module) for module in state["loaded"])
+
+    def index(self, bracket: Token, array: Any, index: Any) -> float:
+        if type(array) is not LoxArray:
+            raise Exception(f"Only arrays can be indexed, not {type(array).__name__}, on line {bracket.line}")
+        if type(index) is not float or not index.is_integer():
+            raise Exception(f"Array index must be a whole number on line {bracket.line}")
+        if not 0 <= index < len(array):
+            raise Exception(f"Array index {self.stringify(index)} out of range on line {bracket.line}")
+        return array[int(index)]
+
     @staticmethod
-    def is_equal(left, right):
+    def is_equal(left: Any, right: Any) -> bool:
         # This may get more complicated later?
         return left == right
 
     @staticmethod
-    def is_truthy(value) -> bool:
+    def is_truthy(value: Any) -> bool:
         match value:
             case bool():
                 return value
@@ -868,7 +4568,17 @@ class Interpreter:
                 return True
 
     @staticmethod
-    def stringify(value):
+    def type_name(value: Any) -> str:
+        match value:
+            case None:
+                return "nil"
+            case bool():
+                return "a boolean"
+            case _:
+                return TYPE_NAMES.get(type(value), type(value).__name__)
+
+    @staticmethod
+    def stringify(value: Any) -> str:
         match value:
             case None:
                 return 'nil'
@@ -880,56 +4590,1349 @@ class Interpreter:
                 # Remove the trailing the ".0" so that ints looks like ints
                 text = str(value).removesuffix('.0')
                 return text
+            case LoxArray():
+                return "[" + ", ".join(map(Interpreter.stringify, value)) + "]"
             case _:
                 return str(value)
 
 
-_had_error = False
-_had_runtime_error = False
+# Images start with this header: the magic bytes, the format version, and the
+# length and SHA-256 digest of the pickled payload that follows. The version
+# is bumped whenever what's pickled changes, including the AST node classes.
+IMAGE_HEADER = struct.Struct("<8sHQ32s")
+IMAGE_MAGIC = b"LOXIMAGE"
+IMAGE_VERSION = 4
+
+
+# The picklers extend C classes that mypyc can't build native classes on
+@mypyc_attr(native_class=False)
+class ImagePickler(pickle.Pickler):
+    """
+    Pickles Lox values for Interpreter.save_image.
+
+    Interned symbols are only meaningful within a process, so tokens,
+    environments, shapes and classes are saved with names where they hold
+    symbols, and interned again when loaded. The globals environment and
+    natives are saved as references, to whatever the loading interpreter
+    has in their place.
+    """
+    def __init__(self, file: io.BytesIO, globals: Environment):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.globals = globals
+
+    def persistent_id(self, obj: Any) -> Any:
+        if obj is self.globals:
+            return "globals"
+        if type(obj) is NativeFunction:
+            return ("native", obj.name)
+        return None
+
+    def reducer_override(self, obj: Any) -> Any:
+        match obj:
+            case Token():
+                symbol = None if obj.symbol is None else symbols.name(obj.symbol)
+                return unpickle_token, (obj.token_type, obj.lexeme, obj.literal, obj.line, symbol)
+            case BufferToken():
+                # Saved as a plain Token rather than with its whole buffer
+                symbol = None if obj.symbol is None else symbols.name(obj.symbol)
+                return unpickle_token, (obj.token_type, obj.lexeme, obj.literal, obj.line, symbol)
+            case Environment():
+                upvalues = None if obj.upvalues is None else by_name(obj.upvalues)
+                return (
+                    unpickle_blank,
+                    (type(obj),),
+                    (obj.enclosing, by_name(obj.values), upvalues),
+                    None,
+                    None,
+                    set_environment_state,
+                )
+            case LateUpvalue():
+                return (
+                    unpickle_blank,
+                    (LateUpvalue,),
+                    (obj.environment, obj.name, obj.captured),
+                    None,
+                    None,
+                    set_late_upvalue_state,
+                )
+            case Upvalue():
+                return (
+                    unpickle_blank,
+                    (Upvalue,),
+                    (obj.environment, symbols.name(obj.symbol), obj.value),
+                    None,
+                    None,
+                    set_upvalue_state,
+                )
+            case LoxFunction():
+                return LoxFunction, (obj.declaration, obj.closure, obj.is_initializer)
+            case LoxClass():
+                # The method cache is left to refill
+                return (
+                    unpickle_blank,
+                    (LoxClass,),
+                    (obj.name, obj.superclass, by_name(obj.methods), obj.shape),
+                    None,
+                    None,
+                    set_class_state,
+                )
+            case Shape():
+                return (
+                    unpickle_blank,
+                    (Shape,),
+                    (obj.klass, by_name(obj.indices), by_name(obj.transitions)),
+                    None,
+                    None,
+                    set_shape_state,
+                )
+            case LoxInstance():
+                return (
+                    unpickle_blank,
+                    (LoxInstance,),
+                    (obj.shape, obj.fields),
+                    None,
+                    None,
+                    set_instance_state,
+                )
+            case LoxBoundMethod():
+                return LoxBoundMethod, (obj.function, obj.this)
+            case MemoizedFunction():
+                return MemoizedFunction, (obj.function, obj.cache.cache_parameters()["maxsize"], obj.bindings)
+            case LoxArray():
+                return LoxArray.from_values, (list(obj),)
+            case BreakpointStatement() | CoverageStatement():
+                # Saved without breakpoints or coverage probes
+                return unpickle_statement, (obj.statement,)
+        return NotImplemented
+
+
+@mypyc_attr(native_class=False)
+class ImageUnpickler(pickle.Unpickler):
+    def __init__(self, file: io.BytesIO, globals: Environment):
+        super().__init__(file)
+        self.globals = globals
+        self.natives = {native.name: native for native in STANDARD_LIBRARY}
+        for value in globals.values.values():
+            if type(value) is NativeFunction:
+                self.natives[value.name] = value
+
+    def persistent_load(self, pid: Any) -> Any:
+        if pid == "globals":
+            return self.globals
+        kind, name = pid
+        native = self.natives.get(name)
+        if native is None:
+            raise ImageError(f"The image needs the native function '{name}', which isn't defined.")
+        return native
+
+
+def by_name(values: dict[int, Any]) -> dict[str, Any]:
+    return {symbols.name(symbol): value for symbol, value in values.items()}
+
+
+def by_symbol(values: dict[str, Any]) -> dict[int, Any]:
+    return {symbols.intern(name): value for name, value in values.items()}
+
+
+def unpickle_token(
+    token_type: TokenType, lexeme: str, literal: Any, line: int, symbol: Optional[str]
+) -> Token:
+    return Token(token_type, lexeme, literal, line, None if symbol is None else symbols.intern(symbol))
+
+
+def unpickle_statement(statement: Statement) -> Statement:
+    return statement
+
+
+def unpickle_blank(cls: type) -> Any:
+    """
+    A placeholder instance of cls, for its pickled state to be set on. Made
+    through __init__, which mypyc's native classes always run, rather than
+    with copyreg.__newobj__.
+    """
+    if cls is Upvalue:
+        return Upvalue(None, 0)
+    if cls is LateUpvalue:
+        return LateUpvalue(None, THIS_TOKEN)
+    if cls is LoxClass:
+        return LoxClass("", None, {})
+    if cls is Shape:
+        return Shape(LoxClass("", None, {}), {})
+    if cls is LoxInstance:
+        return LoxInstance(LoxClass("", None, {}))
+    return cls()
+
+
+def set_environment_state(environment: Environment, state: tuple) -> None:
+    environment.enclosing, values, upvalues = state
+    environment.values = by_symbol(values)
+    environment.upvalues = None if upvalues is None else by_symbol(upvalues)
+
+
+def set_upvalue_state(upvalue: Upvalue, state: tuple) -> None:
+    upvalue.environment, name, upvalue.value = state
+    upvalue.symbol = symbols.intern(name)
+
+
+def set_late_upvalue_state(upvalue: LateUpvalue, state: tuple) -> None:
+    upvalue.environment, upvalue.name, upvalue.captured = state
+    upvalue.symbol = symbol_of(upvalue.name)
+
+
+def set_class_state(klass: LoxClass, state: tuple) -> None:
+    klass.name, klass.superclass, methods, klass.shape = state
+    klass.methods = by_symbol(methods)
+    klass.method_cache = {}
+
+
+def set_instance_state(instance: LoxInstance, state: tuple) -> None:
+    instance.shape, instance.fields = state
+
+
+def set_shape_state(shape: Shape, state: tuple) -> None:
+    shape.klass, indices, transitions = state
+    shape.indices = by_symbol(indices)
+    shape.transitions = by_symbol(transitions)
+
+
 @dataclass
-class Lox:
+class StackInterpreter(Interpreter):
+    """
+    Interpreter that evaluates expressions with an explicit work stack.
+
+    Deeply nested groupings and long operator chains are evaluated without
+    recursing once per level, so they are not limited by the recursion limit.
+    Expression types without a case here fall back to
+    Interpreter.evaluate_expression, whose own sub-expressions come back
+    through this method.
+    """
+
+    parser_class: type[Parser] = field(default_factory=lambda: StackParser, init=False, repr=False, compare=False)
+
+    def evaluate_expression(self, expr: Expr) -> Any:
+        # The work stack holds expressions still to be visited, and 1-tuples
+        # of expressions whose operands are on the value stack and are ready
+        # to be applied.
+        # Dispatched on the exact type of each item, which mypy can't follow
+        # through item_type, so the stack holds Any rather than the union
+        work: list[Any] = [expr]
+        values: list[Any] = []
+        while work:
+            item = work.pop()
+            item_type = type(item)
+            if item_type is LiteralExpr:
+                values.append(item.value)
+            elif item_type is GroupingExpr:
+                work.append(item.expression)
+            elif item_type is VariableExpr:
+                if self.stats is not None:
+                    self.stats.record_lookup(self.environment.depth(item.name))
+                values.append(self.environment.get(item.name))
+            elif item_type is BinaryExpr or item_type is TypedBinaryExpr or item_type is ConcatExpr:
+                work += [(item,), item.right, item.left]
+            elif item_type is UnaryExpr or item_type is TypedUnaryExpr:
+                work += [(item,), item.right]
+            elif item_type is AssignExpr:
+                work += [(item,), item.value]
+            elif item_type is tuple:
+                item, = item
+                item_type = type(item)
+                if item_type is BinaryExpr:
+                    right = values.pop()
+                    values[-1] = self.binary(item.operator, values[-1], right)
+                elif item_type is TypedBinaryExpr:
+                    right = values.pop()
+                    values[-1] = item.function(values[-1], right)
+                elif item_type is ConcatExpr:
+                    right = values.pop()
+                    values[-1] = self.concatenate(values[-1], right)
+                elif item_type is UnaryExpr:
+                    values[-1] = self.unary(item.operator, values[-1])
+                elif item_type is TypedUnaryExpr:
+                    values[-1] = item.function(values[-1])
+                else:
+                    self.environment.assign(item.name, values[-1])
+            else:
+                values.append(super().evaluate_expression(item))
+
+        return values.pop()
+
+
+@dataclass
+class Optimizer:
+    """
+    Whole-program dataflow pass over the statements from Parser.parse.
+
+    A forward pass propagates constants and copies between top level
+    statements and folds operators whose operands became literals, other than
+    string concatenation, which is left for a Budget to count at runtime. A
+    backward liveness pass then removes stores to variables that are never
+    read again and expression statements whose results are never observed.
+
+    Print statements are always kept, and anything that could raise a runtime
+    error is only removed when it can be proven not to. Since variables that
+    are dead at the end of the program are removed, the pass should only be
+    used when the statements make up the whole program. `defined` holds names
+    that already exist in the environment the statements will run in, as
+    interned symbols.
+    """
+    defined: set[int] = field(default_factory=set)
     interpreter: Interpreter = field(default_factory=Interpreter)
 
-    @staticmethod
-    def get_error(_):
-        global _had_error
-        return _had_error
+    def optimize(self, statements: list[Statement]) -> list[Statement]:
+        # Index of the first top level statement defining each name. A name is
+        # defined for every statement after it, since a failing definition
+        # would have stopped the program.
+        self.first_definitions: dict[int, int] = {}
+        for index, stmt in enumerate(statements):
+            if isinstance(stmt, VariableStatement):
+                self.first_definitions.setdefault(symbol_of(stmt.name), index)
+
+        return self.eliminate_dead_stores(self.propagate(statements))
+
+    def is_defined(self, name: int, index: int) -> bool:
+        return name in self.defined or self.first_definitions.get(name, index) < index
+
+    def propagate(self, statements: list[Statement]) -> list[Statement]:
+        # Known values of names, the names they're copies of, and the other
+        # way around
+        self.constants: dict[int, Any] = {}
+        self.copies: dict[int, Token] = {}
+        self.copied_from: dict[int, set[int]] = {}
+        result = []
+        for index, stmt in enumerate(statements):
+            self.index = index
+            match stmt:
+                case VariableStatement():
+                    initializer = stmt.initializer
+                    if initializer:
+                        initializer = self.rewrite(initializer)
+                    self.kill(symbol_of(stmt.name))
+                    if not initializer:
+                        self.constants[symbol_of(stmt.name)] = None
+                    else:
+                        self.record(stmt.name, initializer)
+                    stmt = VariableStatement(stmt.name, initializer, line=stmt.line)
+                case ExpressionStatement():
+                    stmt = ExpressionStatement(self.rewrite(stmt.expression), line=stmt.line)
+                case PrintStatement():
+                    stmt = PrintStatement(self.rewrite(stmt.expression), line=stmt.line)
+                case _:
+                    uses: set[int] = set()
+                    assigns: set[int] = set()
+                    if stmt is not None and self.references(stmt, uses, assigns):
+                        for name in assigns:
+                            self.kill(name)
+                    else:
+                        self.forget()
+            result.append(stmt)
+
+        return result
+
+    def record(self, name: Token, value: Expr):
+        match value:
+            case LiteralExpr():
+                self.constants[symbol_of(name)] = value.value
+            case VariableExpr() if (
+                value.name.symbol != name.symbol
+                and self.is_defined(symbol_of(value.name), self.index)
+            ):
+                self.copies[symbol_of(name)] = value.name
+                self.copied_from.setdefault(symbol_of(value.name), set()).add(symbol_of(name))
+
+    def kill(self, name: int):
+        self.constants.pop(name, None)
+        source = self.copies.pop(name, None)
+        if source is not None:
+            self.copied_from[symbol_of(source)].discard(name)
+        for copy in self.copied_from.pop(name, ()):
+            del self.copies[copy]
+
+    def forget(self):
+        self.constants.clear()
+        self.copies.clear()
+        self.copied_from.clear()
+
+    def rewrite(self, expr: Expr) -> Expr:
+        # Sub-expressions are visited in evaluation order so that assignments
+        # update the facts before any later reads are rewritten.
+        match expr:
+            case LiteralExpr():
+                return expr
+            case VariableExpr():
+                name = expr.name.symbol
+                if name in self.constants:
+                    return LiteralExpr(self.constants[name])
+                if name in self.copies:
+                    return VariableExpr(self.copies[name])
+                return expr
+            case GroupingExpr():
+                inner = self.rewrite(expr.expression)
+                if isinstance(inner, LiteralExpr):
+                    return inner
+                return GroupingExpr(inner)
+            case UnaryExpr():
+                right = self.rewrite(expr.right)
+                if isinstance(right, LiteralExpr):
+                    try:
+                        return LiteralExpr(self.interpreter.unary(expr.operator, right.value))
+                    except Exception:
+                        pass
+                return UnaryExpr(expr.operator, right)
+            case BinaryExpr():
+                left = self.rewrite(expr.left)
+                right = self.rewrite(expr.right)
+                if (
+                    isinstance(left, LiteralExpr)
+                    and isinstance(right, LiteralExpr)
+                    # Strings are left to be built at runtime, where a Budget
+                    # counts them, as folding can make them any length
+                    and not (type(left.value) is str and type(right.value) is str)
+                ):
+                    try:
+                        return LiteralExpr(
+                            self.interpreter.binary(expr.operator, left.value, right.value)
+                        )
+                    except Exception:
+                        # Leave it for the interpreter to report at runtime
+                        pass
+                return BinaryExpr(left, expr.operator, right)
+            case AssignExpr():
+                value = self.rewrite(expr.value)
+                self.kill(symbol_of(expr.name))
+                if self.is_defined(symbol_of(expr.name), self.index):
+                    self.record(expr.name, value)
+                return AssignExpr(expr.name, value)
+            case ArrayExpr():
+                return ArrayExpr(expr.bracket, [self.rewrite(element) for element in expr.elements])
+            case IndexExpr():
+                array = self.rewrite(expr.array)
+                return IndexExpr(array, expr.bracket, self.rewrite(expr.index))
+            case CallExpr():
+                # The arguments are rewritten, but the call itself may do
+                # anything once functions can assign to globals.
+                callee = self.rewrite(expr.callee)
+                arguments = [self.rewrite(argument) for argument in expr.arguments]
+                self.forget()
+                return CallExpr(callee, expr.paren, arguments)
+            case _:
+                # Unknown expressions may run arbitrary code
+                self.forget()
+                return expr
+
+    def eliminate_dead_stores(self, statements: list[Statement]) -> list[Statement]:
+        live: set[int] = set()
+        # Names that a kept statement assigns to, so they must stay defined
+        needs_definition: set[int] = set()
+        all_live = False
+        result = []
+        for index in range(len(statements) - 1, -1, -1):
+            stmt = statements[index]
+            uses: set[int] = set()
+            assigns: set[int] = set()
+            match stmt:
+                case VariableStatement():
+                    name = symbol_of(stmt.name)
+                    initializer = stmt.initializer
+                    if not all_live and name not in live:
+                        if not initializer or self.is_removable(initializer, index):
+                            if name not in needs_definition:
+                                continue
+                            initializer = None
+                        stmt = VariableStatement(stmt.name, initializer, line=stmt.line)
+                    live.discard(name)
+                    needs_definition.discard(name)
+                    if initializer and not self.references(initializer, uses, assigns):
+                        # A call, say, which could read any global
+                        all_live = True
+                case ExpressionStatement():
+                    expr = stmt.expression
+                    while (
+                        isinstance(expr, AssignExpr)
+                        and not all_live
+                        and expr.name.symbol not in live
+                        and self.is_defined(symbol_of(expr.name), index)
+                    ):
+                        expr = expr.value
+                    if self.is_removable(expr, index):
+                        continue
+                    if expr is not stmt.expression:
+                        stmt = ExpressionStatement(expr, line=stmt.line)
+                    if isinstance(expr, AssignExpr):
+                        live.discard(expr.name.symbol)
+                    if not self.references(expr, uses, assigns):
+                        all_live = True
+                case PrintStatement():
+                    if not self.references(stmt.expression, uses, assigns):
+                        all_live = True
+                case _:
+                    if stmt is None or not self.references(stmt, uses, assigns):
+                        all_live = True
+
+            live |= uses
+            needs_definition |= assigns
+            result.append(stmt)
+
+        result.reverse()
+        return result
+
+    def references(self, node, uses: set[int], assigns: set[int]) -> bool:
+        """
+        Collect the names read and assigned anywhere under node. Returns False
+        if node contains anything this pass doesn't understand.
+        """
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            match node:
+                case LiteralExpr():
+                    pass
+                case VariableExpr():
+                    uses.add(symbol_of(node.name))
+                case AssignExpr():
+                    assigns.add(symbol_of(node.name))
+                    pending.append(node.value)
+                case UnaryExpr():
+                    pending.append(node.right)
+                case BinaryExpr():
+                    pending += [node.left, node.right]
+                case GroupingExpr():
+                    pending.append(node.expression)
+                case ArrayExpr():
+                    pending += node.elements
+                case IndexExpr():
+                    pending += [node.array, node.index]
+                case VariableStatement():
+                    if node.initializer:
+                        pending.append(node.initializer)
+                case ExpressionStatement() | PrintStatement():
+                    pending.append(node.expression)
+                case BlockStatement():
+                    pending += node.statements
+                case _:
+                    return False
 
-    @staticmethod
-    def set_error(_, val):
-        global _had_error
-        _had_error = val
+        return True
 
-    # TODO: how to do classproperties like java statics? Not that I think that's
-    # good, but that's how the book does it.
-    had_error = property(get_error, set_error)
+    def is_removable(self, expr: Expr, index: int) -> bool:
+        """
+        Whether evaluating expr at statement `index` can neither have a side
+        effect nor raise a runtime error.
+        """
+        match expr:
+            case LiteralExpr():
+                return True
+            case VariableExpr():
+                return self.is_defined(symbol_of(expr.name), index)
+            case GroupingExpr():
+                return self.is_removable(expr.expression, index)
+            case UnaryExpr() if expr.operator.token_type == Bang():
+                return self.is_removable(expr.right, index)
+            case BinaryExpr() if expr.operator.token_type in (DoubleEqual(), BangEqual()):
+                return (
+                    self.is_removable(expr.left, index)
+                    and self.is_removable(expr.right, index)
+                )
+            case _:
+                # Anything else either has a side effect, or would have been
+                # folded if it couldn't fail.
+                return False
 
-    @staticmethod
-    def get_runtime_error(_):
-        global _had_runtime_error
-        return _had_runtime_error
 
-    @staticmethod
-    def set_runtime_error(_, val):
-        global _had_runtime_error
-        _had_runtime_error = val
+class LoxType(IntEnum):
+    """
+    What TypeInference knows about the values of an expression or variable.
+    """
+    NUMBER = 1
+    STRING = 2
+    BOOLEAN = 3
+    NIL = 4
+    # Could be anything, including an array or an instance
+    UNKNOWN = 5
+
+
+LOX_TYPE_NAMES = {
+    LoxType.NUMBER: "a number",
+    LoxType.STRING: "a string",
+    LoxType.BOOLEAN: "a boolean",
+    LoxType.NIL: "nil",
+}
+
+LITERAL_TYPES = {float: LoxType.NUMBER, str: LoxType.STRING, bool: LoxType.BOOLEAN, type(None): LoxType.NIL}
+
+COMPARISON_OPERATORS = (Greater, GreaterEqual, Less, LessEqual)
+EQUALITY_OPERATORS = {DoubleEqual: eq, BangEqual: ne}
+
+
+def join_types(a: Optional[LoxType], b: Optional[LoxType]) -> Optional[LoxType]:
+    # None is the type of a variable nothing has been assigned to yet
+    if a is None:
+        return b
+    if b is None or a == b:
+        return a
+    return LoxType.UNKNOWN
+
+
+@dataclass
+class TypeInference:
+    """
+    Infers the types of the variables and expressions in the statements from
+    Parser.parse, and specializes the operators it can prove the operand
+    types of: arithmetic and comparisons on numbers become TypedBinaryExprs,
+    `+` on strings ConcatExprs, and `-` on a number or `!` on a boolean
+    TypedUnaryExprs, none of which match on the types of their operands at
+    runtime. Every other operator keeps the generic path.
+
+    Variables aren't resolved to scopes, so a name's type is what every
+    declaration of it and assignment to it anywhere in the statements have
+    in common. Since an assignment like `i = i + 1` depends on the name's own
+    type, the types start out unknown and are joined until they stop
+    changing. Parameters, functions, classes, names that are never declared
+    and names in `defined`, which already exist in the environment the
+    statements will run in, could hold anything, as could every name once
+    there's an import. Like the Optimizer, this assumes the statements are the
+    whole program.
+
+    Operators that are bound to fail with the types of their operands are
+    left for the interpreter to report, if they run, and listed in
+    `warnings` as (line, message).
+    """
+    defined: set[int] = field(default_factory=set)
+    warnings: list[tuple[int, str]] = field(default_factory=list, init=False)
+
+    def specialize(self, statements: list[Statement]) -> list[Statement]:
+        """
+        Specialize the operators in statements, in place, and return them.
+        """
+        # None while a name's type is still being worked out
+        self.types: dict[int, Optional[LoxType]] = dict.fromkeys(self.defined, LoxType.UNKNOWN)
+        self.imports = False
+        self.rewriting = False
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            # Names read before anything was assigned to them
+            self.free: set[int] = set()
+            self.visit_statements(statements)
+            for name in self.free - self.types.keys():
+                self.bind(name, LoxType.UNKNOWN)
+        if self.imports:
+            self.types = dict.fromkeys(self.types, LoxType.UNKNOWN)
+
+        self.rewriting = True
+        self.visit_statements(statements)
+        return statements
+
+    def bind(self, name: int, value_type: Optional[LoxType]) -> None:
+        known = self.types.get(name)
+        joined = join_types(known, value_type)
+        if joined != known or name not in self.types:
+            self.types[name] = joined
+            self.changed = True
+
+    def visit_statements(self, statements: list[Statement]) -> None:
+        for stmt in statements:
+            match stmt:
+                case ExpressionStatement() | PrintStatement():
+                    stmt.expression = self.visit(stmt.expression)[0]
+                case VariableStatement():
+                    value_type: Optional[LoxType] = LoxType.NIL
+                    if stmt.initializer:
+                        stmt.initializer, value_type = self.visit(stmt.initializer)
+                    self.bind(symbol_of(stmt.name), value_type)
+                case BlockStatement():
+                    self.visit_statements(stmt.statements)
+                case IfStatement():
+                    stmt.condition = self.visit(stmt.condition)[0]
+                    self.visit_statements([stmt.then_branch])
+                    if stmt.else_branch is not None:
+                        self.visit_statements([stmt.else_branch])
+                case WhileStatement():
+                    stmt.condition = self.visit(stmt.condition)[0]
+                    self.visit_statements(stmt.body_statements)
+                    if stmt.increment is not None:
+                        stmt.increment = self.visit(stmt.increment)[0]
+                case ReturnStatement():
+                    if stmt.value is not None:
+                        stmt.value = self.visit(stmt.value)[0]
+                case FunctionStatement():
+                    self.bind(symbol_of(stmt.name), LoxType.UNKNOWN)
+                    self.visit_function(stmt)
+                case ClassStatement():
+                    self.bind(symbol_of(stmt.name), LoxType.UNKNOWN)
+                    for method in stmt.methods:
+                        self.visit_function(method)
+                case ImportStatement():
+                    if not self.imports:
+                        self.imports = self.changed = True
+
+    def visit_function(self, function: FunctionStatement) -> None:
+        for param in function.params:
+            self.bind(symbol_of(param), LoxType.UNKNOWN)
+        self.visit_statements(function.body)
+
+    def visit(self, expr: Expr) -> tuple[Expr, Optional[LoxType]]:
+        """
+        Infer the type of expr, returning it along with expr, or the
+        specialized expression to replace it with once rewriting.
+        """
+        match expr:
+            case LiteralExpr():
+                return expr, LITERAL_TYPES.get(type(expr.value), LoxType.UNKNOWN)
+            case VariableExpr():
+                name = symbol_of(expr.name)
+                if self.imports:
+                    return expr, LoxType.UNKNOWN
+                if name not in self.types:
+                    self.free.add(name)
+                value_type = self.types.get(name)
+                if value_type is None:
+                    # Only while the types are still being worked out, or for
+                    # a variable that can never be given a value
+                    value_type = LoxType.UNKNOWN if self.rewriting else None
+                return expr, value_type
+            case GroupingExpr():
+                expr.expression, value_type = self.visit(expr.expression)
+                return expr, value_type
+            case AssignExpr():
+                expr.value, value_type = self.visit(expr.value)
+                self.bind(symbol_of(expr.name), value_type)
+                return expr, value_type
+            case UnaryExpr():
+                expr.right, right = self.visit(expr.right)
+                return self.unary(expr, right)
+            case BinaryExpr():
+                expr.left, left = self.visit(expr.left)
+                expr.right, right = self.visit(expr.right)
+                return self.binary(expr, left, right)
+            case CallExpr():
+                expr.callee = self.visit(expr.callee)[0]
+                expr.arguments = [self.visit(argument)[0] for argument in expr.arguments]
+            case GetExpr():
+                expr.object = self.visit(expr.object)[0]
+            case SetExpr():
+                expr.object = self.visit(expr.object)[0]
+                expr.value = self.visit(expr.value)[0]
+            case ArrayExpr():
+                expr.elements = [self.visit(element)[0] for element in expr.elements]
+            case IndexExpr():
+                expr.array = self.visit(expr.array)[0]
+                expr.index = self.visit(expr.index)[0]
+                # Arrays only hold numbers
+                return expr, LoxType.NUMBER
+        return expr, LoxType.UNKNOWN
+
+    def unary(self, expr: UnaryExpr, right: Optional[LoxType]) -> tuple[Expr, Optional[LoxType]]:
+        function: Optional[Callable[[Any], Any]] = None
+        result: Optional[LoxType]
+        if type(expr.operator.token_type) is Bang:
+            result = LoxType.BOOLEAN
+            if right == LoxType.BOOLEAN:
+                function = not_
+        elif right is None or right == LoxType.UNKNOWN:
+            result = right
+        elif right == LoxType.NUMBER:
+            result = LoxType.NUMBER
+            function = neg
+        else:
+            result = LoxType.UNKNOWN
+            self.warn(expr.operator, f"Operand '{expr.operator.lexeme}' always fails on {LOX_TYPE_NAMES[right]}.")
+
+        if self.rewriting and function is not None:
+            return TypedUnaryExpr(expr.operator, expr.right, function=function), result
+        return expr, result
+
+    def binary(
+        self, expr: BinaryExpr, left: Optional[LoxType], right: Optional[LoxType]
+    ) -> tuple[Expr, Optional[LoxType]]:
+        kind = type(expr.operator.token_type)
+        function = None
+        if kind in EQUALITY_OPERATORS:
+            result = LoxType.BOOLEAN
+            if left == right and left in (LoxType.NUMBER, LoxType.STRING, LoxType.BOOLEAN):
+                function = EQUALITY_OPERATORS[kind]
+        elif left is None or right is None:
+            result = None
+        elif left == right == LoxType.NUMBER:
+            result = LoxType.BOOLEAN if kind in COMPARISON_OPERATORS else LoxType.NUMBER
+            function = ARRAY_OPERATORS[kind]
+        elif kind is Plus and left == right == LoxType.STRING:
+            result = LoxType.STRING
+            if self.rewriting:
+                return ConcatExpr(expr.left, expr.operator, expr.right), result
+        else:
+            result = LoxType.UNKNOWN
+            if left != LoxType.UNKNOWN and right != LoxType.UNKNOWN:
+                self.warn(
+                    expr.operator,
+                    f"Operand '{expr.operator.lexeme}' always fails between "
+                    f"{LOX_TYPE_NAMES[left]} and {LOX_TYPE_NAMES[right]}.",
+                )
+
+        if self.rewriting and function is not None:
+            return TypedBinaryExpr(expr.left, expr.operator, expr.right, function=function), result
+        return expr, result
+
+    def warn(self, token: Token, message: str) -> None:
+        if self.rewriting:
+            self.warnings.append((token.line, message))
+
+
+# What the rows of a formula's column are filled with where they've failed,
+# so that the column keeps one type, by type. Never 0, which would make
+# division take the slow path.
+FORMULA_FILLERS = {LoxType.NUMBER: 1.0, LoxType.STRING: "", LoxType.BOOLEAN: False, LoxType.NIL: None}
+
+
+@dataclass
+class Column:
+    """
+    Values of an expression for every row of a Formula's columns: a list, an
+    array of doubles with NumPy installed and every row a number, or just
+    one value when it's the same for every row.
+    """
+    values: Any
+    type: LoxType
+    constant: bool = False
+
+
+@dataclass
+class Formula:
+    """
+    A Lox expression parsed once to be evaluated over many rows of values,
+    given as columns: each of the variables it uses is bound to the column of
+    the same name, and anything else it names is looked up in the
+    interpreter's globals.
+
+    Rather than interpreting the expression for each row, each operator is
+    applied to whole columns at once, using what's known about their types
+    to go straight to the Python operator, or NumPy's with NumPy installed.
+    Where that isn't known, or the fast path fails, the interpreter's own
+    operators are applied one row at a time, so the values and errors are
+    always the ones interpreting each row would give.
+    """
+    expression: Expr
+    interpreter: Interpreter = field(default_factory=Interpreter)
+    # The variables the expression uses, in order of first use
+    names: list[str] = field(init=False)
+
+    def __post_init__(self):
+        names = {}
+        pending = [self.expression]
+        while pending:
+            expr = pending.pop()
+            if type(expr) is VariableExpr:
+                names.setdefault(expr.name.lexeme)
+            elif isinstance(expr, Expr):
+                pending += reversed([
+                    value for value in (getattr(expr, f.name) for f in fields(expr))
+                    if isinstance(value, Expr) or type(value) is list
+                ])
+            elif type(expr) is list:
+                pending += reversed(expr)
+        self.names = list(names)
+
+    @classmethod
+    def parse(cls, source: str, interpreter: Optional[Interpreter] = None) -> Formula:
+        if interpreter is None:
+            interpreter = Interpreter()
+        parser = interpreter.parser_class(Scanner(source).scan_tokens())
+        expression = parser.expression()
+        if not parser.is_at_end():
+            raise parser.error(parser.peek(), "Expect end of formula.")
+        return cls(expression, interpreter)
+
+    def evaluate(self, columns: dict[str, Any]) -> list:
+        """
+        The value of the formula for each row of columns, which are
+        sequences of Lox values of the same length: lists, arrays or NumPy
+        arrays. Integers are taken as numbers. Raises FormulaError if it
+        fails on any row.
+        """
+        lengths = {name: len(values) for name, values in columns.items()}
+        rows = max(lengths.values(), default=1)
+        for name, length in lengths.items():
+            if length != rows:
+                raise ValueError(f"Column '{name}' has {length} rows, but others have {rows}.")
+
+        evaluator = ColumnEvaluator(self.interpreter, rows)
+        for name in self.names:
+            if name not in columns:
+                continue
+            values = columns[name]
+            values = values.tolist() if hasattr(values, "tolist") else list(values)
+            if int in set(map(type, values)):
+                values = [float(value) if type(value) is int else value for value in values]
+            evaluator.columns[symbols.intern(name)] = evaluator.column(values)
+
+        values = list(evaluator.rows_of(evaluator.evaluate(self.expression)))
+        if not evaluator.errors:
+            return values
+        for row in evaluator.errors:
+            values[row] = None
+        first = min(evaluator.errors)
+        raise FormulaError(
+            f"{evaluator.errors[first]} in row {first}",
+            dict(sorted(evaluator.errors.items())),
+            values,
+        )
+
+
+@dataclass
+class ColumnEvaluator:
+    """
+    Evaluates a Formula's expression a Column at a time.
+    """
+    interpreter: Interpreter
+    rows: int
+    # The Columns bound to variables, by symbol
+    columns: dict[int, Column] = field(default_factory=dict)
+    # The message for each row that has failed, the first for the row,
+    # which is left out of whatever is evaluated after
+    errors: dict[int, str] = field(default_factory=dict)
+
+    def evaluate(self, expr: Expr) -> Column:
+        match expr:
+            case LiteralExpr():
+                return self.constant(expr.value)
+
+            case GroupingExpr():
+                return self.evaluate(expr.expression)
+
+            case VariableExpr():
+                column = self.columns.get(symbol_of(expr.name))
+                if column is not None:
+                    return column
+                return self.each(partial(self.interpreter.globals.get, expr.name))
+
+            case UnaryExpr():
+                return self.unary(expr.operator, self.evaluate(expr.right))
+
+            case BinaryExpr():
+                left = self.evaluate(expr.left)
+                return self.binary(expr.operator, left, self.evaluate(expr.right))
+
+            case CallExpr():
+                callee = self.evaluate(expr.callee)
+                arguments = [self.evaluate(argument) for argument in expr.arguments]
+                call = self.interpreter.call
+                # Called for every row even with the same arguments, as a
+                # call may give a different value each time
+                return self.each(
+                    lambda callee, *arguments: call(callee, list(arguments), expr.paren),
+                    callee,
+                    *arguments,
+                    fold=False,
+                )
+
+            case _:
+                # Anything else is interpreted a row at a time, with the
+                # variables bound to that row's values, and may make calls
+                return self.each(
+                    partial(self.evaluate_row, expr), *self.columns.values(), fold=False
+                )
+
+    def evaluate_row(self, expr: Expr, *values: Any) -> Any:
+        interpreter = self.interpreter
+        previous = interpreter.environment
+        interpreter.environment = Environment(interpreter.globals, dict(zip(self.columns, values)))
+        try:
+            return interpreter.evaluate(expr)
+        finally:
+            interpreter.environment = previous
+
+    def unary(self, operator: Token, right: Column) -> Column:
+        if not right.constant:
+            match operator.token_type, right.type:
+                case Minus(), LoxType.NUMBER:
+                    if numpy is not None:
+                        return Column(-right.values, LoxType.NUMBER)
+                    return Column(list(map(neg, right.values)), LoxType.NUMBER)
+                case Bang(), LoxType.BOOLEAN:
+                    return Column(list(map(not_, right.values)), LoxType.BOOLEAN)
+                case Bang(), LoxType.NUMBER | LoxType.STRING:
+                    return Column([False] * self.rows, LoxType.BOOLEAN)
+                case Bang(), LoxType.NIL:
+                    return Column([True] * self.rows, LoxType.BOOLEAN)
+                case Bang(), _:
+                    return Column(list(map(not_, map(Interpreter.is_truthy, right.values))), LoxType.BOOLEAN)
+        return self.each(partial(self.interpreter.unary, operator), right)
+
+    def binary(self, operator: Token, left: Column, right: Column) -> Column:
+        kind = type(operator.token_type)
+        function = None
+        if left.constant and right.constant:
+            pass
+        elif kind in EQUALITY_OPERATORS:
+            function = EQUALITY_OPERATORS[kind]
+            result = LoxType.BOOLEAN
+        elif left.type == right.type == LoxType.NUMBER:
+            function = ARRAY_OPERATORS[kind]
+            result = LoxType.BOOLEAN if kind in COMPARISON_OPERATORS else LoxType.NUMBER
+        elif kind is Plus and left.type == right.type == LoxType.STRING:
+            function = add
+            result = LoxType.STRING
+
+        if function is not None:
+            try:
+                return self.apply(function, left, right, result)
+            except ArithmeticError:
+                # Division by zero, say, which fails in just those rows
+                pass
+        return self.each(partial(self.interpreter.binary, operator), left, right)
+
+    def apply(self, function: Callable, left: Column, right: Column, result: LoxType) -> Column:
+        """
+        Apply function to every row of left and right at once.
+        """
+        if numpy is not None and left.type == right.type == LoxType.NUMBER:
+            with numpy.errstate(divide="raise", invalid="raise", over="ignore"):
+                values = function(left.values, right.values)
+            if result != LoxType.NUMBER:
+                values = values.tolist()
+            return Column(values, result)
+        return Column(list(map(function, self.rows_of(left), self.rows_of(right))), result)
+
+    def each(self, function: Callable, *columns: Column, fold: bool = True) -> Column:
+        """
+        Apply function to the values of columns one row at a time, recording
+        the message for each row it fails on. Unless fold is False, function
+        is applied just once when every column is constant, as it then gives
+        the same value for every row.
+        """
+        if fold and all(column.constant for column in columns):
+            try:
+                return self.constant(function(*(column.values for column in columns)))
+            except Exception as exc:
+                for row in range(self.rows):
+                    self.errors.setdefault(row, exc.args[0])
+                return self.constant(None)
+
+        errors = self.errors
+        values: list[Any] = []
+        append = values.append
+        rows = zip(*map(self.rows_of, columns)) if columns else repeat((), self.rows)
+        for row, arguments in enumerate(rows):
+            if row in errors:
+                append(None)
+                continue
+            try:
+                append(function(*arguments))
+            except Exception as exc:
+                errors[row] = exc.args[0]
+                append(None)
+        return self.column(values)
+
+    def constant(self, value: Any) -> Column:
+        return Column(value, LITERAL_TYPES.get(type(value), LoxType.UNKNOWN), constant=True)
+
+    def column(self, values: list) -> Column:
+        """
+        A Column of values, with the type every row that hasn't failed has
+        in common.
+        """
+        errors = self.errors
+        if errors:
+            kinds = {type(value) for row, value in enumerate(values) if row not in errors}
+        else:
+            kinds = set(map(type, values))
+        if not kinds:
+            kind = LoxType.NIL
+        elif len(kinds) == 1:
+            kind = LITERAL_TYPES.get(kinds.pop(), LoxType.UNKNOWN)
+        else:
+            kind = LoxType.UNKNOWN
+        if errors and kind in FORMULA_FILLERS:
+            filler = FORMULA_FILLERS[kind]
+            for row in errors:
+                values[row] = filler
+        if kind == LoxType.NUMBER and numpy is not None:
+            values = numpy.array(values, dtype=numpy.float64)
+        return Column(values, kind)
+
+    def rows_of(self, column: Column) -> Iterable[Any]:
+        """
+        The value of column for each row, as Lox values.
+        """
+        if column.constant:
+            return repeat(column.values, self.rows)
+        if type(column.values) is not list:
+            return column.values.tolist()
+        return column.values
+
+
+@dataclass
+class RunStats:
+    """
+    Statistics collected for a single Lox.run.
+
+    Wall and CPU times are in seconds and keyed by phase name ("scan",
+    "parse", "optimize" and "execute"). `lookup_depth` is the total number of
+    enclosing environments walked by variable lookups.
+    """
+    token_count: int = 0
+    statement_count: int = 0
+    node_counts: Counter[str] = field(default_factory=Counter)
+    wall_times: dict[str, float] = field(default_factory=dict)
+    cpu_times: dict[str, float] = field(default_factory=dict)
+    lookups: int = 0
+    lookup_depth: int = 0
+
+    @property
+    def average_lookup_depth(self) -> float:
+        if not self.lookups:
+            return 0.0
+        return self.lookup_depth / self.lookups
+
+    @contextmanager
+    def phase(self, name: str):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.wall_times[name] = self.wall_times.get(name, 0.0) + time.perf_counter() - wall_start
+            self.cpu_times[name] = self.cpu_times.get(name, 0.0) + time.process_time() - cpu_start
+
+    def record_lookup(self, depth: int):
+        self.lookups += 1
+        self.lookup_depth += depth
+
+    def count_nodes(self, statements: list[Statement]):
+        pending: list[Any] = list(statements)
+        while pending:
+            node = pending.pop()
+            if isinstance(node, list):
+                pending += node
+            elif isinstance(node, (Expr, Statement)):
+                self.node_counts[type(node).__name__] += 1
+                if isinstance(node, Statement):
+                    self.statement_count += 1
+                if is_dataclass(node):
+                    pending += [getattr(node, f.name) for f in fields(node)]
+
+    def report(self) -> str:
+        lines = [
+            f"tokens      {self.token_count}",
+            f"statements  {self.statement_count}",
+            "nodes",
+        ]
+        for name, count in sorted(self.node_counts.items()):
+            lines.append(f"  {name:<24}{count:>10}")
+        lines.append(f"{'phase':<12}{'wall':>12}{'cpu':>12}")
+        for name, wall in self.wall_times.items():
+            lines.append(f"  {name:<10}{wall:>11.6f}s{self.cpu_times[name]:>11.6f}s")
+        lines.append(
+            f"lookups     {self.lookups} "
+            f"(average depth {self.average_lookup_depth:.2f})"
+        )
+        return "\n".join(lines)
+
+
+def deep_sizeof(obj, seen: Optional[set[int]] = None) -> tuple[int, int]:
+    """
+    Total size in bytes and number of objects reachable from obj, as counted
+    by sys.getsizeof. Objects whose ids are in seen are skipped, and every
+    object visited is added to it, so a shared seen set attributes each object
+    to the first thing it was measured under. None, booleans, classes, modules
+    and functions aren't counted.
+    """
+    if seen is None:
+        seen = set()
+
+    size = 0
+    count = 0
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if obj is None or id(obj) in seen or isinstance(
+            obj, (bool, type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+        ):
+            continue
+
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        count += 1
+        if isinstance(obj, dict):
+            pending += obj.keys()
+            pending += obj.values()
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending += obj
+        elif is_dataclass(obj):
+            # Read the fields directly, since asking for __dict__ would
+            # allocate one for objects that don't have it materialised.
+            pending += [getattr(obj, f.name) for f in fields(obj)]
+        elif hasattr(obj, "__slots__"):
+            pending += [
+                getattr(obj, slot)
+                for slot in obj.__slots__
+                if hasattr(obj, slot)
+            ]
+        elif hasattr(obj, "__dict__"):
+            pending.append(vars(obj))
+
+    return size, count
+
+
+@dataclass
+class MemoryReport:
+    """
+    Memory held by each stage of a single Lox.run.
+
+    The token stream, the AST and each Environment are measured by walking
+    the objects they reference, as (bytes, objects) pairs. Objects are only
+    counted once, under the first stage that holds them, so the AST doesn't
+    include tokens it shares with the token stream, and the source text isn't
+    counted at all. `peaks` holds the peak traced allocation during each
+    phase in bytes, relative to what was allocated when the phase started.
+    """
+    tokens: tuple[int, int] = (0, 0)
+    ast: tuple[int, int] = (0, 0)
+    # (bytes, objects, number of values) for each Environment, innermost first
+    environments: list[tuple[int, int, int]] = field(default_factory=list)
+    peaks: dict[str, int] = field(default_factory=dict)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            self.peaks[name] = max(self.peaks.get(name, 0), peak - baseline)
+            if started:
+                tracemalloc.stop()
+
+    def measure(self, source: str, tokens, statements, environment: Optional[Environment]):
+        seen = {id(source)}
+        self.tokens = deep_sizeof(tokens, seen)
+        self.ast = deep_sizeof(statements, seen)
+        self.environments = []
+        while environment is not None:
+            size, count = deep_sizeof(environment, seen)
+            self.environments.append((size, count, len(environment.values)))
+            environment = environment.enclosing
+
+    def report(self) -> str:
+        lines = [
+            f"{'':<16}{'bytes':>12}{'objects':>10}",
+            f"{'tokens':<16}{self.tokens[0]:>12}{self.tokens[1]:>10}",
+            f"{'ast':<16}{self.ast[0]:>12}{self.ast[1]:>10}",
+        ]
+        for depth, (size, count, values) in enumerate(self.environments):
+            lines.append(
+                f"{f'environment {depth}':<16}{size:>12}{count:>10}"
+                f"  ({values} values)"
+            )
+        lines.append("peak")
+        for name, peak in self.peaks.items():
+            lines.append(f"  {name:<14}{peak:>12}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def run_phase(
+    name: str, stats: RunStats | bool, memory: MemoryReport | bool
+) -> Iterator[None]:
+    """
+    Time and measure the phase of a run called name, for whichever of stats
+    and memory are being collected.
+    """
+    with stats.phase(name) if isinstance(stats, RunStats) else nullcontext():
+        with memory.phase(name) if isinstance(memory, MemoryReport) else nullcontext():
+            yield
+
+
+_had_error = False
+_had_runtime_error = False
+_had_budget_error = False
+
+
+# Accessors for the Lox error flag properties, outside the class because mypyc
+# can't refer to its methods from the class body
+def _get_error(_):
+    return _had_error
+
+
+def _set_error(_, val):
+    global _had_error
+    _had_error = val
+
+
+def _get_runtime_error(_):
+    return _had_runtime_error
+
+
+def _set_runtime_error(_, val):
+    global _had_runtime_error
+    _had_runtime_error = val
+
+
+def _get_budget_error(_):
+    return _had_budget_error
+
+
+def _set_budget_error(_, val):
+    global _had_budget_error
+    _had_budget_error = val
+
+
+# The error flags below are properties replaced through the class. Not a
+# dataclass, since mypyc would make every attribute of the class body a field,
+# properties included.
+@mypyc_attr(native_class=False)
+class Lox:
+    def __init__(
+        self,
+        interpreter: Optional[Interpreter] = None,
+        scanner_class: type[Scanner] = Scanner,
+        parser_class: type[Parser] = Parser,
+        optimize: bool = False,
+    ) -> None:
+        self.interpreter = Interpreter() if interpreter is None else interpreter
+        self.scanner_class = scanner_class
+        self.parser_class = parser_class
+        # Run the Optimizer and then TypeInference over each source before
+        # executing it. This treats each source as a whole program, so it's
+        # meant for run_file rather than the prompt.
+        self.optimize = optimize
+        # Imported modules are scanned and parsed the same way
+        self.interpreter.importer.scanner_class = scanner_class
+        self.interpreter.importer.parser_class = parser_class
 
     # TODO: how to do classproperties like java statics? Not that I think that's
     # good, but that's how the book does it.
-    had_runtime_error = property(get_runtime_error, set_runtime_error)
-
-    def run_file(self, path: Path | str):
+    had_error = property(_get_error, _set_error)
+    had_runtime_error = property(_get_runtime_error, _set_runtime_error)
+    had_budget_error = property(_get_budget_error, _set_budget_error)
+
+    def run_file(
+        self,
+        path: Path | str,
+        stats: bool | RunStats = False,
+        memory: bool | MemoryReport = False,
+    ) -> Optional[RunStats | MemoryReport]:
         with open(path) as f:
             source = f.read()
-        self.run(source)
+        path = Path(path).resolve()
+        with self.interpreter.importer.run(path):
+            report = self.run(source, stats, memory, path)
 
         if self.had_error:
             sys.exit(65)
+        if self.had_budget_error:
+            sys.exit(75)
         if self.had_runtime_error:
             sys.exit(70)
 
+        return report
+
 
-    def run_prompt(self):
+    def run_prompt(self, stats: bool = False, memory: bool = False):
         while True:
             try:
                 line = input("> ")
@@ -937,27 +5940,120 @@ class Lox:
                 break
             except KeyboardInterrupt:
                 break
-            self.run(line)
+            run_stats = RunStats() if stats else None
+            memory_report = MemoryReport() if memory else None
+            self.run(line, run_stats or False, memory_report or False)
+            for report in (run_stats, memory_report):
+                if report:
+                    print(report.report(), file=sys.stderr)
 
             # If the user is running interactively, an error shouldn't kill the
             # entire session.
             self.had_error = False
 
-    def run(self, source: str):
-        self.interpreter.interpret(Parser.parse_str(source))
+    def run(
+        self,
+        source: str,
+        stats: bool | RunStats = False,
+        memory: bool | MemoryReport = False,
+        path: Optional[Path] = None,
+    ) -> Optional[RunStats | MemoryReport]:
+        """
+        Run source, returning the RunStats collected for it if stats is True,
+        or otherwise the MemoryReport if memory is True. An existing RunStats
+        or MemoryReport can also be passed in to be filled, which is how to
+        collect both at once. Imports are relative to `path`, the file source
+        was read from, if there is one.
+        """
+        if stats is True:
+            stats = RunStats()
+        if memory is True:
+            memory = MemoryReport()
+        if not stats and not memory:
+            tokens = self.scanner_class.scan_str(source)
+            statements = self.parse(tokens, path)
+            if statements is None:
+                return None
+            if self.optimize:
+                statements = self.optimized(statements)
+                if statements is None:
+                    return None
+            self.interpreter.interpret(statements, path)
+            return None
+
+        with run_phase("scan", stats, memory):
+            tokens = self.scanner_class.scan_str(source)
+        with run_phase("parse", stats, memory):
+            statements = self.parse(tokens, path)
+        if statements is None:
+            return stats or memory or None
+        if self.optimize:
+            with run_phase("optimize", stats, memory):
+                statements = self.optimized(statements)
+            if statements is None:
+                return stats or memory or None
+
+        if stats:
+            stats.token_count += len(tokens)
+            stats.count_nodes(statements)
+            self.interpreter.stats = stats
+        try:
+            with run_phase("execute", stats, memory):
+                self.interpreter.interpret(statements, path)
+        finally:
+            self.interpreter.stats = None
+
+        if memory:
+            memory.measure(source, tokens, statements, self.interpreter.environment)
+        return stats or memory or None
+
+    def parse(self, tokens: Tokens, path: Optional[Path]) -> Optional[list[Statement]]:
+        """
+        The statements parsed from tokens, or None if any of them failed to
+        parse, which has been reported.
+        """
+        parsed = self.parser_class(tokens, path=path).parse()
+        statements = [statement for statement in parsed if statement is not None]
+        return statements if len(statements) == len(parsed) else None
+
+    def optimized(self, statements: list[Statement]) -> Optional[list[Statement]]:
+        """
+        The optimized statements, or None if they were nested too deeply to
+        optimize, which has been reported.
+        """
+        defined = set(self.interpreter.environment.values)
+        inference = TypeInference(defined=defined)
+        try:
+            statements = Optimizer(defined=defined).optimize(statements)
+            statements = inference.specialize(statements)
+        except RecursionError:
+            Lox.runtime_error("Stack overflow.")
+            return None
+        for line, message in inference.warnings:
+            self.warning(line, message)
+        return statements
 
+    def define_native(self, name: str, arity: int, function: Callable, pure: bool = False):
+        self.interpreter.define_native(name, arity, function, pure)
 
     @classmethod
     def error(cls, line: int, message: str):
         cls.report(line, "", message)
 
+    @staticmethod
+    def warning(line: int, message: str):
+        # Unlike errors, warnings don't stop the script from running
+        print(f"[line {line}] Warning: {message}", file=sys.stderr)
+
     @classmethod
-    def runtime_error(cls, message):
+    def runtime_error(cls, message, exceeded_budget: bool = False):
         print(
             message,
             file=sys.stderr
         )
-        cls.had_runtime_error = True
+        cls.had_runtime_error = True  # type: ignore[assignment]
+        if exceeded_budget:
+            cls.had_budget_error = True  # type: ignore[assignment]
 
     @classmethod
     def error_token(cls, token, message):
@@ -973,15 +6069,120 @@ class Lox:
             file=sys.stderr
         )
 
-        cls.had_error = True
+        cls.had_error = True  # type: ignore[assignment]
 
 
-def main(args):
-    if len(args) > 1:
-        print("Usage: lox.py [script]", file=sys.stderr)
+class LoxArgumentParser(ArgumentParser):
+    def error(self, message: str):
+        self.print_usage(sys.stderr)
+        print(f"{self.prog}: error: {message}", file=sys.stderr)
         sys.exit(64)
-    elif args:
-        script_file = args[0]
-        Lox().run_file(script_file)
+
+
+def argument_parser() -> ArgumentParser:
+    parser = LoxArgumentParser(prog="lox.py")
+    parser.add_argument("script", nargs="?")
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print token, node, timing and lookup statistics to stderr",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="print memory held by tokens, AST and environments, and peak "
+        "memory per phase, to stderr",
+    )
+    parser.add_argument(
+        "--max-steps",
+        type=int,
+        help="fail with exit code 75 after evaluating this many statements "
+        "and expressions",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="fail with exit code 75 after running for this many seconds",
+    )
+    parser.add_argument(
+        "--max-string-length",
+        type=int,
+        help="fail with exit code 75 after producing this many characters "
+        "of strings",
+    )
+    parser.add_argument(
+        "--coverage",
+        metavar="FILE",
+        help="record which lines are executed, merged into the coverage "
+        "data in this file",
+    )
+    parser.add_argument(
+        "--lcov",
+        metavar="FILE",
+        help="with --coverage, write an LCOV report of all the coverage "
+        "data in its file to this file",
+    )
+    parser.add_argument(
+        "--image",
+        metavar="FILE",
+        help="start from the globals saved in this image by --save-image",
+    )
+    parser.add_argument(
+        "--save-image",
+        metavar="FILE",
+        help="save the globals to this image after running the script",
+    )
+    parser.add_argument(
+        "--import-path",
+        action="append",
+        default=[],
+        metavar="DIR",
+        help="look for imported modules in this directory too, after the "
+        "importing file's own; can be given more than once",
+    )
+    return parser
+
+
+def main(args):
+    parser = argument_parser()
+    options = parser.parse_args(args)
+    if options.save_image and not options.script:
+        parser.error("--save-image needs a script to run")
+    stats = RunStats() if options.stats else False
+    memory = MemoryReport() if options.memory else False
+    budget = None
+    if (
+        options.max_steps is not None
+        or options.timeout is not None
+        or options.max_string_length is not None
+    ):
+        budget = Budget(
+            max_steps=options.max_steps,
+            timeout=options.timeout,
+            max_string_length=options.max_string_length,
+        )
+    importer = Importer(search_path=[Path(directory) for directory in options.import_path])
+    coverage = Coverage() if options.coverage else None
+    lox = Lox(interpreter=Interpreter(budget=budget, importer=importer, coverage=coverage))
+    if options.image:
+        try:
+            lox.interpreter.load_image(options.image)
+        except (OSError, ImageError) as exc:
+            print(f"Can't load image: {exc}", file=sys.stderr)
+            sys.exit(66)
+    if options.script:
+        try:
+            lox.run_file(options.script, stats, memory)
+            if options.save_image:
+                lox.interpreter.save_image(options.save_image)
+        finally:
+            for report in (stats, memory):
+                if report:
+                    print(report.report(), file=sys.stderr)
+            if coverage is not None:
+                coverage.write(options.coverage, merge=True)
+                if options.lcov:
+                    with open(options.lcov, "w") as f:
+                        f.write(Coverage.read(options.coverage).lcov())
     else:
-        Lox().run_prompt()
+        lox.run_prompt(options.stats, options.memory)
@@ -0,0 +1,46 @@
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# LOX_BUILD picks which build of lox the suite runs against, see
+# `make test-both`: "pure" loads lox/__init__.py even when the mypyc
+# extension is there, and "compiled" insists on the extension.
+LOX_BUILD = os.environ.get("LOX_BUILD")
+if LOX_BUILD == "pure":
+    package = Path(__file__).parent.parent / "lox"
+    spec = importlib.util.spec_from_file_location(
+        "lox", package / "__init__.py", submodule_search_locations=[str(package)]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["lox"] = module
+    spec.loader.exec_module(module)
+
+import lox
+
+
+def pytest_configure(config):
+    if LOX_BUILD == "compiled" and not lox.COMPILED:
+        raise pytest.UsageError("lox isn't compiled, run `make compile` first")
+
+
+@pytest.fixture(autouse=True)
+def reset_error_flags():
+    # The error flags are global, like the static fields in the book, and
+    # assigning them through the class replaces the properties. Put both back
+    # afterwards so that one test's errors don't leak into the next.
+    saved = {
+        name: lox.Lox.__dict__[name]
+        for name in ("had_error", "had_runtime_error", "had_budget_error")
+    }
+    lox._had_error = False
+    lox._had_runtime_error = False
+    lox._had_budget_error = False
+    yield
+    for name, value in saved.items():
+        setattr(lox.Lox, name, value)
+    lox._had_error = False
+    lox._had_runtime_error = False
+    lox._had_budget_error = False
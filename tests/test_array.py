@@ -0,0 +1,73 @@
+import lox
+
+import pytest
+
+
+@pytest.fixture(params=["array", "numpy"])
+def backend(request, monkeypatch):
+    if request.param == "array":
+        monkeypatch.setattr(lox, "numpy", None)
+    elif lox.numpy is None:
+        pytest.skip("numpy is not installed")
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "input_str,expected",
+    [
+        ("[1, 2, 3]", [1, 2, 3]),
+        ("[]", []),
+        ("[1, 2] + [10, 20]", [11, 22]),
+        ("[1, 2] - 1", [0, 1]),
+        ("10 - [1, 2]", [9, 8]),
+        ("[1, 2] * [3, 4]", [3, 8]),
+        ("[1, 2] / 4", [0.25, 0.5]),
+        ("[1, 2, 3] > 2", [0, 0, 1]),
+        ("[1, 2, 3] <= [3, 2, 1]", [1, 1, 0]),
+        ("-[1, -2]", [-1, 2]),
+        ("[1, 2 * 3][1]", 6),
+        ("[4, 5, 6][2] + 1", 7),
+        ("[1, 2] == [1, 2]", True),
+        ("[1, 2] != [1, 2, 3]", True),
+        ("[1, 2] == 1", False),
+    ]
+)
+@pytest.mark.parametrize("interpreter_class", [lox.Interpreter, lox.StackInterpreter])
+def test_evaluate_arrays(backend, interpreter_class, input_str, expected):
+    result = interpreter_class.evaluate_str(input_str)
+    if isinstance(expected, list):
+        assert isinstance(result, lox.LoxArray)
+        assert list(result) == expected
+    else:
+        assert result == expected
+
+
+@pytest.mark.parametrize(
+    "input_str,message",
+    [
+        ("[1, 2] + [1]", "same length"),
+        ('[1, "a"]', "must be numbers"),
+        ('[1] + "a"', "not supported"),
+        ("[1, 2][2]", "out of range"),
+        ("[1, 2][-1]", "out of range"),
+        ("[1, 2][0.5]", "whole number"),
+        ("1[0]", "Only arrays"),
+        ("[1] / 0", "zero"),
+    ]
+)
+def test_array_errors(backend, input_str, message):
+    with pytest.raises(Exception) as exc:
+        lox.Interpreter.evaluate_str(input_str)
+    assert message in str(exc.value)
+
+
+def test_reductions(backend):
+    array = lox.LoxArray.from_values([3.0, -1.0, 2.5])
+    assert (array.sum(), array.min(), array.max()) == (4.5, -1.0, 3.0)
+    with pytest.raises(Exception):
+        lox.LoxArray.from_values([]).min()
+
+
+def test_print_array(backend, capsys):
+    lox.Lox().run("var a = [1, 2.5] * 2; print a; print a[1];")
+    assert capsys.readouterr().out == "[2, 5]\n5\n"
@@ -0,0 +1,60 @@
+import lox
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "input_str,expected",
+    [
+        ("var a = 1; { a = 2; { print a; } } print a;", "2\n2"),
+        ("var a = 1; { var a = 2; { var a = 3; print a; } print a; } print a;", "3\n2\n1"),
+        # Pooled scopes start out empty each time
+        ("fun f(n) { { var a; print a; a = n; } } f(1); f(2);", "nil\nnil"),
+        # Recursion inside a pooled scope gets a scope of its own
+        ("fun f(n) { { var a = n; if (n > 0) f(n - 1); print a; } } f(2);", "0\n1\n2"),
+        ("var g; { var a = 1; { fun h() { return a; } g = h; } } { var a = 2; } print g();", "1"),
+        ("fun f() { { var a = 1; { return a; } } } print f(); print f();", "1\n1"),
+    ]
+)
+def test_blocks(capsys, input_str, expected):
+    lox.Lox().run(input_str)
+    captured = capsys.readouterr()
+    assert captured.err == ""
+    assert captured.out == expected + "\n"
+
+
+@pytest.mark.parametrize(
+    "input_str,declares,captures",
+    [
+        ("{ a = 1; { print a; } }", False, False),
+        ("{ var a = 1; print a; }", True, False),
+        ("{ var a = 1; { fun f() {} } }", True, True),
+        ("{ { var a = 1; } }", False, False),
+        ("{ class A {} }", True, True),
+    ]
+)
+def test_block_scopes(input_str, declares, captures):
+    block = lox.Parser(lox.Scanner.scan_str(input_str)).parse()[0]
+    assert (block.declares, block.captures) == (declares, captures)
+
+
+def test_environments_are_recycled():
+    interpreter = lox.Interpreter()
+    runtime = lox.Lox(interpreter=interpreter)
+    runtime.run("{ var a = 1; { var b = 2; } }")
+    assert len(interpreter.free_environments) == 2
+    recycled = list(interpreter.free_environments)
+    runtime.run("{ var a = 1; { var b = 2; } }")
+    assert interpreter.free_environments == recycled
+    assert all(not env.values and env.enclosing is None for env in recycled)
+
+
+def test_captured_scopes_are_not_recycled():
+    interpreter = lox.Interpreter()
+    lox.Lox(interpreter=interpreter).run("{ var a = 1; fun f() { return a; } }")
+    assert interpreter.free_environments == []
+
+
+def test_blocks_without_declarations_have_no_scope():
+    stats = lox.Lox().run("var a = 1; { { { print a; } } }", stats=True)
+    assert stats.lookup_depth == 0
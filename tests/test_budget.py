@@ -0,0 +1,90 @@
+import lox
+
+import pytest
+
+
+def run(source, budget):
+    interpreter = lox.Interpreter(budget=budget)
+    lox.Lox(interpreter=interpreter).run(source)
+    return interpreter
+
+
+# "print 1 + 2;" is one statement and three expressions
+@pytest.mark.parametrize("max_steps, exceeded", [(3, True), (4, False), (100, False)])
+@pytest.mark.parametrize("check_interval", [1, 2, 1024])
+def test_step_limit(max_steps, exceeded, check_interval, capsys):
+    budget = lox.Budget(max_steps=max_steps, check_interval=check_interval)
+    run("print 1 + 2;", budget)
+    captured = capsys.readouterr()
+    assert lox.Lox().had_budget_error is exceeded
+    assert lox.Lox().had_runtime_error is exceeded
+    if exceeded:
+        assert captured.out == ""
+        assert "more than 3 steps" in captured.err
+    else:
+        assert captured.out == "3\n"
+
+
+def test_step_limit_counts_across_statements(capsys):
+    budget = lox.Budget(max_steps=5)
+    run("print 1; print 2; print 3;", budget)
+    assert capsys.readouterr().out == "1\n2\n"
+    assert lox.Lox().had_budget_error
+
+
+def test_deadline(capsys):
+    source = "print " + " + ".join(["1"] * 200) + ";"
+    run(source, lox.Budget(timeout=0, check_interval=16))
+    assert capsys.readouterr().out == ""
+    assert lox.Lox().had_budget_error
+
+
+def test_string_limit(capsys):
+    budget = lox.Budget(max_string_length=10)
+    run('var a = "abc" + "def"; print a; var b = a + "ghij";', budget)
+    captured = capsys.readouterr()
+    assert captured.out == "abcdef\n"
+    assert "more than 10 string characters" in captured.err
+    assert lox.Lox().had_budget_error
+    assert budget.string_length == 16
+
+
+def test_ordinary_errors_are_not_budget_errors():
+    run('print 1 - "a";', lox.Budget(max_steps=100))
+    assert lox.Lox().had_runtime_error
+    assert not lox.Lox().had_budget_error
+
+
+def test_budget_is_uninstalled():
+    interpreter = run("print 1;", lox.Budget(max_steps=100))
+    assert interpreter.evaluate == interpreter.evaluate_expression
+    assert interpreter.execute == interpreter.execute_statement
+    assert interpreter.binary == interpreter.binary_operator
+    assert interpreter.concatenate == interpreter.concatenate_strings
+
+
+def test_budget_with_stack_interpreter(capsys):
+    # Expressions evaluated without recursion count once per tree
+    interpreter = lox.StackInterpreter(budget=lox.Budget(max_steps=3))
+    lox.Lox(interpreter=interpreter).run("print -(-(-1)); print 2;")
+    assert capsys.readouterr().out == "-1\n"
+    assert lox.Lox().had_budget_error
+
+
+def test_budget_exit_code(tmp_path):
+    script = tmp_path / "script.lox"
+    script.write_text('print "a" + "b";')
+    with pytest.raises(SystemExit) as exc:
+        lox.main([str(script), "--max-string-length", "1"])
+    assert exc.value.code == 75
+
+
+def test_string_limit_when_optimized(capsys):
+    # Every string here is a constant, which the Optimizer could fold
+    source = 'var a = "ab"; var b = a + a; var c = b + b; var d = c + c; print d;'
+    interpreter = lox.Interpreter(budget=lox.Budget(max_string_length=10))
+    lox.Lox(interpreter=interpreter, optimize=True).run(source)
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "more than 10 string characters" in captured.err
+    assert lox.Lox().had_budget_error
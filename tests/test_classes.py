@@ -0,0 +1,175 @@
+import lox
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "input_str,expected",
+    [
+        (
+            "class A {} print A; print A();",
+            "A\nA instance",
+        ),
+        (
+            "class P { init(x, y) { this.x = x; this.y = y; } sum() { return this.x + this.y; } }"
+            "var p = P(1, 2); print p.sum(); p.x = 10; print p.sum();",
+            "3\n12",
+        ),
+        (
+            # Fields shadow methods
+            "class A { m() { return 1; } } var a = A(); print a.m(); a.m = clock; print a.m == clock;",
+            "1\ntrue",
+        ),
+        (
+            "class A { m() { return this.v; } } var a = A(); a.v = 3; var m = a.m; a.v = 4; print m(); print m;",
+            "4\n<fn m>",
+        ),
+        (
+            "class A { name() { return \"A\"; } hi() { return \"hi \" + this.name(); } }"
+            "class B < A { name() { return \"B\" + super.name(); } }"
+            "print B().hi();",
+            "hi BA",
+        ),
+        (
+            # super is bound to the class the method was declared in
+            "class A { m() { return \"A\"; } } class B < A { m() { return super.m(); } }"
+            "class C < B {} print C().m();",
+            "A",
+        ),
+        (
+            "class A { init() { this.v = 1; return; } } var a = A(); print a.init() == a; print a.v;",
+            "true\n1",
+        ),
+        (
+            "class A { get() { fun inner() { return this.v; } return inner; } } var a = A(); a.v = 7; print a.get()();",
+            "7",
+        ),
+        (
+            "class C { loop(n) { if (n < 1) return \"done\"; return this.loop(n - 1); } } print C().loop(20000);",
+            "done",
+        ),
+    ]
+)
+@pytest.mark.parametrize("interpreter_class", [lox.Interpreter, lox.StackInterpreter])
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_classes(capsys, interpreter_class, parser_class, input_str, expected):
+    lox.Lox(interpreter=interpreter_class(), parser_class=parser_class).run(input_str)
+    captured = capsys.readouterr()
+    assert captured.err == ""
+    assert captured.out == expected + "\n"
+
+
+@pytest.mark.parametrize(
+    "input_str,message",
+    [
+        ("print this;", "Can't use 'this' outside of a class."),
+        ("fun f() { return super.m(); }", "Can't use 'super' outside of a class."),
+        ("class A { m() { super.m(); } }", "Can't use 'super' in a class with no superclass."),
+        ("class A { init() { return 1; } }", "Can't return a value from an initializer."),
+        ("class A < A {}", "A class can't inherit from itself."),
+    ]
+)
+def test_class_parse_errors(capsys, input_str, message):
+    lox.Parser(lox.Scanner.scan_str(input_str)).parse()
+    assert message in capsys.readouterr().err
+
+
+@pytest.mark.parametrize(
+    "input_str,message",
+    [
+        ("class A {} A().x;", "Undefined property 'x' on line 1"),
+        ("class A {} A().x();", "Undefined property 'x' on line 1"),
+        ("1.x;", "Only instances have properties"),
+        ('"a".x = 1;', "Only instances have fields"),
+        ("var B = 1; class A < B {}", "Superclass must be a class"),
+        ("class A {} A(1);", "Expected 0 arguments but got 1"),
+        ("class A { init(a) {} } A();", "Expected 1 arguments but got 0"),
+        ("class A { m() {} } class B < A { m() { super.x(); } } B().m();", "Undefined property 'x'"),
+    ]
+)
+def test_class_runtime_errors(capsys, input_str, message):
+    lox.Lox().run(input_str)
+    assert message in capsys.readouterr().err
+
+
+def test_instances_share_shapes():
+    interpreter = lox.Interpreter()
+    lox.Lox(interpreter=interpreter).run("""
+        class P { init(x, y) { this.x = x; this.y = y; } }
+        var a = P(1, 2);
+        var b = P(3, 4);
+        var c = P(5, 6);
+        c.z = 7;
+    """)
+    a, b, c = (interpreter.globals.get(lox.Scanner.scan_str(name)[0]) for name in "abc")
+    assert a.shape is b.shape
+    assert a.shape.indices == {lox.symbols.intern("x"): 0, lox.symbols.intern("y"): 1}
+    assert c.shape is a.shape.transitions[lox.symbols.intern("z")]
+    assert c.fields == [5, 6, 7]
+
+
+def test_inline_caches():
+    source = """
+        class A { m() { return 1; } }
+        class B { m() { return 2; } }
+        fun f(o) { return o.m() + o.v; }
+    """
+    statements = lox.Parser(lox.Scanner.scan_str(source)).parse()
+    interpreter = lox.Interpreter()
+    interpreter.interpret(statements)
+    body = statements[2].body[0].value
+    call, get = body.left, body.right
+
+    def run(source):
+        lox.Lox(interpreter=interpreter).run(source)
+
+    run("var a = A(); a.v = 10; print f(a);")
+    a_shape = interpreter.globals.get(lox.Scanner.scan_str("a")[0]).shape
+    assert call.callee.shape is a_shape and call.callee.method.declaration.name.lexeme == "m"
+    assert get.shape is a_shape and get.index == 0
+
+    # A different class at the same site replaces the cache
+    run("var b = B(); b.v = 20; print f(b); print f(a);")
+    assert get.shape is a_shape
+
+
+def test_method_lookup_is_cached_per_class():
+    interpreter = lox.Interpreter()
+    lox.Lox(interpreter=interpreter).run(
+        "class A { m() {} } class B < A {} class C < B {} C().m(); C().m();"
+    )
+    c = interpreter.globals.get(lox.Scanner.scan_str("C")[0])
+    m = lox.symbols.intern("m")
+    assert c.method_cache[m] is c.superclass.superclass.methods[m]
+    assert c.superclass.method_cache[m] is c.method_cache[m]
+
+
+REENTRANT = """
+class A { m(x) { return "A"; } }
+class C { m(x) { return "C"; } }
+class F { init() { this.m = nil; } }
+fun call(o, argument) {
+  var result = o.m(argument());
+  return result;
+}
+fun none() { return nil; }
+fun field(x) { return nil; }
+"""
+
+
+@pytest.mark.parametrize(
+    "input_str,expected",
+    [
+        # The argument runs the same call site on another class first
+        ("fun other() { return call(A(), none); } print call(C(), other);", "C"),
+        # Or on an instance where the name is a field
+        (
+            "fun other() { var f = F(); f.m = field; return call(f, none); } print call(A(), other);",
+            "A",
+        ),
+    ],
+)
+@pytest.mark.parametrize("interpreter_class", [lox.Interpreter, lox.StackInterpreter])
+def test_reentrant_call_sites(capsys, interpreter_class, input_str, expected):
+    lox.Lox(interpreter=interpreter_class()).run(REENTRANT + input_str)
+    assert capsys.readouterr() == (expected + "\n", "")
@@ -0,0 +1,233 @@
+import lox
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "input_str,expected",
+    [
+        (
+            # Each call captures its own variable
+            """
+            fun makeCounter() {
+              var count = 0;
+              fun counter() { count = count + 1; return count; }
+              return counter;
+            }
+            var a = makeCounter(); var b = makeCounter();
+            a(); a();
+            print a(); print b();
+            """,
+            "3\n1",
+        ),
+        (
+            # Closures over the same variable share it, before and after
+            # its scope is left
+            """
+            var get; var set;
+            fun make() {
+              var value = 1;
+              fun g() { return value; }
+              fun s(v) { value = v; }
+              get = g; set = s;
+              s(2);
+              print value;
+            }
+            make();
+            set(3);
+            print get();
+            """,
+            "2\n3",
+        ),
+        (
+            # A new variable for each iteration of a loop body
+            """
+            var first; var second;
+            for (var i = 0; i < 2; i = i + 1) {
+              var j = i;
+              fun f() { return j; }
+              if (i == 0) first = f; else second = f;
+            }
+            print first(); print second();
+            """,
+            "0\n1",
+        ),
+        (
+            # Through a function that doesn't use it itself
+            """
+            fun outer() {
+              var x = "outer";
+              fun middle() {
+                fun inner() { return x; }
+                return inner;
+              }
+              return middle();
+            }
+            print outer()();
+            """,
+            "outer",
+        ),
+        (
+            "fun f() { fun fact(n) { if (n < 2) return 1; return n * fact(n - 1); } return fact(5); } print f();",
+            "120",
+        ),
+        (
+            # Blocks inside a function
+            "fun f() { var a = 1; { var b = 2; fun g() { return a + b; } return g; } } print f()();",
+            "3",
+        ),
+        (
+            """
+            class Box {
+              init(value) { this.value = value; }
+              getter() { fun get() { return this.value; } return get; }
+            }
+            print Box(4).getter()();
+            """,
+            "4",
+        ),
+        (
+            """
+            fun make(greeting) {
+              class A { hi() { return greeting; } }
+              class B < A { hi() { return super.hi() + "!"; } }
+              return B();
+            }
+            print make("hey").hi();
+            """,
+            "hey!",
+        ),
+        (
+            # Names declared after the function are found once they are
+            'var x = "global"; fun f() { fun g() { return x; } var x = "local"; return g(); } print f();',
+            "local",
+        ),
+        (
+            # Local functions calling each other
+            "fun outer() { fun a() { return b(); } fun b() { return 1; } return a(); } print outer();",
+            "1",
+        ),
+        (
+            """
+            fun outer() {
+              fun isEven(n) { if (n == 0) return true; return isOdd(n - 1); }
+              fun isOdd(n) { if (n == 0) return false; return isEven(n - 1); }
+              return isEven(4);
+            }
+            print outer();
+            """,
+            "true",
+        ),
+        (
+            # A global until the block declares its own
+            'var a = "global"; { fun show() { print a; } show(); var a = "block"; show(); }',
+            "global\nblock",
+        ),
+        (
+            # Through a function declared between them
+            """
+            fun outer() {
+              fun middle() { fun inner() { return later; } return inner(); }
+              var later = "later";
+              return middle();
+            }
+            print outer();
+            """,
+            "later",
+        ),
+        (
+            # And assigned through
+            "fun f() { fun set() { x = 2; } var x = 1; set(); return x; } print f();",
+            "2",
+        ),
+        (
+            """
+            fun f() {
+              class A { get() { return value; } }
+              var value = "method";
+              return A().get();
+            }
+            print f();
+            """,
+            "method",
+        ),
+    ],
+)
+@pytest.mark.parametrize("interpreter_class", [lox.Interpreter, lox.StackInterpreter])
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_closures(capsys, interpreter_class, parser_class, input_str, expected):
+    lox.Lox(interpreter=interpreter_class(), parser_class=parser_class).run(input_str)
+    captured = capsys.readouterr()
+    assert captured.err == ""
+    assert captured.out == expected + "\n"
+
+
+@pytest.mark.parametrize(
+    "source,free",
+    [
+        ("fun f(a) { var b = a; return b + c; }", ["c"]),
+        ("fun f() { print a; var a = 1; print a; }", ["a"]),
+        ("fun f() { { var a = 1; } return a; }", ["a"]),
+        ("fun f() { fun g() { return a + b; } var a; }", ["a", "b"]),
+        ("fun f() { fun g() { return f; } }", ["f"]),
+        ("fun f() { return this.a + super.b(); }", ["this", "super"]),
+        ("fun f() { class C < D { m() { return this.a + x; } } }", ["D", "x"]),
+    ],
+)
+def test_free_variables(source, free):
+    function = lox.Parser.parse_str(source)[0]
+    assert [name.lexeme for name in function.free] == free
+
+
+def test_only_free_variables_are_captured():
+    interpreter = lox.Interpreter()
+    lox.Lox(interpreter=interpreter).run("""
+    fun outer() {
+      var used = 1;
+      var unused = 2;
+      fun inner() { return used + clock(); }
+      return inner;
+    }
+    var inner = outer();
+    fun top() { return inner; }
+    """)
+    inner = interpreter.globals.values[lox.symbols.intern("inner")]
+    assert type(inner.closure) is lox.ClosureEnvironment
+    assert inner.closure.enclosing is interpreter.globals
+    upvalue, = inner.closure.values.values()
+    assert upvalue.environment is None
+    assert upvalue.get() == 1
+    # Nothing to capture from the globals
+    top = interpreter.globals.values[lox.symbols.intern("top")]
+    assert top.closure is interpreter.globals
+
+
+def test_late_names_are_undefined_until_declared(capsys):
+    lox.Lox().run("fun outer() { fun a() { return b(); } a(); fun b() {} } outer();")
+    assert capsys.readouterr().err == "Undefined variable b.\n"
+
+
+def test_tail_calls_close_their_frame(capsys):
+    lox.Lox().run("""
+    var saved;
+    fun f(n) {
+      fun get() { return n; }
+      if (n == 0) saved = get;
+      if (n < 3) return f(n + 1);
+      return saved;
+    }
+    print f(0)();
+    """)
+    assert capsys.readouterr().out == "0\n"
+
+
+def test_debugger_sees_captured_values():
+    scopes = []
+
+    def on_pause(pause):
+        scopes.extend(pause.scopes())
+        return "continue"
+
+    source = "fun f() {\n  var a = 1;\n  fun g() {\n    print a;\n  }\n  g();\n}\nf();\n"
+    lox.Lox(interpreter=lox.Interpreter(debugger=lox.Debugger(on_pause, {4}))).run(source)
+    assert scopes[1] == {"a": 1}
@@ -0,0 +1,141 @@
+import threading
+
+import lox
+
+import pytest
+
+SOURCE = """fun sign(n) {
+  if (n < 0) {
+    return -1;
+  } else if (n > 0) {
+    return 1;
+  }
+  return 0;
+}
+print sign(5);
+var i = 0;
+while (i < 0) {
+  i = i + 1;
+}
+"""
+
+
+def run(source, coverage, path=None, parser_class=lox.Parser):
+    interpreter = lox.Interpreter(coverage=coverage)
+    lox.Lox(interpreter=interpreter, parser_class=parser_class).run(source, path=path)
+    return interpreter
+
+
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_report(parser_class, capsys):
+    coverage = lox.Coverage()
+    run(SOURCE, coverage, parser_class=parser_class)
+    assert capsys.readouterr().out == "1\n"
+    assert coverage.report() == {
+        "<script>": {
+            1: True, 2: True, 3: False, 4: True, 5: True, 7: False,
+            9: True, 10: True, 11: True, 12: False,
+        }
+    }
+
+
+def test_probes_remove_themselves():
+    coverage = lox.Coverage()
+    statements = lox.Parser.parse_str("var a = 1;\nif (a > 0) {\n  print a;\n}\nprint 2;")
+
+    def probes():
+        return sum(
+            type(stmt) is lox.CoverageStatement
+            for _, _, stmt in lox.statement_slots(statements)
+        )
+
+    coverage.load(statements)
+    assert probes() == 5
+    lox.Interpreter(coverage=coverage).interpret(statements)
+    assert probes() == 0
+    assert all(coverage.report()["<script>"].values())
+
+
+def test_memoize_sees_through_probes(capsys):
+    run("fun sq(n) { return n * n; }\nvar f = memoize(sq, 4);\nprint f(3);", lox.Coverage())
+    assert capsys.readouterr().out == "9\n"
+
+
+def test_merge():
+    first, second = lox.Coverage(), lox.Coverage()
+    run("var a = 1;\nif (a > 1) {\n  print a;\n}", first)
+    run("var a = 2;\nif (a > 1) {\n  print a;\n}", second)
+    run("print 1;", second, path="other.lox")
+    assert first.report()["<script>"][3] is False
+    first.merge(second)
+    assert first.report() == {
+        "<script>": {1: True, 2: True, 3: True},
+        "other.lox": {1: True},
+    }
+
+
+def test_write_and_read(tmp_path, capsys):
+    path = tmp_path / "coverage.json"
+    first = lox.Coverage()
+    run(SOURCE, first)
+    first.write(path, merge=True)
+    second = lox.Coverage()
+    run(SOURCE.replace("sign(5)", "sign(-5)"), second)
+    second.write(path, merge=True)
+
+    merged = lox.Coverage.read(path)
+    assert merged.report()["<script>"] == {
+        1: True, 2: True, 3: True, 4: True, 5: True, 7: False,
+        9: True, 10: True, 11: True, 12: False,
+    }
+
+
+def test_concurrent_writers(tmp_path):
+    path = tmp_path / "coverage.json"
+
+    def write(name):
+        for round in range(50):
+            coverage = lox.Coverage()
+            run("var a = 1;", coverage, path=f"{name}{round}.lox")
+            coverage.write(path, merge=True)
+
+    writers = [threading.Thread(target=write, args=(name,)) for name in "ab"]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    # Nothing was lost to the other writer replacing the file
+    assert len(lox.Coverage.read(path).report()) == 100
+    assert sorted(file.name for file in tmp_path.iterdir()) == ["coverage.json", "coverage.json.lock"]
+
+
+def test_lcov():
+    coverage = lox.Coverage()
+    run("var a = 1;\nif (a > 1)\n  print a;", coverage, path="a.lox")
+    assert coverage.lcov() == (
+        "TN:\nSF:a.lox\nDA:1,1\nDA:2,1\nDA:3,0\nLF:3\nLH:2\nend_of_record\n"
+    )
+
+
+def test_imported_modules(tmp_path):
+    (tmp_path / "lib.lox").write_text("fun f() {\n  return 1;\n}\nfun g() {\n  return 2;\n}")
+    main = tmp_path / "main.lox"
+    main.write_text('import "lib.lox";\nf();')
+    coverage = lox.Coverage()
+    lox.Lox(interpreter=lox.Interpreter(coverage=coverage)).run_file(main)
+    report = coverage.report()
+    assert report[str(tmp_path / "lib.lox")] == {1: True, 2: True, 4: True, 5: False}
+    assert report[str(main.resolve())] == {1: True, 2: True}
+
+
+def test_cli(tmp_path, capsys):
+    script = tmp_path / "script.lox"
+    script.write_text("var a = 1;\nif (a > 1)\n  print a;\n")
+    data = tmp_path / "coverage.json"
+    report = tmp_path / "lcov.info"
+    lox.main(["--coverage", str(data), str(script)])
+    script.write_text("var a = 2;\nif (a > 1)\n  print a;\n")
+    lox.main(["--coverage", str(data), "--lcov", str(report), str(script)])
+    assert report.read_text() == (
+        f"TN:\nSF:{script.resolve()}\nDA:1,1\nDA:2,1\nDA:3,1\nLF:3\nLH:3\nend_of_record\n"
+    )
@@ -0,0 +1,149 @@
+import threading
+
+import lox
+
+import pytest
+
+SOURCE = """fun add(a, b) {
+  var c = a + b;
+  return c;
+}
+var x = 1;
+var y = add(x, 2);
+for (var i = 0; i < 2; i = i + 1) {
+  print i;
+}
+print y;
+"""
+
+
+def debug(source, breakpoints, commands, parser_class=lox.Parser, **kwargs):
+    """
+    Run source, answering each pause with the next of commands, and return
+    the lines paused on.
+    """
+    commands = iter(commands)
+    lines = []
+
+    def on_pause(pause):
+        lines.append(pause.line)
+        return next(commands)
+
+    debugger = lox.Debugger(on_pause, set(breakpoints))
+    interpreter = lox.Interpreter(debugger=debugger, **kwargs)
+    lox.Lox(interpreter=interpreter, parser_class=parser_class).run(source)
+    return lines
+
+
+@pytest.mark.parametrize(
+    "breakpoints,commands,lines",
+    [
+        ([], [], []),
+        ([8], ["continue"] * 2, [8, 8]),
+        ([5, 10], ["continue"] * 2, [5, 10]),
+        # Into the call, then out through the return
+        ([6], ["step"] * 4 + ["continue"], [6, 2, 3, 7, 7]),
+        # Over the call
+        ([6], ["next", "next", "continue"], [6, 7, 10]),
+        # Over the loop, or into it, stopping once for the statements on
+        # its first line
+        ([7], ["next", "continue"], [7, 10]),
+        ([7], ["step", "step", "step", "continue"], [7, 7, 7, 8]),
+        ([7, 8], ["next", "continue", "continue"], [7, 8, 8]),
+        ([2], ["step"] * 3 + ["continue"], [2, 3, 7, 7]),
+    ],
+)
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_pauses(breakpoints, commands, lines, parser_class, capsys):
+    assert debug(SOURCE, breakpoints, commands, parser_class) == lines
+    assert capsys.readouterr().out == "0\n1\n3\n"
+    assert not lox.Lox().had_runtime_error
+
+
+def test_nothing_is_installed_without_breakpoints(capsys):
+    statements = lox.Parser.parse_str(SOURCE)
+    interpreter = lox.Interpreter(debugger=lox.Debugger(lambda pause: "step"))
+    interpreter.interpret(statements)
+    assert capsys.readouterr().out == "0\n1\n3\n"
+    assert interpreter.execute == interpreter.execute_statement
+    assert not any(
+        type(stmt) is lox.BreakpointStatement
+        for _, _, stmt in lox.statement_slots(statements)
+    )
+
+
+def test_breakpoints_are_set_and_cleared_while_running(capsys):
+    source = "var i = 0;\nwhile (i < 4) {\n  i = i + 1;\n  print i;\n}\n"
+    pauses = []
+
+    def on_pause(pause):
+        pauses.append((pause.line, pause.variables()["i"]))
+        if len(pauses) == 1:
+            debugger.set_breakpoint(4)
+        else:
+            debugger.clear_breakpoint(4)
+        return "continue"
+
+    debugger = lox.Debugger(on_pause, {3})
+    lox.Lox(interpreter=lox.Interpreter(debugger=debugger)).run(source)
+    assert pauses == [(3, 0), (4, 1), (3, 1), (3, 2), (3, 3)]
+    assert capsys.readouterr().out == "1\n2\n3\n4\n"
+
+
+def test_scopes():
+    source = "var a = 1;\nfun f(a) {\n  var b = 2;\n  print a + b;\n}\nf(3);\n"
+    scopes = []
+
+    def on_pause(pause):
+        scopes.extend(pause.scopes())
+        assert pause.variables()["a"] == 3
+        return "continue"
+
+    lox.Lox(interpreter=lox.Interpreter(debugger=lox.Debugger(on_pause, {4}))).run(source)
+    assert scopes[0] == {"a": 3, "b": 2}
+    assert scopes[-1]["a"] == 1
+    assert "clock" in scopes[-1]
+
+
+def test_interrupt(capsys):
+    paused = []
+
+    def on_pause(pause):
+        paused.append(pause.line)
+        return "continue"
+
+    debugger = lox.Debugger(on_pause)
+    debugger.interrupt()
+    lox.Lox(interpreter=lox.Interpreter(debugger=debugger)).run("print 1;\nprint 2;")
+    assert paused == [1]
+    assert capsys.readouterr().out == "1\n2\n"
+
+
+def test_unknown_command(capsys):
+    debug("print 1;", [1], ["jump"])
+    assert "Unknown debugger command 'jump'." in capsys.readouterr().err
+    assert lox.Lox().had_runtime_error
+
+
+def test_with_budget(capsys):
+    budget = lox.Budget(max_steps=1000, check_interval=1)
+    lines = debug(SOURCE, [6], ["step"] * 4 + ["continue"], budget=budget)
+    assert lines == [6, 2, 3, 7, 7]
+    assert budget.steps > 0
+    assert capsys.readouterr().out == "0\n1\n3\n"
+
+
+def test_queues(capsys):
+    queues = lox.DebuggerQueues()
+    debugger = lox.Debugger(queues, {6})
+    interpreter = lox.Interpreter(debugger=debugger)
+    thread = threading.Thread(target=lox.Lox(interpreter=interpreter).run, args=(SOURCE,))
+    thread.start()
+    lines = []
+    for command in ["step", "next", "continue"]:
+        pause = queues.pauses.get(timeout=5)
+        lines.append(pause.line)
+        queues.commands.put(command)
+    thread.join(timeout=5)
+    assert lines == [6, 2, 3]
+    assert capsys.readouterr().out == "0\n1\n3\n"
@@ -0,0 +1,65 @@
+import lox
+
+import pytest
+
+# Comfortably past the default recursion limit
+DEPTH = 20_000
+
+
+def test_deeply_nested_groupings():
+    text = "(" * DEPTH + "1" + ")" * DEPTH
+    assert lox.StackInterpreter.evaluate_str(text) == 1
+
+
+def test_deeply_nested_unary():
+    text = "-" * DEPTH + "1"
+    assert lox.StackInterpreter.evaluate_str(text) == 1
+    assert lox.StackInterpreter.evaluate_str("!" * (DEPTH + 1) + "true") == False
+
+
+def test_long_left_deep_chain():
+    text = " + ".join(["1"] * DEPTH)
+    assert lox.StackInterpreter.evaluate_str(text) == DEPTH
+
+
+def test_long_right_deep_assignment_chain(capsys):
+    names = [f"a{i}" for i in range(DEPTH // 4)]
+    source = "".join(f"var {name};" for name in names)
+    source += " = ".join(names) + " = 3; print a0 + a1;"
+    runtime = lox.Lox(
+        interpreter=lox.StackInterpreter(),
+        parser_class=lox.StackParser,
+    )
+    runtime.run(source)
+    assert capsys.readouterr().out == "6\n"
+
+
+def test_format_deep_ast():
+    expr = lox.LiteralExpr(1)
+    for _ in range(DEPTH):
+        expr = lox.GroupingExpr(expr)
+    assert lox.format_ast(expr) == "(group " * DEPTH + "1" + ")" * DEPTH
+
+
+def test_runtime_error_inside_deep_expression():
+    text = "(" * DEPTH + '1 - "a"' + ")" * DEPTH
+    with pytest.raises(Exception, match="Operand '-' not supported"):
+        lox.StackInterpreter.evaluate_str(text)
+
+
+def test_too_deep_to_optimize_is_reported(capsys):
+    text = "print " + "(" * DEPTH + "1" + ")" * DEPTH + ";"
+    runtime = lox.Lox(
+        interpreter=lox.StackInterpreter(),
+        parser_class=lox.StackParser,
+        optimize=True,
+    )
+    runtime.run(text)
+    captured = capsys.readouterr()
+    # The compiled build doesn't use the Python stack, so gets through it
+    if captured.err:
+        assert captured.err == "Stack overflow.\n"
+        assert captured.out == ""
+        assert runtime.had_runtime_error
+    else:
+        assert captured.out == "1\n"
@@ -0,0 +1,120 @@
+import random
+
+import lox
+
+import pytest
+
+
+def statement_lines(document):
+    statements = [stmt for stmt in document.statements if stmt is not None]
+    return [stmt.line for _, _, stmt in lox.statement_slots(statements)]
+
+
+def assert_matches_fresh(document, parser_class=lox.Parser):
+    fresh = lox.Document(document.source, parser_class)
+    assert [(t, t.lexeme, t.line) for t in document.tokens] == [
+        (t, t.lexeme, t.line) for t in fresh.tokens
+    ]
+    assert document.starts == fresh.starts
+    assert document.statements == fresh.statements
+    assert statement_lines(document) == statement_lines(fresh)
+    assert document.statement_starts == fresh.statement_starts
+    assert document.diagnostics == fresh.diagnostics
+    assert document.scan_errors == fresh.scan_errors
+
+
+@pytest.mark.parametrize(
+    "source,edit",
+    [
+        ("var a = 1;\nprint a;", (8, 1, "22")),
+        ("print ab;", (8, 0, "c")),
+        ("print a(b);", (7, 0, "x")),
+        # Joining a number across a deleted operator
+        ("print 1.+2;", (8, 1, "")),
+        ("print a;\n// note\nprint b;", (11, 0, "more ")),
+        ("print a;\nprint b;", (8, 1, "")),
+        ("print a; print b;", (5, 0, ' "')),
+        ('print "a\nb"; print c;', (7, 0, "\n\n")),
+        ("print a; print b;", (0, 17, "")),
+        ("", (0, 0, "fun f() { return 1; }")),
+        ("print (a;", (8, 0, ")")),
+    ]
+)
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_edit(capsys, parser_class, source, edit):
+    document = lox.Document(source, parser_class)
+    document.edit(*edit)
+    assert_matches_fresh(document, parser_class)
+    # Errors are collected rather than reported
+    assert capsys.readouterr().err == ""
+
+
+def test_unchanged_objects_are_reused():
+    source = "".join(f"var v{i} = {i};\nprint v{i};\n" for i in range(50))
+    document = lox.Document(source)
+    tokens = list(document.tokens)
+    statements = list(document.statements)
+
+    document.edit(source.index("25;"), 2, "7 + 8")
+    assert document.rescanned < 10
+    assert document.reparsed <= 3
+    assert document.statements[:48] == statements[:48]
+    assert all(a is b for a, b in zip(document.statements[52:], statements[52:]))
+    assert all(a is b for a, b in zip(document.tokens[-100:], tokens[-100:]))
+    assert_matches_fresh(document)
+
+
+def test_lines_are_adjusted_lazily():
+    document = lox.Document("print a;\nprint b;\nprint c;")
+    last = document.tokens[-2]
+    document.edit(0, 0, "\n\n")
+    document.edit(0, 0, "\n")
+    assert last.line == 3
+    assert document.line_shifts
+    assert document.tokens[-2] is last and last.line == 6
+    assert not document.line_shifts
+
+
+def test_statement_lines_are_adjusted(capsys):
+    document = lox.Document('fun f() {\n  print 1;\n}\nf();\nprint 1 - "a";')
+    document.edit(0, 0, "\n\n")
+    assert statement_lines(document) == [3, 4, 6, 7]
+    coverage = lox.Coverage()
+    interpreter = lox.Interpreter(coverage=coverage)
+    interpreter.interpret(document.statements)
+    assert capsys.readouterr() == ("1\n", "Operand '-' not supported between float and str on line 7\n")
+    assert coverage.report()["<script>"] == {3: True, 4: True, 6: True, 7: True}
+
+
+def test_diagnostics():
+    document = lox.Document("print 1;\nprint 2\nprint 3;")
+    assert document.diagnostics == [(3, "Expect ';' after value")]
+    document.edit(len("print 1;\nprint 2"), 0, ";")
+    assert document.diagnostics == []
+    document.edit(0, 0, "\n(")
+    assert document.diagnostics == [(2, "Expected expression")]
+    document.edit(0, 0, '"')
+    assert document.diagnostics == [(1, "Unterminated string.")]
+
+
+def test_edit_outside_document():
+    document = lox.Document("print 1;")
+    with pytest.raises(ValueError):
+        document.edit(5, 10, "")
+
+
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_random_edits(capsys, parser_class):
+    rng = random.Random(2024)
+    pieces = ["a", "1", " ", "\n", "+", "=", '"', ";", "(", ")", "{", "}", ".",
+              "var ", "print ", "fun ", "/", "//", "!", "<"]
+    for _ in range(100):
+        document = lox.Document(
+            "".join(rng.choice(pieces) for _ in range(rng.randint(0, 30))), parser_class
+        )
+        for _ in range(5):
+            offset = rng.randint(0, len(document.source))
+            deleted = rng.randint(0, min(3, len(document.source) - offset))
+            inserted = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 3)))
+            document.edit(offset, deleted, inserted)
+            assert_matches_fresh(document, parser_class)
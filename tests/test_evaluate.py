@@ -72,5 +72,6 @@ import pytest
         ),
     ]
 )
-def test_scripts(input_str, expected):
-    assert lox.Interpreter.evaluate_str(input_str) == expected
+@pytest.mark.parametrize("interpreter_class", [lox.Interpreter, lox.StackInterpreter])
+def test_scripts(interpreter_class, input_str, expected):
+    assert interpreter_class.evaluate_str(input_str) == expected
@@ -0,0 +1,161 @@
+from array import array
+
+import lox
+
+import pytest
+
+
+@pytest.fixture(params=["array", "numpy"])
+def backend(request, monkeypatch):
+    if request.param == "array":
+        monkeypatch.setattr(lox, "numpy", None)
+    elif lox.numpy is None:
+        pytest.skip("numpy is not installed")
+    return request.param
+
+
+def per_row(source, columns):
+    """
+    The value or error message interpreting source gives for each row.
+    """
+    interpreter = lox.Interpreter()
+    expression = lox.Formula.parse(source, interpreter).expression
+    results = []
+    for row in zip(*columns.values()):
+        values = {
+            lox.symbols.intern(name): float(value) if type(value) is int else value
+            for name, value in zip(columns, row)
+        }
+        interpreter.environment = lox.Environment(interpreter.globals, values)
+        try:
+            results.append(interpreter.evaluate(expression))
+        except Exception as exc:
+            results.append(exc.args[0])
+    return results
+
+
+COLUMNS = {
+    "a": [1.0, 2.0, -3.5, 0.0],
+    "b": [4.0, 0.0, 2.0, 0.0],
+    "s": ["x", "y", "", "zz"],
+    "t": ["1", "2", "3", "4"],
+    "m": [1.0, "one", None, True],
+    "flag": [True, False, True, False],
+}
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "a",
+        "a + b * 2 - 1",
+        "(a - b) / 2",
+        "-a",
+        "a > b", "a >= b", "a < 1", "a <= b",
+        "a == b", "a != 0", "s == t", "m == 1",
+        's + "!"', "s + t",
+        "!flag", "!a", "!m", "!s", "!nil",
+        # Only fails where b is 0
+        "a / b",
+        "1 / b + 1",
+        # Fails for every row, or some
+        "s - 1", "a + s", "m + 1", "-m", "-s",
+        "sqrt(a * a + b * b)", "len(s) + a",
+        "[a, b][1]", "[a, b] * 2",
+        "1 + 2", "clock == clock",
+        "nope + a",
+    ],
+)
+def test_same_as_each_row(source, backend):
+    expected = per_row(source, COLUMNS)
+    formula = lox.Formula.parse(source)
+    try:
+        values = formula.evaluate(COLUMNS)
+    except lox.FormulaError as exc:
+        errors = exc.errors
+        values = exc.values
+        first = min(errors)
+        assert exc.args[0] == f"{errors[first]} in row {first}"
+    else:
+        errors = {}
+    assert [errors.get(row, value) for row, value in enumerate(values)] == expected
+    assert all(values[row] is None for row in errors)
+    assert all(
+        type(value) is type(want)
+        for row, (value, want) in enumerate(zip(values, expected))
+        if row not in errors
+    )
+
+
+def test_columns(backend):
+    formula = lox.Formula.parse("price * quantity > limit")
+    assert formula.names == ["price", "quantity", "limit"]
+    columns = {
+        "price": array("d", [1.5, 2.5, 3.5]),
+        "quantity": [1, 2, 3],
+        "limit": array("i", [2, 2, 2]),
+        "unused": [None, None, None],
+    }
+    assert formula.evaluate(columns) == [False, True, True]
+
+
+def test_numpy_columns(backend):
+    numpy = pytest.importorskip("numpy")
+    formula = lox.Formula.parse("x * 2 + y")
+    assert formula.evaluate({"x": numpy.arange(3.0), "y": numpy.ones(3, dtype=int)}) == [1.0, 3.0, 5.0]
+
+
+def test_globals():
+    interpreter = lox.Interpreter()
+    lox.Lox(interpreter=interpreter).run("var rate = 2; fun scale(x) { return x * rate; }")
+    formula = lox.Formula.parse("scale(x) + rate", interpreter)
+    assert formula.evaluate({"x": [1, 2]}) == [4.0, 6.0]
+
+
+@pytest.mark.parametrize(
+    "source,columns,expected",
+    [
+        ("next()", {"x": [1, 2, 3]}, [1.0, 2.0, 3.0]),
+        ("next() + 0", {"x": [1, 2, 3]}, [1.0, 2.0, 3.0]),
+        ("[next()][0]", {"x": [1, 2, 3]}, [1.0, 2.0, 3.0]),
+        ("[next()][0]", {}, [1.0]),
+    ],
+)
+def test_calls_are_made_for_every_row(source, columns, expected):
+    interpreter = lox.Interpreter()
+    lox.Lox(interpreter=interpreter).run("var count = 0; fun next() { count = count + 1; return count; }")
+    assert lox.Formula.parse(source, interpreter).evaluate(columns) == expected
+
+
+def test_errors_are_by_row(backend):
+    formula = lox.Formula.parse("(a + 1) / b - len(s)")
+    with pytest.raises(lox.FormulaError) as info:
+        formula.evaluate({"a": [1, 2, 3], "b": [1, 0, 2], "s": ["a", "bc", 3]})
+    assert info.value.errors == {
+        1: "float division by zero",
+        2: "len() expects a string or an array, got a number on line 1",
+    }
+    assert info.value.values == [1.0, None, None]
+    assert str(info.value) == "float division by zero in row 1"
+
+
+@pytest.mark.parametrize(
+    "columns,expected",
+    [
+        ({}, [3.0]),
+        ({"x": []}, []),
+    ],
+)
+def test_rows(columns, expected):
+    assert lox.Formula.parse("1 + 2").evaluate(columns) == expected
+
+
+def test_columns_must_be_the_same_length():
+    with pytest.raises(ValueError, match="Column 'y' has 1 rows, but others have 2."):
+        lox.Formula.parse("x + y").evaluate({"x": [1, 2], "y": [1]})
+
+
+def test_formula_is_one_expression(capsys):
+    with pytest.raises(lox.ParseError):
+        lox.Formula.parse("1 + 2 3")
+    assert "Expect end of formula." in capsys.readouterr().err
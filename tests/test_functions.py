@@ -0,0 +1,102 @@
+import lox
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "input_str,expected",
+    [
+        (
+            "fun fib(n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); } print fib(15);",
+            "610",
+        ),
+        (
+            "fun f() {} print f(); print f;",
+            "nil\n<fn f>",
+        ),
+        (
+            "fun f() { return; print 1; } print f();",
+            "nil",
+        ),
+        (
+            "fun f(a, b) { { if (a > b) { return a; } else return b; } } print f(1, 2); print f(4, 3);",
+            "2\n4",
+        ),
+        (
+            # Closures see the environment they were declared in
+            "var x = 1; fun get() { return x; } x = 2; print get();",
+            "2",
+        ),
+        (
+            "fun outer() { var x = 3; fun inner() { return x; } return inner; } print outer()();",
+            "3",
+        ),
+        (
+            # Parameters shadow globals only inside the call
+            "var a = 1; fun f(a) { a = a + 1; return a; } print f(10); print a;",
+            "11\n1",
+        ),
+        (
+            # Tail calls to natives are ordinary calls
+            'fun f(s) { return len(s); } print f("abc");',
+            "3",
+        ),
+        (
+            "{ var a = 1; { var a = 2; print a; } print a; }",
+            "2\n1",
+        ),
+        (
+            "if (nil) print 1; else if (0) print 2; else print 3;",
+            "2",
+        ),
+    ]
+)
+@pytest.mark.parametrize("interpreter_class", [lox.Interpreter, lox.StackInterpreter])
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_functions(capsys, interpreter_class, parser_class, input_str, expected):
+    lox.Lox(interpreter=interpreter_class(), parser_class=parser_class).run(input_str)
+    captured = capsys.readouterr()
+    assert captured.err == ""
+    assert captured.out == expected + "\n"
+
+
+def test_tail_calls_run_in_constant_stack(capsys):
+    lox.Lox().run("""
+        fun even(n) { if (n < 1) return true; return odd(n - 1); }
+        fun odd(n) { if (n < 1) return false; return even(n - 1); }
+        print even(50000);
+    """)
+    captured = capsys.readouterr()
+    assert captured.err == ""
+    assert captured.out == "true\n"
+
+
+def test_deep_recursion_is_a_runtime_error(capsys):
+    lox.Lox().run("fun f(n) { return 1 + f(n + 1); } f(0);")
+    assert capsys.readouterr().err == "Stack overflow.\n"
+    assert lox.Lox().had_runtime_error
+
+
+@pytest.mark.parametrize(
+    "input_str,message",
+    [
+        ("fun f(a) {} f();", "Expected 1 arguments but got 0 on line 1"),
+        ("fun f(a) { return f(); } f(1);", "Expected 1 arguments but got 0 on line 1"),
+    ]
+)
+def test_call_errors(capsys, input_str, message):
+    lox.Lox().run(input_str)
+    assert capsys.readouterr().err == message + "\n"
+
+
+def test_top_level_return_is_a_parse_error(capsys):
+    lox.Lox().run("return 1;")
+    assert "Can't return from top-level code." in capsys.readouterr().err
+    assert lox.Lox().had_error
+
+
+def test_parse_error_recovery(capsys):
+    statements = lox.Parser(lox.Scanner.scan_str("var = 1; print 2; fun (")).parse()
+    assert "Expect variable name" in capsys.readouterr().err
+    assert statements[0] is None
+    assert isinstance(statements[1], lox.PrintStatement)
@@ -0,0 +1,158 @@
+import lox
+
+import pytest
+
+PRELUDE = """
+var greeting = "hello";
+var counts = [1, 2, 3];
+fun fib(n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); }
+var fastFib = memoize(fib, 16);
+fun makeCounter() {
+  var count = 0;
+  fun counter() { count = count + 1; return count; }
+  return counter;
+}
+var counter = makeCounter();
+counter();
+class Animal {
+  init(name) { this.name = name; }
+  speak() { return this.name + " makes a sound"; }
+}
+class Dog < Animal {
+  speak() { return super.speak() + ", woof"; }
+}
+var dog = Dog("rex");
+var root = clock;
+"""
+
+SCRIPT = """
+print greeting;
+print sum(counts);
+print fib(10);
+print fastFib(20);
+print counter();
+print dog.speak();
+print Dog("fido").speak();
+print root == clock;
+"""
+
+OUTPUT = "hello\n6\n55\n6765\n2\nrex makes a sound, woof\nfido makes a sound, woof\ntrue\n"
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "base.img"
+    lox_ = lox.Lox()
+    lox_.run(PRELUDE)
+    lox_.interpreter.save_image(path)
+    return path
+
+
+def test_round_trip(image, capsys):
+    lox_ = lox.Lox()
+    lox_.interpreter.load_image(image)
+    lox_.run(SCRIPT)
+    assert capsys.readouterr().out == OUTPUT
+    assert not lox.Lox().had_runtime_error
+
+
+def test_symbols_are_interned_again(image, capsys, monkeypatch):
+    # As in a new process, where names are interned in a different order
+    table = lox.SymbolTable()
+    for name in ["this", "super", "init", "dog", "name", "fib", "speak", "x"]:
+        table.intern(name)
+    monkeypatch.setattr(lox, "symbols", table)
+    lox_ = lox.Lox()
+    lox_.interpreter.load_image(image)
+    lox_.run(SCRIPT)
+    assert capsys.readouterr().out == OUTPUT
+
+
+def test_cli(image, tmp_path, capsys):
+    prelude = tmp_path / "prelude.lox"
+    prelude.write_text(PRELUDE)
+    script = tmp_path / "script.lox"
+    script.write_text(SCRIPT)
+    saved = tmp_path / "saved.img"
+    lox.main(["--save-image", str(saved), str(prelude)])
+    lox.main(["--image", str(saved), str(script)])
+    assert capsys.readouterr().out == OUTPUT
+
+
+def test_breakpoints_are_not_saved(tmp_path, capsys):
+    path = tmp_path / "base.img"
+    debugger = lox.Debugger(lambda pause: "continue", {1})
+    lox_ = lox.Lox(interpreter=lox.Interpreter(debugger=debugger))
+    lox_.run("fun f() {\n  return 1;\n}")
+    debugger.set_breakpoint(2)
+    lox_.interpreter.save_image(path)
+
+    interpreter = lox.Interpreter()
+    interpreter.load_image(path)
+    body = interpreter.globals.values[lox.symbols.intern("f")].declaration.body
+    assert type(body[0]) is lox.ReturnStatement
+
+
+def test_natives_must_be_defined(tmp_path):
+    path = tmp_path / "base.img"
+    lox_ = lox.Lox()
+    lox_.define_native("double", 1, lambda x: x * 2)
+    lox_.run("var twice = double;")
+    lox_.interpreter.save_image(path)
+
+    with pytest.raises(lox.ImageError, match="needs the native function 'double'"):
+        lox.Interpreter().load_image(path)
+
+    lox_ = lox.Lox()
+    lox_.define_native("double", 1, lambda x: x * 2)
+    lox_.interpreter.load_image(path)
+    assert lox_.interpreter.evaluate_str("1") == 1
+    assert lox_.interpreter.globals.values[lox.symbols.intern("twice")].name == "double"
+
+
+def test_imported_modules_are_not_run_again(tmp_path, capsys):
+    (tmp_path / "lib.lox").write_text('print "loading";')
+    main = tmp_path / "main.lox"
+    main.write_text('import "lib.lox";')
+    path = tmp_path / "base.img"
+    lox_ = lox.Lox()
+    lox_.run_file(main)
+    lox_.interpreter.save_image(path)
+
+    lox_ = lox.Lox()
+    lox_.interpreter.load_image(path)
+    lox_.run_file(main)
+    assert capsys.readouterr().out == "loading\n"
+
+
+@pytest.mark.parametrize(
+    "damage,message",
+    [
+        (lambda data: data[:10], "too short"),
+        (lambda data: b"NOTANIMG" + data[8:], "isn't an image"),
+        (lambda data: data[:8] + b"\x63\x00" + data[10:], "version 99 image"),
+        (lambda data: data[:-1], "damaged"),
+        (lambda data: data[:-1] + bytes([data[-1] ^ 1]), "damaged"),
+    ],
+)
+def test_invalid_images(damage, message, image):
+    image.write_bytes(damage(image.read_bytes()))
+    with pytest.raises(lox.ImageError, match=message):
+        lox.Interpreter().load_image(image)
+
+
+def test_cli_invalid_image(tmp_path, capsys):
+    path = tmp_path / "base.img"
+    path.write_bytes(b"nonsense")
+    with pytest.raises(SystemExit) as exc:
+        lox.main(["--image", str(path)])
+    assert exc.value.code == 66
+    assert "Can't load image" in capsys.readouterr().err
+
+
+def test_cli_save_image_needs_a_script(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exc:
+        lox.main(["--save-image", str(tmp_path / "saved.img")])
+    assert exc.value.code == 64
+    assert "--save-image needs a script to run" in capsys.readouterr().err
+    assert not (tmp_path / "saved.img").exists()
@@ -0,0 +1,145 @@
+import os
+
+import lox
+
+import pytest
+
+
+def write(path, source):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(source)
+    return path
+
+
+def run(source, path=None, **kwargs):
+    interpreter = lox.Interpreter(importer=lox.Importer(**kwargs))
+    lox.Lox(interpreter=interpreter).run(source, path=path)
+    return interpreter
+
+
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_import(parser_class, tmp_path, capsys):
+    write(tmp_path / "lib.lox", 'fun greet(name) { return "hi " + name; }')
+    main = write(tmp_path / "main.lox", 'import "lib.lox";\nprint greet("lox");')
+    lox.Lox(parser_class=parser_class).run_file(main)
+    assert capsys.readouterr().out == "hi lox\n"
+
+
+def test_modules_run_once(tmp_path, capsys):
+    write(tmp_path / "a.lox", 'print "a"; var a = 1;')
+    write(tmp_path / "b.lox", 'import "a.lox"; print "b";')
+    main = write(tmp_path / "main.lox", 'import "a.lox";\nimport "b.lox";\nimport "a.lox";\nprint a;')
+    interpreter = run(main.read_text(), main)
+    assert capsys.readouterr().out == "a\nb\n1\n"
+    assert interpreter.importer.loaded == {tmp_path / "a.lox", tmp_path / "b.lox"}
+
+
+def test_imports_are_relative_to_the_importing_file(tmp_path, capsys):
+    write(tmp_path / "lib" / "inner.lox", 'print "inner";')
+    write(tmp_path / "lib" / "outer.lox", 'import "inner.lox";')
+    main = write(tmp_path / "main.lox", 'import "lib/outer.lox";')
+    lox.Lox().run_file(main)
+    assert capsys.readouterr().out == "inner\n"
+
+
+def test_search_path(tmp_path, capsys, monkeypatch):
+    write(tmp_path / "shared" / "lib.lox", 'print "shared";')
+    write(tmp_path / "local" / "lib.lox", 'print "local";')
+    monkeypatch.chdir(tmp_path / "local")
+    run('import "lib.lox";', search_path=[tmp_path / "shared"])
+    monkeypatch.chdir(tmp_path)
+    run('import "lib.lox";', search_path=[tmp_path / "shared"])
+    assert capsys.readouterr().out == "local\nshared\n"
+
+
+def test_modules_load_when_the_import_runs(tmp_path, capsys):
+    write(tmp_path / "lib.lox", 'print "loaded"; fun f() { return 1; }')
+    main = write(
+        tmp_path / "main.lox",
+        'fun use() {\n  import "lib.lox";\n  return f();\n}\nprint "start";\nprint use();\nprint use();',
+    )
+    lox.Lox().run_file(main)
+    assert capsys.readouterr().out == "start\nloaded\n1\n1\n"
+
+
+@pytest.mark.parametrize(
+    "files,message",
+    [
+        ({"main.lox": 'import "missing.lox";'}, "Can't find module 'missing.lox' on line 1"),
+        (
+            {"main.lox": 'import "a.lox";', "a.lox": 'import "b.lox";', "b.lox": '\nimport "a.lox";'},
+            "Import cycle a.lox -> b.lox -> a.lox on line 2",
+        ),
+        ({"main.lox": '\nimport "main.lox";'}, "Import cycle main.lox -> main.lox on line 2"),
+        ({"main.lox": 'import "a.lox";', "a.lox": "\nprint 1"}, "Expect ';' after value in a.lox on line 2"),
+        ({"main.lox": 'import "a.lox";', "a.lox": '\n"oops'}, "Unterminated string. in a.lox on line 2"),
+    ],
+)
+def test_import_errors(files, message, tmp_path, capsys):
+    for name, source in files.items():
+        write(tmp_path / name, source)
+    with pytest.raises(SystemExit) as exc:
+        lox.Lox().run_file(tmp_path / "main.lox")
+    assert exc.value.code == 70
+    assert capsys.readouterr().err == message + "\n"
+
+
+def test_import_needs_a_string(capsys):
+    lox.Lox().run("import lib;")
+    assert "Expect module path after 'import'." in capsys.readouterr().err
+    assert lox.Lox().had_error
+
+
+def test_parsed_modules_are_cached(tmp_path, capsys):
+    lib = write(tmp_path / "lib.lox", "print 1;")
+    main = write(tmp_path / "main.lox", 'import "lib.lox";')
+    key = (lib, lox.Scanner, lox.Parser)
+
+    lox.Lox().run_file(main)
+    statements = lox.PARSED_MODULES[key].statements
+    lox.Lox().run_file(main)
+    assert lox.PARSED_MODULES[key].statements is statements
+
+    # Touched, but the same
+    stat = lib.stat()
+    os.utime(lib, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    lox.Lox().run_file(main)
+    assert lox.PARSED_MODULES[key].statements is statements
+
+    write(lib, "print 2;")
+    os.utime(lib, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    lox.Lox().run_file(main)
+    assert lox.PARSED_MODULES[key].statements is not statements
+    assert capsys.readouterr().out == "1\n1\n1\n2\n"
+
+
+def test_breakpoints_in_modules(tmp_path, capsys):
+    write(tmp_path / "lib.lox", 'print "lib";\nprint "second";')
+    main = write(tmp_path / "main.lox", 'import "lib.lox";')
+    lines = []
+
+    def on_pause(pause):
+        lines.append(pause.line)
+        return "continue"
+
+    debugger = lox.Debugger(on_pause, {2})
+    lox.Lox(interpreter=lox.Interpreter(debugger=debugger)).run_file(main)
+    assert lines == [2]
+    assert capsys.readouterr().out == "lib\nsecond\n"
+
+
+def test_runs_get_their_own_copy_of_modules(tmp_path, capsys):
+    lib = write(tmp_path / "lib.lox", 'var a = 1;\nvar b = 2;\nprint "lib";\nif (big) {\n  print "big";\n}')
+    main = write(tmp_path / "main.lox", 'var big = false;\nimport "lib.lox";')
+    pauses = []
+    debugger = lox.Debugger(lambda pause: pauses.append(pause.line) or "continue", {3})
+    lox.Lox(interpreter=lox.Interpreter(debugger=debugger)).run_file(main)
+    coverage = lox.Coverage()
+    lox.Lox(interpreter=lox.Interpreter(coverage=coverage)).run_file(main)
+    # Neither the breakpoints nor the coverage probes are left in the
+    # module for later runs
+    write(main, 'var big = true;\nimport "lib.lox";')
+    lox.Lox().run_file(main)
+    assert pauses == [3]
+    assert coverage.report()[str(lib)] == {1: True, 2: True, 3: True, 4: True, 5: False}
+    assert capsys.readouterr().out == "lib\nlib\nlib\nbig\n"
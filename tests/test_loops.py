@@ -0,0 +1,80 @@
+import lox
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "input_str,expected",
+    [
+        (
+            "var i = 0; while (i < 3) { print i; i = i + 1; }",
+            "0\n1\n2",
+        ),
+        (
+            "for (var i = 0; i < 3; i = i + 1) print i;",
+            "0\n1\n2",
+        ),
+        (
+            # The loop variable is scoped to the loop
+            "var i = 10; for (var i = 0; i < 2; i = i + 1) {} print i;",
+            "10",
+        ),
+        (
+            "var i = 0; for (; i < 2;) i = i + 1; print i;",
+            "2",
+        ),
+        (
+            # Each iteration gets fresh variables, even when reusing a scope
+            "for (var i = 0; i < 3; i = i + 1) { var a; print a; a = i; }",
+            "nil\nnil\nnil",
+        ),
+        (
+            # Closures capture the variables of their own iteration
+            "var f; var g; for (var i = 0; i < 2; i = i + 1) { var j = i; fun h() { return j; }"
+            " if (i == 0) f = h; else g = h; } print f(); print g();",
+            "0\n1",
+        ),
+        (
+            'var s = ""; for (var i = 0; i < 3; i = i + 1) { var t = str(i); s = s + t; } print s;',
+            "012",
+        ),
+        (
+            "fun f() { for (var i = 0; ; i = i + 1) { if (i > 2) return i; } } print f(); print f();",
+            "3\n3",
+        ),
+        (
+            "var n = 0; while (n < 2) { var m = 0; while (m < 2) { n = n + 0.5; m = m + 1; } } print n;",
+            "2",
+        ),
+        (
+            # Only nil and false are falsey
+            'var n = 0; while (n) n = nil; print n; var s = ""; while (s) s = false; print s;',
+            "nil\nfalse",
+        ),
+    ]
+)
+@pytest.mark.parametrize("interpreter_class", [lox.Interpreter, lox.StackInterpreter])
+def test_loops(capsys, interpreter_class, input_str, expected):
+    lox.Lox(interpreter=interpreter_class()).run(input_str)
+    captured = capsys.readouterr()
+    assert captured.err == ""
+    assert captured.out == expected + "\n"
+
+
+def test_loop_scopes():
+    def loop(source):
+        return lox.Parser(lox.Scanner.scan_str(source)).parse()[0]
+
+    plain = loop("while (a) { a = a - 1; }")
+    assert (plain.declares, plain.captures) == (False, False)
+    declares = loop("while (a) { var b = a; a = b - 1; }")
+    assert (declares.declares, declares.captures) == (True, False)
+    captures = loop("while (a) { var b = a; if (b) { fun f() { return b; } } }")
+    assert (captures.declares, captures.captures) == (True, True)
+    assert loop("while (a) a = a - 1;").body_statements == [plain.body.statements[0]]
+
+
+def test_loops_count_against_budget(capsys):
+    interpreter = lox.Interpreter(budget=lox.Budget(max_steps=1000))
+    lox.Lox(interpreter=interpreter).run("while (true) {}")
+    assert "more than 1000 steps" in capsys.readouterr().err
@@ -0,0 +1,136 @@
+import lox
+
+import pytest
+
+
+def run(source):
+    runtime = lox.Lox()
+    runtime.run(source)
+    return runtime
+
+
+def test_memoized_fib(capsys):
+    runtime = run("""
+        fun fib(n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); }
+        var fib = memoize(fib, 100);
+        print fib(60);
+        print cacheMisses(fib);
+        print cacheHits(fib);
+        print fib;
+    """)
+    assert capsys.readouterr().out == "1548008755920\n61\n58\n<memoized <fn fib>>\n"
+    fib = runtime.interpreter.globals.values[lox.symbols.intern("fib")]
+    assert (fib.hits, fib.misses) == (58, 61)
+
+
+def test_cache_is_bounded(capsys):
+    run("""
+        fun square(x) { return x * x; }
+        var square = memoize(square, 2);
+        square(1); square(2); square(3); square(1);
+        print cacheMisses(square);
+    """)
+    assert capsys.readouterr().out == "4\n"
+
+
+def test_arguments_are_keyed_by_type(capsys):
+    run("""
+        fun same(x) { return x; }
+        var same = memoize(same, 10);
+        print same(1); print same(true); print same([1]); print same([1]);
+        print cacheHits(same);
+    """)
+    assert capsys.readouterr().out == "1\ntrue\n[1]\n[1]\n1\n"
+
+
+@pytest.mark.parametrize(
+    "body,reason",
+    [
+        ("print x;", "prints"),
+        ("y = x;", "assigns to non-local variable 'y'"),
+        ("return x + y;", "reads non-local variable 'y'"),
+        ("return clock();", "calls <native fn>, which isn't pure"),
+        ("return g(x);", "calls <fn g>, which prints"),
+        ("return x();", "calls a function that isn't known until it runs"),
+        ("fun h() {} return 1;", "declares a nested function"),
+        ("return nope(x);", "calls undefined 'nope'"),
+    ]
+)
+def test_impure_functions_are_rejected(capsys, body, reason):
+    run(f"""
+        var y = 1;
+        fun f(x) {{ {body} }}
+        fun g(x) {{ print x; }}
+        var f = memoize(f, 10);
+    """)
+    err = capsys.readouterr().err
+    assert f"memoize() needs a pure function, but <fn f> {reason} on line 5" in err
+
+
+def test_pure_functions_are_accepted(capsys):
+    run("""
+        fun helper(x) { return sqrt(x) + 1; }
+        fun f(x) {
+            var total = 0;
+            { var y = helper(x); total = total + y; }
+            if (total > 2) return [total][0];
+            return -total;
+        }
+        var f = memoize(f, 10);
+        print f(4);
+    """)
+    captured = capsys.readouterr()
+    assert captured.err == ""
+    assert captured.out == "3\n"
+
+
+@pytest.mark.parametrize(
+    "call,message",
+    [
+        ("memoize(1, 1)", "memoize() expects a function, got a number"),
+        ("memoize(f, 0)", "cache size must be at least 1"),
+        ("cacheHits(f)", "cacheHits() expects a memoized function"),
+        ("memoize(f, 1)(1, 2)", "Expected 1 arguments but got 2"),
+    ]
+)
+def test_memoize_errors(capsys, call, message):
+    run(f"fun f(x) {{ return x; }} {call};")
+    assert message in capsys.readouterr().err
+
+
+def test_rebound_callees_clear_the_cache(capsys):
+    run("""
+        fun helper(x) { return x + 1; }
+        fun f(x) { return helper(x); }
+        var m = memoize(f, 10);
+        print m(1);
+        fun helper(x) { return x + 100; }
+        print m(1); print f(1);
+        print cacheMisses(m);
+    """)
+    # Counted again from when it was cleared
+    assert capsys.readouterr() == ("2\n101\n101\n1\n", "")
+
+
+def test_rebound_callees_are_checked_again(capsys):
+    run("""
+        fun helper(x) { return x + 1; }
+        fun f(x) { return helper(x); }
+        var m = memoize(f, 10);
+        print m(1);
+        fun helper(x) { print "side effect"; return x; }
+        print m(1);
+    """)
+    captured = capsys.readouterr()
+    assert captured.out == "2\n"
+    assert captured.err == "<memoized <fn f>> is no longer pure, <fn f> calls <fn helper>, which prints on line 7\n"
+
+
+def test_signed_zeros_are_different_arguments(capsys):
+    run("""
+        fun negate(x) { return -x; }
+        var negate = memoize(negate, 10);
+        var zero = 0;
+        print negate(zero); print negate(-zero); print negate(zero);
+    """)
+    assert capsys.readouterr().out == "-0\n0\n-0\n"
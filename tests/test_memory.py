@@ -0,0 +1,53 @@
+import lox
+
+import pytest
+
+# The globals an interpreter starts with
+NATIVES = len(lox.STANDARD_LIBRARY) + len(lox.Interpreter().scheduler.natives())
+
+
+def test_deep_sizeof_counts_shared_objects_once():
+    shared = [1.5, "text"]
+    size, count = lox.deep_sizeof([shared, shared])
+    assert count == 4
+
+    seen = set()
+    lox.deep_sizeof(shared, seen)
+    assert lox.deep_sizeof([shared], seen)[1] == 1
+
+
+def test_run_returns_memory_report(capsys):
+    report = lox.Lox().run('var a = "x"; var b = a + a; print b;', memory=True)
+    assert capsys.readouterr().out == "xx\n"
+
+    assert isinstance(report, lox.MemoryReport)
+    assert report.tokens[0] > 0 and report.tokens[1] > 0
+    assert report.ast[0] > 0 and report.ast[1] > 0
+    assert len(report.environments) == 1
+    # The globals also hold the standard library
+    assert report.environments[0][2] == 2 + NATIVES
+    assert set(report.peaks) == {"scan", "parse", "execute"}
+
+
+def test_token_memory_grows_with_source():
+    small = lox.Lox().run("print 1;", memory=True)
+    large = lox.Lox().run("print 1;" * 100, memory=True)
+    assert large.tokens[0] > small.tokens[0] * 10
+    assert large.ast[0] > small.ast[0] * 10
+
+
+def test_stats_and_memory_together():
+    stats = lox.RunStats()
+    memory = lox.MemoryReport()
+    assert lox.Lox().run("1;", stats, memory) is stats
+    assert stats.token_count == 3
+    assert memory.ast[1] > 0
+
+
+def test_memory_flag(tmp_path, capsys):
+    script = tmp_path / "script.lox"
+    script.write_text("var a = 1;")
+    lox.main(["--memory", str(script)])
+    err = capsys.readouterr().err
+    assert "environment 0" in err
+    assert f"({1 + NATIVES} values)" in err
@@ -0,0 +1,79 @@
+import lox
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "input_str,expected",
+    [
+        ("sqrt(16)", 4),
+        ("floor(2.7) + ceil(2.2)", 5),
+        ("abs(-3)", 3),
+        ("pow(2, 10)", 1024),
+        ("min(3, 4) + max(3, 4)", 7),
+        ('len("hello")', 5),
+        ("len([1, 2, 3])", 3),
+        ('substring("hello", 1, 3)', "el"),
+        ('find("hello", "l")', 2),
+        ('find("hello", "z")', -1),
+        ('num("2.5") * 2', 5),
+        ('num("nope")', None),
+        ('str(2.5) + str(3) + str(nil)', "2.53nil"),
+        ("fixed(3.14159, 2)", "3.14"),
+        ("sum([1, 2, 3])", 6),
+        ("amin([3, 1, 2]) + amax([3, 1, 2])", 4),
+        ("sum(fill(4, 0.5))", 2),
+    ]
+)
+@pytest.mark.parametrize("interpreter_class", [lox.Interpreter, lox.StackInterpreter])
+def test_standard_library(interpreter_class, input_str, expected):
+    assert interpreter_class.evaluate_str(input_str) == expected
+
+
+@pytest.mark.parametrize(
+    "input_str,message",
+    [
+        ("sqrt()", "Expected 1 arguments but got 0 on line 1"),
+        ("len(1, 2)", "Expected 1 arguments but got 2"),
+        ("len(1)", "len() expects a string or an array, got a number on line 1"),
+        ('substring("abc", 2, 1)', "out of bounds"),
+        ('substring("abc", 0.5, 1)', "whole number"),
+        ("sqrt(-1)", "negative"),
+        ("amin([])", "amin() of an empty array"),
+        ('"a"()', "Can only call functions"),
+        ("nil()", "Can only call functions"),
+    ]
+)
+def test_native_errors(input_str, message):
+    with pytest.raises(Exception) as exc:
+        lox.Interpreter.evaluate_str(input_str)
+    assert message in str(exc.value)
+
+
+def test_clock_advances():
+    interpreter = lox.Interpreter()
+    first = interpreter.evaluate(lox.Parser.parse_str("clock();")[0].expression)
+    second = interpreter.evaluate(lox.Parser.parse_str("clock();")[0].expression)
+    assert type(first) is float and second >= first
+
+
+def test_define_native(capsys):
+    runtime = lox.Lox()
+    runtime.define_native("twice", 1, lambda x: x * 2)
+    runtime.run("var f = twice; print f(21); print twice;")
+    assert capsys.readouterr().out == "42\n<native fn>\n"
+
+
+def test_natives_are_not_environments():
+    calls = []
+    interpreter = lox.Interpreter()
+    interpreter.define_native("probe", 0, lambda: calls.append(interpreter.environment))
+    lox.Lox(interpreter=interpreter).run("probe();")
+    assert calls == [interpreter.globals]
+
+
+def test_natives_are_globals():
+    outer = lox.Environment()
+    interpreter = lox.Interpreter(lox.Environment(enclosing=outer))
+    assert interpreter.globals is outer
+    assert lox.symbols.intern("len") in outer.values
@@ -0,0 +1,106 @@
+import lox
+
+import pytest
+
+
+def optimize(source):
+    statements = lox.Parser.parse_str(source)
+    return lox.Optimizer().optimize(statements)
+
+
+@pytest.mark.parametrize(
+    "input_str,expected",
+    [
+        # Dead stores and unused variables disappear entirely
+        (
+            'var a = 1; var b = 2; print a;',
+            [lox.PrintStatement(lox.LiteralExpr(1))],
+        ),
+        (
+            'var a = 1; a = 2; a = 3; print a;',
+            [lox.PrintStatement(lox.LiteralExpr(3))],
+        ),
+        # Copies are propagated, which makes the copy itself dead
+        (
+            'var a = 1 + 2; var b = a; var c = b; print c + c;',
+            [lox.PrintStatement(lox.LiteralExpr(6))],
+        ),
+        # Strings are built at runtime, where a Budget can count them
+        (
+            'var a = "x"; print a + a;',
+            [lox.PrintStatement(lox.BinaryExpr(lox.LiteralExpr("x"), lox.Token(lox.Plus()), lox.LiteralExpr("x")))],
+        ),
+        # Unobserved computations are dropped
+        (
+            '1 + 2; "foo" == "bar"; print 3;',
+            [lox.PrintStatement(lox.LiteralExpr(3))],
+        ),
+    ]
+)
+def test_optimize(input_str, expected):
+    assert optimize(input_str) == expected
+
+
+@pytest.mark.parametrize(
+    "input_str",
+    [
+        # Reads of undefined variables must still fail
+        'var a = b; print 1;',
+        'print 1; undefined;',
+        'b = 1; var b = 2;',
+        # As must operators that fail at runtime
+        'var a = 1 - "a"; print 2;',
+        'var a = 1 / 0; print 2;',
+        'var a = -"a"; print 2;',
+    ]
+)
+def test_errors_are_kept(capsys, input_str):
+    lox.Lox().run(input_str)
+    expected = capsys.readouterr()
+
+    lox.Lox(optimize=True).run(input_str)
+    actual = capsys.readouterr()
+    # Besides any warnings from TypeInference about the operators
+    errors = [line for line in actual.err.splitlines(True) if "] Warning: " not in line]
+    assert (actual.out, "".join(errors)) == expected
+    assert actual.err != ""
+
+
+@pytest.mark.parametrize(
+    "input_str",
+    [
+        'var a = 1; var b = a; a = 2; print b; print a;',
+        'var a; var b = a == nil; print b;',
+        'var a = 1; var b = (a = 2) + a; print a; print b;',
+        'var s = "a"; s = s + s; s = s + s; print s;',
+        # Calls can read any global
+        'var a = 1; fun f() { print a; } a = 2; f();',
+        'fun g() { return h; } var h = 1; print -g();',
+        'var a = 1; fun f() { return a; } a = 2; var b = f(); print b;',
+        'var a = 1; class C { m() { print a; } } a = 3; C().m();',
+        'var a = 1; class C { m() { return a; } } var c = C(); a = 4; print c.m();',
+    ]
+)
+def test_output_is_unchanged(capsys, input_str):
+    lox.Lox().run(input_str)
+    expected = capsys.readouterr()
+
+    lox.Lox(optimize=True).run(input_str)
+    assert capsys.readouterr() == expected
+
+
+def test_existing_globals_are_defined():
+    statements = lox.Parser.parse_str('var b = a; print 1;')
+    optimized = lox.Optimizer(defined={lox.symbols.intern("a")}).optimize(statements)
+    assert optimized == [lox.PrintStatement(lox.LiteralExpr(1))]
+
+
+def test_blocks_are_barriers():
+    parse = lox.Parser.parse_str
+    statements = (
+        parse('var a = 1; var b = 2;')
+        + [lox.BlockStatement(parse('a = b;'))]
+        + parse('print a;')
+    )
+    optimized = lox.Optimizer().optimize(statements)
+    assert optimized == statements
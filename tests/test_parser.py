@@ -48,11 +48,48 @@ import pytest
                 lox.LiteralExpr(True),
             )
         ),
+        ('[1, 2][0]',
+            lox.IndexExpr(
+                lox.ArrayExpr(
+                    lox.Token(lox.LeftBracket()),
+                    [lox.LiteralExpr(1), lox.LiteralExpr(2)],
+                ),
+                lox.Token(lox.LeftBracket()),
+                lox.LiteralExpr(0),
+            )
+        ),
         # TODO: I guess idents aren't here yet
         #('some_ident', lox.LiteralExpr(False)),
     ]
 )
-def test_parse_expression(input_str, expected):
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_parse_expression(parser_class, input_str, expected):
     scanner = lox.Scanner(input_str)
-    parser = lox.Parser(scanner.scan_tokens())
+    parser = parser_class(scanner.scan_tokens())
     assert parser.expression() == expected
+
+
+@pytest.mark.parametrize(
+    "input_str",
+    [
+        "print 1 - 2 - 3;",
+        "print 1 / 2 * 3 + 4 - 5;",
+        "print !!true == !false;",
+        "print -1 - -2 * --3;",
+        "print 1 < 2 == 3 >= 4 != 5 <= 6 > 7;",
+        "var a = 1; var b; a = b = (a + 2) * 3;",
+        'print ("foo" + "bar") == "foobar";',
+        "a + 1;",
+        "print [1, 2 + 3, [4][0]];",
+        "print -a[1][b = 2] * [][0];",
+        "print f(1)(2, g())[3] - (h)();",
+        "fun f(a, b) { if (a) return b(a); else { return; } } f(1, f);",
+        "for (var i = 0; i < 3; i = i + 1) while (i) { print i; }",
+        "for (;;) {} for (a = 1; ; ) print a;",
+        "class A < B { init(a) { this.a = -a.b(c).d = 1; } m() { return super.m()[0]; } }",
+    ]
+)
+@pytest.mark.parametrize("parser_class", [lox.PrattParser, lox.StackParser])
+def test_parser_matches_recursive_descent(parser_class, input_str):
+    expected = lox.Parser(lox.Scanner.scan_str(input_str)).parse()
+    assert parser_class(lox.Scanner.scan_str(input_str)).parse() == expected
@@ -310,10 +310,20 @@ def test_format_ast():
     assert lox.format_ast(
         lox.BinaryExpr(
             lox.UnaryExpr(
-                lox.Token(lox.Minus, "-", None, 1),
+                lox.Token(lox.Minus(), "-", None, 1),
                 lox.LiteralExpr(123),
             ),
-            lox.Token(lox.Star, "*", None, 1),
+            lox.Token(lox.Star(), "*", None, 1),
             lox.GroupingExpr(lox.LiteralExpr(45.67)),
         )
     ) == "(* (- 123) (group 45.67))"
+
+
+def test_identifiers_are_interned():
+    tokens = lox.Scanner.scan_str("foo bar foo print")
+    foo, bar, foo_again, keyword, _ = tokens
+    assert foo.symbol == foo_again.symbol == lox.symbols.intern("foo")
+    assert bar.symbol != foo.symbol
+    assert lox.symbols.name(bar.symbol) == "bar"
+    assert keyword.symbol is None
+    assert keyword.token_type is lox.KEYWORDS["print"]
@@ -0,0 +1,53 @@
+import lox
+
+import pytest
+
+
+def test_run_returns_stats(capsys):
+    stats = lox.Lox().run("var a = 1; print a + a;", stats=True)
+    assert capsys.readouterr().out == "2\n"
+
+    assert stats.token_count == 11
+    assert stats.statement_count == 2
+    assert stats.node_counts == {
+        "VariableStatement": 1,
+        "PrintStatement": 1,
+        "LiteralExpr": 1,
+        "BinaryExpr": 1,
+        "VariableExpr": 2,
+    }
+    assert set(stats.wall_times) == set(stats.cpu_times) == {"scan", "parse", "execute"}
+    assert stats.lookups == 2
+    assert stats.average_lookup_depth == 0
+
+
+def test_run_without_stats():
+    assert lox.Lox().run("1;") is None
+
+
+def test_lookup_depth():
+    stats = lox.RunStats()
+    outer = lox.Environment()
+    interpreter = lox.Interpreter(lox.Environment(enclosing=outer), stats=stats)
+    name = lox.Scanner.scan_str("depth_test")[0]
+    outer.define(name, 1.0)
+    assert interpreter.evaluate(lox.VariableExpr(name)) == 1.0
+    assert (stats.lookups, stats.lookup_depth) == (1, 1)
+
+
+def test_stats_flag(tmp_path, capsys):
+    script = tmp_path / "script.lox"
+    script.write_text("print 1 + 2;")
+    lox.main(["--stats", str(script)])
+    captured = capsys.readouterr()
+    assert captured.out == "3\n"
+    assert "tokens      6" in captured.err
+    assert "execute" in captured.err
+
+
+def test_stats_printed_on_error(tmp_path, capsys):
+    script = tmp_path / "script.lox"
+    script.write_text("print missing;")
+    with pytest.raises(SystemExit):
+        lox.main(["--stats", str(script)])
+    assert "lookups     1" in capsys.readouterr().err
@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+
+import lox
+
+import pytest
+
+PIPELINE = """
+var jobs = channel(2);
+fun producer() {
+  for (var i = 1; i <= 5; i = i + 1) {
+    send(jobs, i);
+  }
+  close(jobs);
+}
+fun consumer() {
+  var total = 0;
+  var job = receive(jobs);
+  while (job != nil) {
+    total = total + job * job;
+    job = receive(jobs);
+  }
+  return total;
+}
+spawn(producer);
+print join(spawn(consumer));
+"""
+
+
+def run(source, parser_class=lox.Parser, **kwargs):
+    interpreter = lox.Interpreter(**kwargs)
+    lox.Lox(interpreter=interpreter, parser_class=parser_class).run(source)
+    return interpreter
+
+
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_pipeline(parser_class, capsys):
+    interpreter = run(PIPELINE, parser_class)
+    assert capsys.readouterr().out == "55\n"
+    assert not lox.Lox().had_runtime_error
+    assert interpreter.execute == interpreter.execute_statement
+
+
+def test_switches_wake_only_the_next_thread(capsys):
+    # Waking every green thread on each switch takes minutes for this many
+    start = time.perf_counter()
+    run("""
+    var results = channel(1);
+    fun worker() { send(results, 1); }
+    for (var i = 0; i < 1000; i = i + 1) spawn(worker);
+    var total = 0;
+    for (var i = 0; i < 1000; i = i + 1) total = total + receive(results);
+    print total;
+    """)
+    assert capsys.readouterr().out == "1000\n"
+    assert time.perf_counter() - start < 10
+
+
+def test_many_threads_alive_at_once(capsys):
+    # Each green thread holds an OS thread until it finishes
+    before = threading.active_count()
+    counts = []
+    runtime = lox.Lox()
+    runtime.define_native("countThreads", 0, lambda: counts.append(threading.active_count()))
+    runtime.run("""
+    var gate = channel(1);
+    var done = channel(1);
+    fun worker() { receive(gate); send(done, 1); }
+    for (var i = 0; i < 5000; i = i + 1) spawn(worker);
+    countThreads();
+    close(gate);
+    var total = 0;
+    for (var i = 0; i < 5000; i = i + 1) total = total + receive(done);
+    print total;
+    """)
+    assert capsys.readouterr().out == "5000\n"
+    assert counts == [before + 5000]
+    for thread in threading.enumerate():
+        if thread.name.startswith("lox <fn"):
+            thread.join()
+    assert threading.active_count() == before
+
+
+def test_channels_are_bounded(capsys):
+    run("""
+    var ch = channel(2);
+    fun fill() {
+      for (var i = 0; i < 3; i = i + 1) {
+        send(ch, i);
+        print "sent " + str(i);
+      }
+    }
+    spawn(fill);
+    print "receiving " + str(receive(ch));
+    """)
+    assert capsys.readouterr().out == "sent 0\nsent 1\nreceiving 0\nsent 2\n"
+
+
+@pytest.mark.parametrize(
+    "time_slice,output",
+    [
+        (lox.TIME_SLICE, "a0\na1\na2\nb0\nb1\nb2\n"),
+        # Switching before every statement
+        (1, "a0\nb0\na1\nb1\na2\nb2\n"),
+    ],
+)
+def test_time_slice(time_slice, output, capsys):
+    interpreter = lox.Interpreter()
+    interpreter.scheduler.time_slice = time_slice
+    lox.Lox(interpreter=interpreter).run("""
+    fun count(name) {
+      fun run() {
+        for (var i = 0; i < 3; i = i + 1) print name + str(i);
+      }
+      return run;
+    }
+    spawn(count("a"));
+    spawn(count("b"));
+    """)
+    assert capsys.readouterr().out == output
+
+
+def test_methods(capsys):
+    run("""
+    class Counter {
+      init() { this.count = 0; }
+      run() { this.count = this.count + 1; return this.count; }
+    }
+    var counter = Counter();
+    print join(spawn(counter.run)) + join(spawn(counter.run));
+    """)
+    assert capsys.readouterr().out == "3\n"
+
+
+@pytest.mark.parametrize(
+    "source,message",
+    [
+        ("var ch = channel(1);\nsend(ch, 1);\nsend(ch, 2);", "Deadlock: every green thread is waiting on line 3"),
+        ("var ch = channel(1);\nfun f() {\n  receive(ch);\n}\njoin(spawn(f));", "Deadlock: every green thread is waiting on line 3"),
+        ("var ch = channel(1);\nfun f() {\n  receive(ch);\n}\nspawn(f);", "Deadlock: every green thread is waiting on line 3"),
+        ("var ch = channel(1);\nclose(ch);\nsend(ch, 1);", "send() on a closed channel on line 3"),
+        ("fun f() {\n  print nope;\n}\nspawn(f);\nsleep(1);", "Undefined variable nope."),
+        ("spawn(1);", "spawn() expects a function, got a number on line 1"),
+        ("fun f(a) {}\nspawn(f);", "spawn() expects a function with no parameters, but <fn f> has 1 on line 2"),
+        ("channel(0);", "channel() capacity must be at least 1 on line 1"),
+        ("receive(1);", "receive() expects a channel, got a number on line 1"),
+        ("join(nil);", "join() expects a green thread, got nil on line 1"),
+    ],
+)
+def test_errors(source, message, capsys):
+    before = threading.active_count()
+    interpreter = run(source)
+    assert capsys.readouterr().err == message + "\n"
+    assert lox.Lox().had_runtime_error
+    # Whatever was left running has been stopped
+    assert threading.active_count() == before
+    assert interpreter.execute == interpreter.execute_statement
+    assert not interpreter.scheduler.live
+
+
+def test_errors_leave_the_environment(capsys):
+    interpreter = run("var ch = channel(1);\nfun f() {\n  var a = 1;\n  receive(ch);\n}\nspawn(f);\nnope;")
+    assert interpreter.environment is interpreter.globals
+    lox.Lox(interpreter=interpreter).run("print 1;")
+    assert capsys.readouterr().out == "1\n"
+
+
+def test_asynchronous_natives_overlap(tmp_path, capsys):
+    for name in ["a", "b", "c"]:
+        (tmp_path / f"{name}.txt").write_text(name * 3)
+
+    async def read(path):
+        await asyncio.sleep(0.2)
+        return await asyncio.to_thread((tmp_path / path).read_text)
+
+    lox_ = lox.Lox()
+    lox_.define_native("read", 1, read)
+    start = time.perf_counter()
+    lox_.run("""
+    var results = channel(3);
+    fun reader(path) {
+      fun run() { send(results, read(path)); }
+      return run;
+    }
+    spawn(reader("a.txt"));
+    spawn(reader("b.txt"));
+    spawn(reader("c.txt"));
+    var got = "";
+    for (var i = 0; i < 3; i = i + 1) got = got + receive(results);
+    print len(got);
+    """)
+    assert time.perf_counter() - start < 0.5
+    assert capsys.readouterr().out == "9\n"
+
+
+def test_sleep(capsys):
+    run("""
+    fun later() { sleep(0.05); print "later"; }
+    spawn(later);
+    print "first";
+    """)
+    assert capsys.readouterr().out == "first\nlater\n"
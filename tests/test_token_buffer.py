@@ -0,0 +1,76 @@
+import lox
+
+import pytest
+
+SOURCE = '''// leading comment
+var greeting = "hello
+world";
+print greeting + "!" ;  // trailing
+var n = 12.5 * (3 - 1);
+print n >= 25 == !false;
+'''
+
+
+def test_matches_scanner():
+    expected = lox.Scanner.scan_str(SOURCE)
+    buffer = lox.BufferScanner.scan_str(SOURCE)
+    assert isinstance(buffer, lox.TokenBuffer)
+    assert len(buffer) == len(expected)
+    for result, token in zip(buffer, expected):
+        for attr in ("token_type", "lexeme", "literal", "line"):
+            assert getattr(result, attr) == getattr(token, attr)
+        assert result == token
+
+
+def test_columns():
+    buffer = lox.BufferScanner.scan_str("var a;\n  print a;")
+    assert [(token.line, token.column) for token in buffer] == [
+        (1, 1), (1, 5), (1, 6), (2, 3), (2, 9), (2, 10), (2, 11),
+    ]
+
+
+def test_only_literals_are_stored():
+    buffer = lox.BufferScanner.scan_str('print "a" + 1 + b;')
+    assert buffer.literals == {1: "a", 3: 1}
+
+
+def test_negative_index():
+    buffer = lox.BufferScanner.scan_str("1 + 2")
+    assert buffer[-1].token_type == lox.EndOfFile()
+    with pytest.raises(IndexError):
+        buffer[len(buffer)]
+
+
+@pytest.mark.parametrize("parser_class", [lox.Parser, lox.PrattParser, lox.StackParser])
+def test_parser_consumes_buffer(parser_class):
+    expected = parser_class(lox.Scanner.scan_str(SOURCE)).parse()
+    assert parser_class(lox.BufferScanner.scan_str(SOURCE)).parse() == expected
+
+
+def test_run_with_buffer(capsys):
+    lox.Lox(scanner_class=lox.BufferScanner).run(SOURCE)
+    captured = capsys.readouterr()
+    assert captured.err == ""
+    assert captured.out == "hello\nworld!\ntrue\n"
+
+
+def test_symbols():
+    buffer = lox.BufferScanner.scan_str("var a = a + b;")
+    assert [token.symbol for token in buffer] == [
+        None,
+        lox.symbols.intern("a"),
+        None,
+        lox.symbols.intern("a"),
+        None,
+        lox.symbols.intern("b"),
+        None,
+        None,
+    ]
+
+
+def test_lines_in_any_order():
+    expected = [token.line for token in lox.Scanner.scan_str(SOURCE)]
+    buffer = lox.BufferScanner.scan_str(SOURCE)
+    indexes = list(range(len(buffer)))
+    for order in (indexes, indexes[::-1], indexes[::2] + indexes[1::2]):
+        assert [buffer.line(index) for index in order] == [expected[index] for index in order]
@@ -0,0 +1,130 @@
+from dataclasses import fields
+
+import lox
+
+import pytest
+
+T = lox.LoxType
+
+
+def infer(source, defined=()):
+    statements = lox.Parser.parse_str(source)
+    inference = lox.TypeInference(defined={lox.symbols.intern(name) for name in defined})
+    inference.specialize(statements)
+    types = {lox.symbols.name(symbol): value for symbol, value in inference.types.items()}
+    return statements, types, inference.warnings
+
+
+def operators(statements):
+    """
+    The type names of the operator expressions in statements, in order.
+    """
+    found = []
+
+    def visit(node):
+        if isinstance(node, (lox.UnaryExpr, lox.BinaryExpr)):
+            found.append(type(node).__name__)
+        if isinstance(node, list):
+            for item in node:
+                visit(item)
+        elif isinstance(node, (lox.Expr, lox.Statement)):
+            for field in fields(node):
+                visit(getattr(node, field.name))
+
+    visit(statements)
+    return found
+
+
+@pytest.mark.parametrize(
+    "source,expected",
+    [
+        ("var a = 1; var b = a * 2; var c = b > a;", {"a": T.NUMBER, "b": T.NUMBER, "c": T.BOOLEAN}),
+        ('var s = "a"; s = s + "b";', {"s": T.STRING}),
+        ("var n; var m = nil;", {"n": T.NIL, "m": T.NIL}),
+        ("var a = 1; a = true;", {"a": T.UNKNOWN}),
+        ("for (var i = 0; i < 3; i = i + 1) {}", {"i": T.NUMBER}),
+        # Every declaration of a name counts, in any scope
+        ('var a = 1; { var a = "s"; }', {"a": T.UNKNOWN}),
+        ("var a = 1; fun f(a) {}", {"a": T.UNKNOWN, "f": T.UNKNOWN}),
+        # Read before they're declared, in a function declared first
+        ("fun f() { return a + b; } var a = 1; var b = a;", {"a": T.NUMBER, "b": T.NUMBER, "f": T.UNKNOWN}),
+        ("var a = clock; var b = clock();", {"a": T.UNKNOWN, "b": T.UNKNOWN, "clock": T.UNKNOWN}),
+        ("var a = [1, 2]; var b = a[0];", {"a": T.UNKNOWN, "b": T.NUMBER}),
+        ('var a = 1; import "lib.lox";', {"a": T.UNKNOWN}),
+    ],
+)
+def test_types(source, expected):
+    types = infer(source)[1]
+    assert {name: types[name] for name in expected} == expected
+
+
+@pytest.mark.parametrize(
+    "source,expected",
+    [
+        ("var a = 1; print a - 2; print -a; print a == 1;", ["TypedBinaryExpr", "TypedUnaryExpr", "TypedBinaryExpr"]),
+        ('var s = "a"; print s + s; print s == "a";', ["ConcatExpr", "TypedBinaryExpr"]),
+        ("var b = true; print !b; print !1;", ["TypedUnaryExpr", "UnaryExpr"]),
+        # The generic path for anything that might not be a number
+        ("fun f(x) { return x + 1; }", ["BinaryExpr"]),
+        ("var a = [1]; print a * 2; print a[0] * 2;", ["BinaryExpr", "TypedBinaryExpr"]),
+        ('var a = 1; print a + "s"; print a == "s";', ["BinaryExpr", "BinaryExpr"]),
+        ('var a = 1; print a + 1; import "lib.lox";', ["BinaryExpr"]),
+    ],
+)
+def test_specialized(source, expected):
+    assert operators(infer(source)[0]) == expected
+
+
+def test_defined_names_could_be_anything():
+    statements, types, _ = infer("var a = 1; print a + b;", defined=["a", "b"])
+    assert types["a"] == T.UNKNOWN
+    assert operators(statements) == ["BinaryExpr"]
+
+
+@pytest.mark.parametrize(
+    "source,warnings",
+    [
+        ('print "a" - 1;', [(1, "Operand '-' always fails between a string and a number.")]),
+        ("var a = nil;\nprint a < 1;", [(2, "Operand '<' always fails between nil and a number.")]),
+        ('var s = "a";\nprint -s;', [(2, "Operand '-' always fails on a string.")]),
+        ('var s = "a";\nprint s == 1; print !s;', []),
+        ("fun f(x) { return x - 1; }", []),
+    ],
+)
+def test_warnings(source, warnings):
+    assert infer(source)[2] == warnings
+
+
+PROGRAMS = [
+    "var total = 0;\nfor (var i = 0; i < 10; i = i + 1) total = total + i * i;\nprint total;",
+    'var s = "";\nfor (var i = 0; i < 3; i = i + 1) s = s + "ab";\nprint s; print s == "ababab";',
+    "var a = 3; var b = 4;\nprint -a; print a / b; print a >= b; print !(a < b); print a != b;",
+    "fun sq(x) { return x * x; }\nvar n = 5;\nprint sq(n) + n;",
+    "var a = [1, 2, 3];\nvar i = 1;\nprint a[i] * 2; print a * 2;",
+]
+
+
+@pytest.mark.parametrize("source", PROGRAMS)
+@pytest.mark.parametrize("interpreter_class", [lox.Interpreter, lox.StackInterpreter])
+def test_same_results(source, interpreter_class, capsys):
+    lox.Lox(interpreter=interpreter_class()).run(source)
+    expected = capsys.readouterr()
+    lox.Lox(interpreter=interpreter_class(), optimize=True).run(source)
+    assert capsys.readouterr() == expected
+    assert expected.err == ""
+
+
+def test_warnings_are_reported(capsys):
+    lox.Lox(optimize=True).run('print 1;\nif (false) print "a" - 1;')
+    captured = capsys.readouterr()
+    assert captured.out == "1\n"
+    assert captured.err == "[line 2] Warning: Operand '-' always fails between a string and a number.\n"
+    assert not lox.Lox().had_error
+
+
+def test_budget_counts_concatenation(capsys):
+    budget = lox.Budget(max_string_length=10)
+    source = 'var s = "";\nwhile (true) s = s + "abc";'
+    lox.Lox(interpreter=lox.Interpreter(budget=budget), optimize=True).run(source)
+    assert "more than 10 string characters" in capsys.readouterr().err
+    assert lox.Lox().had_budget_error